@@ -0,0 +1,269 @@
+import os
+import json
+import uuid
+from hashcache import digest_cache
+from worker import check_cancel
+from linking import link_file, detach_symlinked_dirs
+from copyengine import BatchCopier, remove_file, rmtree
+from vpk import is_vpk, same_vpk
+import tracing
+
+ADD = 'add'
+REPLACE = 'replace'
+DELETE = 'delete'
+UNCHANGED = 'unchanged'
+PROFILE_FOLDERS = ('cfg', 'custom')
+# Both live inside the tf folder so staged files are on the same filesystem and
+# can be swapped in with os.replace
+STAGING_DIR = '.tf2cm-staging'
+JOURNAL_FILE = '.tf2cm-journal.json'
+
+def format_size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.0f} {unit}" if unit == 'B' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+class ApplyPlan:
+    """What applying a profile will do to the tf folder, worked out from digests.
+
+    Each op is (action, relpath, size, stat signature of the tf file when planned).
+    """
+    def __init__(self, profile_path, tf2_dir):
+        self.profile_path = profile_path
+        self.tf2_dir = tf2_dir
+        self.ops = []
+        self.settled = False
+
+    def add(self, action, relpath, size, sig=None):
+        self.ops.append((action, relpath, size, sig))
+
+    def settle(self):
+        """Re-plan unchanged files whose stat signature moved since planning as replaces.
+
+        From then on execute_plan() changes exactly self.changes, so a snapshot
+        taken of them covers every tf file the apply overwrites. Settling twice
+        changes nothing the second time.
+        """
+        if self.settled:
+            return
+        ops = []
+        for action, relpath, size, sig in self.ops:
+            if action == UNCHANGED and not _sig_holds(os.path.join(self.tf2_dir, relpath), sig):
+                action = REPLACE
+            ops.append((action, relpath, size, sig))
+        self.ops = ops
+        self.settled = True
+
+    def count(self, action):
+        return sum(1 for op in self.ops if op[0] == action)
+
+    @property
+    def changes(self):
+        return [op for op in self.ops if op[0] != UNCHANGED]
+
+    @property
+    def bytes_to_copy(self):
+        return sum(op[2] for op in self.ops if op[0] in (ADD, REPLACE))
+
+    def summary(self):
+        return (f"{self.count(ADD)} to add, {self.count(REPLACE)} to replace, "
+                f"{self.count(DELETE)} to delete, {self.count(UNCHANGED)} unchanged "
+                f"({format_size(self.bytes_to_copy)} to copy)")
+
+def _stat_sig(st):
+    return (st.st_size, st.st_mtime_ns)
+
+def _cache_files(tf2_dir):
+    for folder in PROFILE_FOLDERS:
+        for root, _, files in os.walk(os.path.join(tf2_dir, folder)):
+            for fname in files:
+                if fname.endswith('.cache'):
+                    yield os.path.relpath(os.path.join(root, fname), tf2_dir).replace(os.sep, '/')
+
+def _known_same(tf_path, st, profile_file, digest, algorithm):
+    """Whether tf_path holds digest as far as the digest cache knows, or None if it has to be hashed."""
+    cached = digest_cache.lookup(tf_path, st, algorithm)
+    if cached is not None:
+        return cached == digest
+    # A .vpk the digest cache does not know is compared by directory tree, reading only its header
+    return same_vpk(tf_path, profile_file) if is_vpk(tf_path) else None
+
+@tracing.timed('plan')
+def plan_apply(profile_path, manifest, tf2_dir, prev_manifest=None, cancel=None):
+    """Diff a profile manifest against the tf folder without changing anything.
+
+    Files only the previous profile had are deleted, the new profile's files are
+    added or replaced where the tf copy is missing or differs, and identical
+    files are left alone. .cache files are dropped once anything changes so the
+    game rebuilds them. Same-sized tf files the digest cache does not know are
+    hashed together at the end, on the hash_workers pool.
+    """
+    plan = ApplyPlan(profile_path, tf2_dir)
+    algorithm = manifest['algorithm']
+    files = manifest['files']
+    unhashed = []  # (relpath, manifest entry, stat) of same-sized files with no cached digest
+    if prev_manifest:
+        for relpath in prev_manifest['files']:
+            if relpath not in files:
+                try:
+                    st = os.stat(os.path.join(tf2_dir, relpath))
+                except OSError:
+                    continue
+                plan.add(DELETE, relpath, st.st_size, _stat_sig(st))
+    for relpath, entry in files.items():
+        check_cancel(cancel)
+        if relpath.endswith('.cache'):
+            continue
+        tf_path = os.path.join(tf2_dir, relpath)
+        tracing.count('files_stat')
+        try:
+            st = os.stat(tf_path)
+        except OSError:
+            plan.add(ADD, relpath, entry['size'])
+            continue
+        same = st.st_size == entry['size'] and _known_same(tf_path, st, os.path.join(profile_path, relpath),
+                                                           entry['digest'], algorithm)
+        if same is None:
+            unhashed.append((relpath, entry, st))
+        else:
+            plan.add(UNCHANGED if same else REPLACE, relpath, entry['size'], _stat_sig(st))
+    digests = digest_cache.digest_many([os.path.join(tf2_dir, relpath) for relpath, _, _ in unhashed], algorithm, cancel)
+    for (relpath, entry, st), digest in zip(unhashed, digests):
+        plan.add(UNCHANGED if digest == entry['digest'] else REPLACE, relpath, entry['size'], _stat_sig(st))
+    if plan.changes:
+        for relpath in _cache_files(tf2_dir):
+            try:
+                plan.add(DELETE, relpath, os.path.getsize(os.path.join(tf2_dir, relpath)))
+            except OSError:
+                continue
+    digest_cache.save()
+    return plan
+
+def _write_journal(tf2_dir, journal):
+    path = os.path.join(tf2_dir, JOURNAL_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _sig_holds(path, sig):
+    try:
+        return _stat_sig(os.stat(path)) == sig
+    except OSError:
+        return False
+
+def _pending_ops(plan):
+    ops = []
+    for action, relpath, size, sig in plan.ops:
+        if action == UNCHANGED:
+            if plan.settled or _sig_holds(os.path.join(plan.tf2_dir, relpath), sig):
+                continue
+            action = REPLACE
+        ops.append([action, relpath])
+    return ops
+
+@tracing.timed('apply')
+def execute_plan(plan, strategy='auto', progress=None, cancel=None):
+    """Carry out the non-unchanged operations of a plan as one transaction.
+
+    New files are first copied into a staging directory inside the tf folder
+    while the journal says 'staging'; an interruption there leaves tf untouched.
+    The journal then switches to 'committing' and every change becomes a
+    rename: the old file moves into the staging area and the staged file
+    replaces it. recover_apply() finishes or undoes an interrupted apply.
+    A file planned as unchanged is still copied if its stat signature moved since
+    planning, unless the plan was settle()d, which already re-planned those.
+    Staged files are reflinked or hardlinked instead of copied where the strategy allows.
+    progress(files, bytes) follows the staging copies, and cancel is honoured up
+    to the commit, rolling the apply back.
+    """
+    ops = _pending_ops(plan)
+    if not ops:
+        return
+    tf2_dir = plan.tf2_dir
+    recover_apply(tf2_dir)
+    detach_symlinked_dirs(tf2_dir, [relpath for _, relpath in ops], strategy)
+    staging = os.path.join(tf2_dir, STAGING_DIR, uuid.uuid4().hex)
+    os.makedirs(os.path.join(staging, 'new'))
+    os.makedirs(os.path.join(staging, 'old'))
+    journal = {'state': 'staging', 'staging': os.path.basename(staging), 'ops': ops}
+    _write_journal(tf2_dir, journal)
+    copier = BatchCopier(lambda src, dst: link_file(src, dst, strategy), progress=progress, cancel=cancel)
+    try:
+        for i, (action, relpath) in enumerate(ops):
+            if action != DELETE:
+                copier.add(os.path.join(plan.profile_path, relpath), os.path.join(staging, 'new', str(i)))
+        copier.finish()
+    except BaseException:
+        copier.abort()
+        try:
+            copier.finish()
+        except BaseException:
+            pass
+        recover_apply(tf2_dir)  # Still 'staging', so this only drops the staged copies
+        raise
+    journal['state'] = 'committing'
+    _write_journal(tf2_dir, journal)
+    _roll_forward(tf2_dir, staging, ops)
+    _finish(tf2_dir, staging)
+
+def _roll_forward(tf2_dir, staging, ops):
+    # Safe to repeat: a step whose rename already happened is skipped
+    for i, (action, relpath) in enumerate(ops):
+        dst = os.path.join(tf2_dir, relpath)
+        new = os.path.join(staging, 'new', str(i))
+        old = os.path.join(staging, 'old', str(i))
+        staged = os.path.exists(new)
+        if (action == DELETE or staged) and os.path.exists(dst) and not os.path.exists(old):
+            os.replace(dst, old)
+        if staged:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(new, dst)
+
+def _roll_back(tf2_dir, staging, ops):
+    for i, (action, relpath) in reversed(list(enumerate(ops))):
+        dst = os.path.join(tf2_dir, relpath)
+        old = os.path.join(staging, 'old', str(i))
+        if os.path.exists(old):
+            os.replace(old, dst)
+        elif action != DELETE and not os.path.exists(os.path.join(staging, 'new', str(i))) and os.path.exists(dst):
+            remove_file(dst)
+
+def _finish(tf2_dir, staging):
+    os.remove(os.path.join(tf2_dir, JOURNAL_FILE))
+    rmtree(staging, ignore_errors=True)
+    try:
+        os.rmdir(os.path.join(tf2_dir, STAGING_DIR))
+    except OSError:
+        pass
+
+def recover_apply(tf2_dir, roll_back=False):
+    """Complete or undo an apply that was interrupted, based on its journal.
+
+    An apply that never finished staging is rolled back, which only means
+    dropping the staged copies. One that was already committing is rolled
+    forward, unless roll_back is set. Returns the action taken, or None.
+    """
+    if not tf2_dir:
+        return None
+    try:
+        with open(os.path.join(tf2_dir, JOURNAL_FILE), 'r') as f:
+            journal = json.load(f)
+    except FileNotFoundError:
+        rmtree(os.path.join(tf2_dir, STAGING_DIR), ignore_errors=True)
+        return None
+    except (OSError, ValueError):
+        return None
+    staging = os.path.join(tf2_dir, STAGING_DIR, journal['staging'])
+    if journal['state'] == 'committing' and not roll_back:
+        _roll_forward(tf2_dir, staging, journal['ops'])
+        action = 'rolled forward'
+    else:
+        if journal['state'] == 'committing':
+            _roll_back(tf2_dir, staging, journal['ops'])
+        action = 'rolled back'
+    _finish(tf2_dir, staging)
+    return action
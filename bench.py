@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracing
+from applier import format_size
+from linking import STRATEGIES
+
+# Benchmarks for the profile operations on generated tf folders. Every measurement
+# runs in a process of its own, in a folder with its own profiles and digest cache,
+# so nothing carries over between measurements and peak RSS belongs to one operation.
+
+RESULTS_VERSION = 1
+MODES = ('cold', 'warm')
+CFG_FOLDERS = ('', 'user', 'class', 'hud')
+CLASSES = ('scout', 'soldier', 'pyro', 'demoman', 'heavyweapons', 'engineer', 'medic', 'sniper', 'spy')
+# A slowdown only counts as a regression when it is also larger than this, so
+# operations that take a few milliseconds do not fail on noise.
+MIN_TIME_DELTA = 0.05
+MIN_RSS_DELTA = 16 * 1024 * 1024
+
+def _cfg_text(rng, size):
+    lines = []
+    while sum(len(line) + 1 for line in lines) < size:
+        kind = rng.randrange(3)
+        if kind == 0:
+            lines.append(f'bind "{rng.choice("abcdefghijklmnopqrstuvwxyz")}" "slot{rng.randint(1, 9)}"')
+        elif kind == 1:
+            lines.append(f"cl_cvar_{rng.randrange(500)} {rng.randint(0, 100)}")
+        else:
+            lines.append(f'alias "a{rng.randrange(1000)}" "exec {rng.choice(CLASSES)}"')
+    return "\n".join(lines) + "\n"
+
+def generate_tree(tf2_dir, shape):
+    """Write a synthetic tf folder (cfg and custom only) described by shape; returns (files, bytes)."""
+    rng = random.Random(shape['seed'])
+    files = nbytes = 0
+    def write(relpath, data):
+        nonlocal files, nbytes
+        path = os.path.join(tf2_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        files += 1
+        nbytes += len(data)
+    write(os.path.join('cfg', 'config.cfg'), _cfg_text(rng, 8000).encode())
+    for i in range(shape['cfg_files']):
+        folder = CFG_FOLDERS[i % len(CFG_FOLDERS)]
+        write(os.path.join('cfg', folder, f"{CLASSES[i % len(CLASSES)]}_{i:05}.cfg"), _cfg_text(rng, rng.randint(200, 4000)).encode())
+    for d in range(shape['custom_dirs']):
+        materials = os.path.join('custom', f"addon{d:03}", 'materials')
+        for j in range(shape['custom_files']):
+            subdirs = [f"dir{rng.randrange(3)}" for _ in range(rng.randrange(shape['depth']))]
+            ext = '.vmt' if j % 2 else '.vtf'
+            write(os.path.join(materials, *subdirs, f"tex{j:05}{ext}"), rng.randbytes(rng.randint(1024, 64 * 1024)))
+    for b in range(shape['blobs']):
+        path = os.path.join(tf2_dir, 'custom', f"vpk{b:02}", f"pak{b:02}_dir.vpk")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for _ in range(shape['blob_mb']):
+                f.write(os.urandom(1024 * 1024))
+        files += 1
+        nbytes += shape['blob_mb'] * 1024 * 1024
+    return files, nbytes
+
+def make_variant(tf2_dir, variant_dir, shape):
+    """Hardlinked copy of tf2_dir with a share of its cfg files rewritten, added and removed."""
+    rng = random.Random(shape['seed'] + 1)
+    shutil.copytree(tf2_dir, variant_dir, copy_function=os.link)
+    cfgs = sorted(os.path.join(root, f) for root, _, files in os.walk(os.path.join(variant_dir, 'cfg')) for f in files)
+    changed = rng.sample(cfgs, int(len(cfgs) * shape['changed']))
+    for path in changed[:len(changed) // 2]:
+        os.remove(path)  # A new file, not a write through the hardlink into the base tree
+        with open(path, 'w') as f:
+            f.write(_cfg_text(rng, rng.randint(200, 4000)))
+    for path in changed[len(changed) // 2:]:
+        os.remove(path)
+    for i in range(len(changed) // 2):
+        with open(os.path.join(variant_dir, 'cfg', f"added_{i:05}.cfg"), 'w') as f:
+            f.write(_cfg_text(rng, rng.randint(200, 4000)))
+
+def prepare_tree(workdir, shape):
+    """Generate the base and variant trees once; a workdir holding the same shape is reused."""
+    tree = os.path.join(workdir, 'tree')
+    shape_file = os.path.join(tree, 'shape.json')
+    try:
+        with open(shape_file, 'r') as f:
+            if json.load(f) == shape:
+                return tree
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(tree, ignore_errors=True)
+    sys.stderr.write("Generating synthetic tf folders...\n")
+    files, nbytes = generate_tree(os.path.join(tree, 'tf'), shape)
+    make_variant(os.path.join(tree, 'tf'), os.path.join(tree, 'variant'), shape)
+    sys.stderr.write(f"{files} files, {format_size(nbytes)}\n")
+    with open(shape_file, 'w') as f:
+        json.dump(shape, f)
+    return tree
+
+def _drop_page_cache(paths):
+    """Ask the OS to evict these files from the page cache; False where it cannot."""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    os.sync()
+    for top in paths:
+        for root, _, files in os.walk(top):
+            for fname in files:
+                try:
+                    fd = os.open(os.path.join(root, fname), os.O_RDONLY)
+                except OSError:
+                    continue
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                except OSError:
+                    pass
+                finally:
+                    os.close(fd)
+    return True
+
+def _reset_peak_rss():
+    # Linux lets a process reset its own high-water mark, so the peak covers just the timed part
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss(reset):
+    """(bytes, scope): the peak since _reset_peak_rss() if that worked, otherwise of the whole process."""
+    if reset:
+        try:
+            with open('/proc/self/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024, 'operation'
+        except OSError:
+            pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak if sys.platform == 'darwin' else peak * 1024), 'process'
+
+class Operation:
+    """One benchmarked operation: prepare(i) resets state untimed, run(i) is timed."""
+    profiles = ()
+
+    def __init__(self, core, tree, strategy):
+        self.core = core
+        self.tf2_dir = os.path.join(tree, 'tf')
+        self.variant_dir = os.path.join(tree, 'variant')
+        self.target = os.path.abspath('target_tf')
+        self.strategy = strategy
+
+    def profile(self, name):
+        return os.path.join(self.core.resource_path(self.core.PROFILES_DIR), name)
+
+    def setup(self):
+        from jobs import Job
+        for name in self.profiles:
+            source = self.tf2_dir if name == 'base' else self.variant_dir
+            job = Job(f"Creating {name}", (), None, (), None, None)
+            self.core.create_profile_job(job, self.profile(name), self.core.tf_sources(source), name, '', '')
+
+    def prepare(self, i):
+        pass
+
+    def run(self, i):
+        raise NotImplementedError
+
+class MatchProfiles(Operation):
+    profiles = ('base', 'variant')
+
+    def run(self, i):
+        self.core.match_profiles(None, [self.profile('base'), self.profile('variant')], self.tf2_dir)
+
+class FolderHashSubset(Operation):
+    profiles = ('base',)
+
+    def run(self, i):
+        for folder in ('cfg', 'custom'):
+            self.core.folder_hash_subset(os.path.join(self.tf2_dir, folder), os.path.join(self.profile('base'), folder))
+
+class TolerantMatch(Operation):
+    profiles = ('base',)
+
+    def run(self, i):
+        self.core.tolerant_profile_match(self.profile('base'), self.tf2_dir)
+
+class Backup(Operation):
+    # The warm run backs up content the blob store already holds
+    def run(self, i):
+        self.core.backup_folders(self.tf2_dir, self.profile(f"backup{i}"))
+
+class Restore(Operation):
+    profiles = ('base',)
+
+    def run(self, i):
+        self.core.restore_folders(self.profile('base'), self.target, self.strategy)
+
+class PlanApply(Operation):
+    profiles = ('base', 'variant')
+
+    def setup(self):
+        super().setup()
+        self.core.restore_folders(self.profile('base'), self.target, self.strategy)
+
+    def run(self, i):
+        self.core.plan_profile_apply(None, self.profile('variant'), self.profile('base'), self.target)
+
+class Apply(Operation):
+    profiles = ('base', 'variant')
+
+    def prepare(self, i):
+        self.core.restore_folders(self.profile('base'), self.target, self.strategy)
+
+    def run(self, i):
+        from jobs import Job
+        plan = self.core.plan_profile_apply(None, self.profile('variant'), self.profile('base'), self.target)
+        self.core.apply_profile_job(Job("Applying profile", (), None, (), None, None), plan, self.strategy)
+
+OPERATIONS = {
+    'match_profiles': MatchProfiles,
+    'folder_hash_subset': FolderHashSubset,
+    'tolerant_profile_match': TolerantMatch,
+    'backup_folders': Backup,
+    'restore_folders': Restore,
+    'plan_apply': PlanApply,
+    'apply': Apply,
+}
+
+def run_child(spec):
+    """Measure one operation in one mode; runs inside a fresh run folder (the cwd)."""
+    import core  # Imported here: its profiles folder and digest cache are relative to the cwd
+    op = OPERATIONS[spec['op']](core, spec['tree'], spec['strategy'])
+    op.setup()
+    if spec['mode'] == 'warm':
+        op.prepare(0)
+        op.run(0)
+    op.prepare(1)
+    dropped = False
+    if spec['mode'] == 'cold':
+        core.digest_cache.clear()
+        core.digest_cache.save()
+        dropped = _drop_page_cache([spec['tree'], os.getcwd()])
+    reset = _reset_peak_rss()
+    start = time.perf_counter()
+    with tracing.traced(tracing.Trace(spec['op'])) as trace:
+        op.run(1)
+    seconds = time.perf_counter() - start
+    peak_rss, rss_scope = _peak_rss(reset)
+    with open(spec['result'], 'w') as f:
+        json.dump({'seconds': seconds, 'peak_rss': peak_rss, 'rss_scope': rss_scope, 'page_cache_dropped': dropped,
+                   'counters': trace.counters, 'spans': trace.totals()}, f)
+    return 0
+
+def measure(workdir, tree, op, mode, strategy, run):
+    """Run one measurement in a child process and return its result dict."""
+    run_dir = os.path.join(workdir, 'runs', f"{op}-{mode}-{run}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    spec = {'op': op, 'mode': mode, 'tree': tree, 'strategy': strategy, 'result': os.path.join(run_dir, 'result.json')}
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)], cwd=run_dir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{op} ({mode}) failed:\n{proc.stderr.strip()}")
+        with open(spec['result'], 'r') as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+def run_benchmarks(args, shape, workdir):
+    tree = prepare_tree(workdir, shape)
+    from hashcache import settings
+    results = []
+    for op in args.ops:
+        for mode in args.modes:
+            runs = [measure(workdir, tree, op, mode, args.strategy, r) for r in range(args.repeat)]
+            seconds = [r['seconds'] for r in runs]
+            peaks = [r['peak_rss'] for r in runs if r['peak_rss'] is not None]
+            result = {
+                'op': op, 'mode': mode, 'seconds': statistics.median(seconds), 'runs': seconds,
+                'peak_rss': max(peaks) if peaks else None, 'rss_scope': runs[0]['rss_scope'],
+                'page_cache_dropped': runs[0]['page_cache_dropped'],
+                'counters': runs[-1]['counters'], 'spans': runs[-1]['spans'],
+            }
+            results.append(result)
+            rss = format_size(result['peak_rss']) if peaks else "n/a"
+            sys.stderr.write(f"{op:<24} {mode:<5} {result['seconds']:9.3f}s  peak RSS {rss:>10}\n")
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'hashing': dict(settings),
+        'strategy': args.strategy,
+        'shape': shape,
+        'results': results,
+    }
+
+def find_regressions(report, baseline, threshold):
+    """Results that got slower or bigger than baseline by more than threshold (a ratio, e.g. 1.25)."""
+    previous = {(r['op'], r['mode']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in report['results']:
+        base = previous.get((result['op'], result['mode']))
+        if base is None:
+            continue
+        name = f"{result['op']} ({result['mode']})"
+        if result['seconds'] > base['seconds'] * threshold and result['seconds'] - base['seconds'] > MIN_TIME_DELTA:
+            regressions.append(f"{name}: {base['seconds']:.3f}s -> {result['seconds']:.3f}s")
+        if (result['peak_rss'] and base.get('peak_rss') and result['rss_scope'] == base.get('rss_scope')
+                and result['peak_rss'] > base['peak_rss'] * threshold and result['peak_rss'] - base['peak_rss'] > MIN_RSS_DELTA):
+            regressions.append(f"{name}: peak RSS {format_size(base['peak_rss'])} -> {format_size(result['peak_rss'])}")
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bench", description="Time the profile operations on synthetic tf folders.")
+    parser.add_argument('--ops', nargs='+', choices=OPERATIONS, default=list(OPERATIONS), help="operations to run (default: all)")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES),
+                        help="cold: empty digest cache and file pages dropped where the OS allows; warm: after one untimed run")
+    parser.add_argument('--repeat', type=int, default=1, help="measurements per operation and mode; the median is reported")
+    parser.add_argument('--strategy', choices=STRATEGIES, default='auto', help="how restore and apply place files")
+    parser.add_argument('--out', help="write the JSON results here instead of to stdout")
+    parser.add_argument('--compare', help="earlier results to check for regressions (exit code 1 if any)")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown or memory growth ratio that counts as a regression")
+    parser.add_argument('--workdir', help="keep the generated trees here and reuse them on later runs")
+
+    shape = parser.add_argument_group("tree shape")
+    shape.add_argument('--cfg-files', type=int, default=2000, help="small .cfg files in tf/cfg")
+    shape.add_argument('--custom-dirs', type=int, default=8, help="addons in tf/custom, each with a materials tree")
+    shape.add_argument('--custom-files', type=int, default=250, help="material files per addon")
+    shape.add_argument('--depth', type=int, default=6, help="deepest folder nesting under materials")
+    shape.add_argument('--blobs', type=int, default=1, help="large VPK-like files")
+    shape.add_argument('--blob-mb', type=int, default=100, help="size of each large file in MB")
+    shape.add_argument('--changed', type=float, default=0.05, help="share of cfg files the applied variant changes")
+    shape.add_argument('--seed', type=int, default=1)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--child']:
+        return run_child(json.loads(argv[1]))
+    args = build_parser().parse_args(argv)
+    shape = {key: getattr(args, key) for key in ('cfg_files', 'custom_dirs', 'custom_files', 'depth', 'blobs', 'blob_mb', 'changed', 'seed')}
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="tf2cm-bench-")
+    try:
+        report = run_benchmarks(args, shape, workdir)
+    except (RuntimeError, OSError) as e:
+        sys.stderr.write(f"error: {e}\n")
+        return 1
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('shape') != shape:
+            sys.stderr.write("warning: the baseline was measured on a differently shaped tree\n")
+        regressions = find_regressions(report, baseline, args.threshold)
+        for line in regressions:
+            sys.stderr.write(f"regression: {line}\n")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
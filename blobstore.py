@@ -0,0 +1,587 @@
+import os
+import json
+import stat
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from hashcache import digest_cache, settings
+from copyengine import BatchCopier, remove_tree, remove_file, rmtree
+from linking import link_file
+import tracing
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STORE_DIR = ".store"
+STORE_ALGORITHM = "sha256"
+MANIFEST_FILE = "manifest.json"
+# 4: profile files are hardlinks to read-only blobs again; 3 gave every profile its own copies
+MANIFEST_VERSION = 4
+PROFILE_FOLDERS = ('cfg', 'custom')
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+LOCK_FILE = "lock"
+# Exists while references are being committed; left behind, it means refs.json may be off
+DIRTY_FILE = "dirty"
+# Digests a job holds as pending, in its tmp/<token>/ folder, locked by the job while it runs
+HELD_FILE = "held"
+# msvcrt locks byte ranges; one byte far past the data keeps a locked file readable
+_LOCK_OFFSET = 1 << 30
+
+def load_manifest(profile_dir):
+    """Read a profile's manifest.json as written, or None if there is none."""
+    try:
+        with open(os.path.join(profile_dir, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def scan_profile_files(profile_dir):
+    """Stat every file under a profile's cfg and custom folders without reading them."""
+    found = {}
+    for folder in PROFILE_FOLDERS:
+        stack = [os.path.join(profile_dir, folder)]
+        while stack:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            st = entry.stat()
+                            relpath = os.path.relpath(entry.path, profile_dir).replace(os.sep, '/')
+                            found[relpath] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+    return found
+
+def manifest_is_valid(profile_dir, manifest):
+    """True if the manifest is the current format and the profile was not changed by hand since."""
+    if manifest is None or manifest.get('version') != MANIFEST_VERSION or manifest.get('algorithm') != STORE_ALGORITHM:
+        return False
+    files = manifest['files']
+    found = scan_profile_files(profile_dir)
+    if len(found) != len(files):
+        return False
+    for relpath, (size, mtime_ns) in found.items():
+        entry = files.get(relpath)
+        if entry is None or entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+            return False
+    return True
+
+def save_manifest(profile_dir, files):
+    manifest = {'version': MANIFEST_VERSION, 'algorithm': STORE_ALGORITHM, 'files': files}
+    _write_json(os.path.join(profile_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+def _seal(path):
+    """Make a blob read-only, so no profile file linked to it can be edited in place."""
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & _WRITE_BITS:
+        os.chmod(path, mode & ~_WRITE_BITS)
+
+def _try_lock_file(f):
+    """Lock an open file, or return False if another handle (in any process) has it locked."""
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(_LOCK_OFFSET)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def _lock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while not _try_lock_file(f):
+        time.sleep(0.01)
+
+def _unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(_LOCK_OFFSET)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+class PendingRefs:
+    """Blobs a running job found or stored in the store but holds no counted reference to yet.
+
+    No blob is removed while it is pending, so a job only needs the store lock
+    at the moment it finds or publishes each blob. Leaving the with block drops
+    the holds and removes the blobs among them that nothing else refers to;
+    commit references with acquire() or a manifest before that. Files on their
+    way into the store are written under the job's own folder in tmp/, next to
+    the list of held digests other processes read.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.token = uuid.uuid4().hex
+        self.tmp_dir = os.path.join(store.tmp_dir, self.token)
+        self.digests = Counter()
+        self._held_file = None
+
+    def add(self, digest):
+        """Hold digest's blob; False if the store does not have it."""
+        return self.store._hold_existing(self, digest)
+
+    def tmp_path(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def __enter__(self):
+        self.store._begin_hold(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.store._unhold(self)
+
+class BlobStore:
+    """Content-addressed file store shared by all profiles.
+
+    Every unique file is kept once under blobs/ and named by its SHA-256.
+    Profile folders hold hardlinks to those blobs (or copies where the
+    filesystem cannot link), and each profile's manifest.json lists the
+    relpath, size and digest of its files. refs.json counts how many
+    manifest entries point at each blob so unused blobs can be removed.
+
+    Blobs are read-only, so a profile file can only be changed by replacing
+    it, which breaks its link and leaves the blob and every other profile
+    alone. manifest() notices the new stat signature and links the new
+    content into the store.
+
+    The store lock is only taken to publish or hold a blob and to commit
+    references; copying and hashing happen outside it, under PendingRefs.
+    It is a file lock as well as a thread lock, so the CLI and the GUI can
+    work on the same store at once.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.refs_path = os.path.join(root, 'refs.json')
+        self._refs = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_handle = None
+        self._marked_dirty = False
+        self._pending = Counter()
+        self._holders = set()  # Tokens of the PendingRefs in use, whose tmp/ folders are not garbage
+        self._foreign = None  # What other processes hold as pending, read once per locked section
+
+    @contextmanager
+    def locked(self):
+        """Hold the store lock, e.g. while writing the file that records acquire()d references."""
+        with self._lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.root, exist_ok=True)
+                self._lock_handle = open(os.path.join(self.root, LOCK_FILE), 'a+b')
+                _lock_file(self._lock_handle)
+                # Another process may have changed refs.json or its holds since
+                self._refs = None
+                self._foreign = None
+            self._lock_depth += 1
+            try:
+                yield
+                if self._lock_depth == 1 and self._marked_dirty:
+                    os.remove(os.path.join(self.root, DIRTY_FILE))  # Every commit in this section completed
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._marked_dirty = False
+                    _unlock_file(self._lock_handle)
+                    self._lock_handle.close()
+                    self._lock_handle = None
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def _load_refs(self):
+        if self._refs is None:
+            try:
+                with open(self.refs_path, 'r') as f:
+                    self._refs = Counter(json.load(f))
+            except Exception:
+                self._refs = Counter()
+        return self._refs
+
+    def _mark_dirty(self):
+        # Called with the store lock held, before the first write of a commit
+        if not self._marked_dirty:
+            open(os.path.join(self.root, DIRTY_FILE), 'w').close()
+            self._marked_dirty = True
+
+    def _save_refs(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._mark_dirty()
+        _write_json(self.refs_path, {d: n for d, n in self._refs.items() if n > 0})
+
+    def _store_stream(self, fsrc, pending, stat_source=None):
+        """Copy an open stream into the store while hashing it, so new content is read only once.
+
+        The blob is held for pending from the moment it is published.
+        """
+        tmp_path = pending.tmp_path()
+        h = hashlib.new(STORE_ALGORITHM)
+        try:
+            with open(tmp_path, 'wb') as fdst:
+                while True:
+                    chunk = fsrc.read(settings['buffer_size'])
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    fdst.write(chunk)
+                    tracing.count('bytes_read', len(chunk))
+                    tracing.count('bytes_written', len(chunk))
+            if stat_source:
+                shutil.copystat(stat_source, tmp_path)
+            digest = h.hexdigest()
+            self._publish(pending, tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                remove_file(tmp_path)
+            raise
+        return digest
+
+    def _publish(self, pending, tmp_path, digest):
+        """Move tmp_path in as digest's blob, or drop it if the store has one already, and hold it."""
+        blob = self.blob_path(digest)
+        with self.locked():
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if os.path.exists(blob):
+                remove_file(tmp_path)
+            else:
+                _seal(tmp_path)
+                os.replace(tmp_path, blob)
+            self._hold(pending, digest)
+
+    def _copy_into_store(self, src, st, pending):
+        with open(src, 'rb') as fsrc:
+            tracing.count('files_opened')
+            digest = self._store_stream(fsrc, pending, src)
+        digest_cache.remember(src, st, STORE_ALGORITHM, digest)
+        return digest
+
+    def _link(self, src, dst):
+        # src is sealed first: blobs written before manifest version 4 may still be writable
+        _seal(src)
+        try:
+            os.link(src, dst)
+        except OSError:
+            link_file(src, dst, 'reflink')
+
+    def store_file(self, src, pending):
+        """Make sure the store holds src's content, hold it for pending and return its digest."""
+        st = os.stat(src)
+        digest = digest_cache.lookup(src, st, STORE_ALGORITHM)
+        if digest is None or not pending.add(digest):
+            digest = self._copy_into_store(src, st, pending)
+        return digest
+
+    def has_blob(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def link_blob(self, digest, dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        self._link(self.blob_path(digest), dst)
+
+    def hold(self):
+        """A PendingRefs for blobs a job finds or stores before it commits references to them."""
+        return PendingRefs(self)
+
+    def _begin_hold(self, pending):
+        # Created under the store lock, so collect_garbage() never sees the folder without its locked held file
+        with self.locked():
+            os.makedirs(pending.tmp_dir, exist_ok=True)
+            pending._held_file = open(os.path.join(pending.tmp_dir, HELD_FILE), 'a+b')
+            _try_lock_file(pending._held_file)
+            self._holders.add(pending.token)
+
+    def _hold(self, pending, digest):
+        # Called with the store lock held
+        if not pending.digests[digest]:
+            pending._held_file.write(digest.encode('ascii') + b'\n')
+            pending._held_file.flush()
+        pending.digests[digest] += 1
+        self._pending[digest] += 1
+
+    def _hold_existing(self, pending, digest):
+        with self.locked():
+            if not self.has_blob(digest):
+                return False
+            self._hold(pending, digest)
+            return True
+
+    def _unhold(self, pending):
+        with self.locked():
+            self._pending.subtract(pending.digests)
+            refs = self._load_refs()
+            for digest in pending.digests:
+                if self._pending[digest] <= 0:
+                    del self._pending[digest]
+                    if refs[digest] <= 0:
+                        self._remove_blob(digest)
+            pending.digests.clear()
+            self._holders.discard(pending.token)
+            pending._held_file.close()
+        rmtree(pending.tmp_dir, ignore_errors=True)
+
+    def _scan_holders(self):
+        """(digests other processes hold as pending, tmp/ entries no running job owns).
+
+        Called with the store lock held. A held file nobody has locked was left
+        by a process that died, since the lock goes with its process.
+        """
+        held, unused = set(), []
+        try:
+            names = os.listdir(self.tmp_dir)
+        except OSError:
+            return held, unused
+        for name in names:
+            if name in self._holders:
+                continue
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                with open(os.path.join(path, HELD_FILE), 'rb') as f:
+                    if _try_lock_file(f):
+                        _unlock_file(f)
+                        unused.append(path)
+                    else:
+                        f.seek(0)
+                        held.update(f.read().decode('ascii').split())
+            except OSError:
+                unused.append(path)  # No held file: a flat tmp/ file from an older version
+        return held, unused
+
+    def _is_pending(self, digest):
+        if self._pending[digest] > 0:
+            return True
+        if self._foreign is None:
+            self._foreign = self._scan_holders()[0]
+        return digest in self._foreign
+
+    def acquire(self, digests):
+        """Count references to blobs held outside any profile manifest, e.g. by a snapshot."""
+        with self.locked():
+            self._load_refs().update(digests)
+            self._save_refs()
+
+    def release(self, digests):
+        """Undo acquire(), removing blobs nothing refers to any more."""
+        with self.locked():
+            self._drop_digests(digests)
+            self._save_refs()
+
+    def _ingest_file(self, src, dst, pending):
+        digest = self.store_file(src, pending)
+        self._link(self.blob_path(digest), dst)
+        return digest
+
+    def import_profile(self, profile_dir, sources, progress=None, cancel=None):
+        """Fill profile_dir/<folder> from sources {folder: path} through the store.
+
+        Content the store already knows costs a hardlink, not a copy. If the
+        import fails or is cancelled, blobs it added that nothing refers to are removed.
+        """
+        def add_files(copier):
+            for folder, src_folder in sources.items():
+                dst_folder = os.path.join(profile_dir, folder)
+                if os.path.exists(dst_folder):
+                    rmtree(dst_folder)
+                if not src_folder or not os.path.exists(src_folder):
+                    continue
+                for root, _, fnames in os.walk(src_folder):
+                    dst_root = os.path.normpath(os.path.join(dst_folder, os.path.relpath(root, src_folder)))
+                    os.makedirs(dst_root, exist_ok=True)
+                    for fname in fnames:
+                        copier.add(os.path.join(root, fname), os.path.join(dst_root, fname))
+        return self._import(profile_dir, self._ingest_file, add_files, progress, cancel)
+
+    def import_bundle(self, profile_dir, bundle, progress=None, cancel=None):
+        """Fill profile_dir from a ProfileBundle, streaming entries into the store.
+
+        Entries whose digest the store already holds are linked without being
+        read. The rest are hashed on the way in and must match the bundle's manifest.
+        """
+        def ingest(relpath, dst, pending):
+            expected = bundle.files[relpath]['digest']
+            if not pending.add(expected):
+                with bundle.open(relpath) as fsrc:
+                    digest = self._store_stream(fsrc, pending)
+                if digest != expected:
+                    # The stray blob goes with the import's holds, unless something else refers to it
+                    raise ValueError(f"{relpath} is corrupt in the bundle")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            self._link(self.blob_path(expected), dst)
+            return expected
+        def add_files(copier):
+            for relpath, entry in bundle.files.items():
+                copier.add(relpath, os.path.join(profile_dir, *relpath.split('/')), entry['size'])
+        return self._import(profile_dir, ingest, add_files, progress, cancel)
+
+    @tracing.timed('import')
+    def _import(self, profile_dir, ingest_file, add_files, progress, cancel):
+        digests = {}
+        with self.hold() as pending:
+            def ingest(src, dst):
+                digests[dst] = ingest_file(src, dst, pending)
+            # Files are ingested concurrently; blob names are content hashes, so racing writers agree
+            copier = BatchCopier(ingest, progress=progress, cancel=cancel)
+            try:
+                add_files(copier)
+                copier.finish()
+            except BaseException:
+                copier.abort()
+                try:
+                    copier.finish()
+                except BaseException:
+                    pass
+                raise  # Blobs this import added that nothing else refers to go with its holds
+            files = {}
+            for dst, digest in digests.items():
+                st = os.stat(dst)
+                relpath = os.path.relpath(dst, profile_dir).replace(os.sep, '/')
+                files[relpath] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': digest}
+            return self._commit_manifest(profile_dir, files)
+
+    def adopt_profile(self, profile_dir):
+        """Move an existing, unmanaged profile folder into the store without copying it.
+
+        A file the store does not know yet becomes its blob; any other file is
+        replaced by a link to the blob holding its content.
+        """
+        files = {}
+        with self.hold() as pending:
+            for folder in PROFILE_FOLDERS:
+                for root, _, fnames in os.walk(os.path.join(profile_dir, folder)):
+                    for fname in fnames:
+                        fpath = os.path.join(root, fname)
+                        st = os.stat(fpath)
+                        digest = digest_cache.digest(fpath, st, STORE_ALGORITHM)
+                        blob = self.blob_path(digest)
+                        if not pending.add(digest):
+                            # New content: the file itself becomes the blob
+                            tmp_path = pending.tmp_path()
+                            self._link(fpath, tmp_path)
+                            self._publish(pending, tmp_path, digest)
+                        if not os.path.samefile(blob, fpath):
+                            # Same content already stored: swap the file for a link to it
+                            tmp_path = pending.tmp_path()
+                            self._link(blob, tmp_path)
+                            os.replace(tmp_path, fpath)
+                            st = os.stat(fpath)
+                            digest_cache.remember(fpath, st, STORE_ALGORITHM, digest)
+                        else:
+                            _seal(blob)
+                        relpath = os.path.relpath(fpath, profile_dir).replace(os.sep, '/')
+                        files[relpath] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': digest}
+            return self._commit_manifest(profile_dir, files)
+
+    def manifest(self, profile_dir):
+        """Return an up-to-date manifest, rebuilding it if the profile changed on disk.
+
+        Rebuilding only re-reads files whose stat signature changed, thanks to the digest cache.
+        """
+        manifest = load_manifest(profile_dir)
+        if not manifest_is_valid(profile_dir, manifest):
+            manifest = self.adopt_profile(profile_dir)
+        return manifest
+
+    def _commit_manifest(self, profile_dir, files):
+        # The references dropped are those of the manifest on disk now, so two
+        # jobs rebuilding the same profile at once still leave the counts right
+        with self.locked():
+            refs = self._load_refs()
+            refs.update(entry['digest'] for entry in files.values())
+            old_manifest = load_manifest(profile_dir)
+            if old_manifest and old_manifest.get('algorithm') == STORE_ALGORITHM:
+                self._drop_refs(old_manifest)
+            self._mark_dirty()
+            manifest = save_manifest(profile_dir, files)
+            self._save_refs()
+        digest_cache.save()
+        return manifest
+
+    def _drop_refs(self, manifest):
+        self._drop_digests(entry['digest'] for entry in manifest['files'].values())
+
+    def _drop_digests(self, digests):
+        refs = self._load_refs()
+        for digest in digests:
+            refs[digest] -= 1
+            if refs[digest] <= 0:
+                del refs[digest]
+                self._remove_blob(digest)
+
+    def _remove_blob(self, digest):
+        if self._is_pending(digest):
+            return  # A running job still holds it; the job drops it if it ends up unused
+        blob = self.blob_path(digest)
+        try:
+            remove_file(blob)
+            os.rmdir(os.path.dirname(blob))
+        except OSError:
+            pass
+
+    def release_profile(self, profile_dir):
+        """Drop a profile's references and delete blobs nothing points at any more."""
+        with self.locked():
+            manifest = load_manifest(profile_dir)
+            if manifest is None:
+                return
+            if manifest.get('algorithm') == STORE_ALGORITHM:
+                self._drop_refs(manifest)
+            self._mark_dirty()
+            os.remove(os.path.join(profile_dir, MANIFEST_FILE))
+            self._save_refs()
+
+    def delete_profile(self, profile_dir, progress=None, cancel=None):
+        self.release_profile(profile_dir)
+        # A cancelled delete leaves a partial profile; its manifest is rebuilt when next used
+        remove_tree(profile_dir, progress, cancel)
+
+    def needs_collection(self):
+        """True if an interrupted job may have left garbage: tmp/ files no running job owns, or a half-made commit."""
+        with self.locked():
+            return os.path.exists(os.path.join(self.root, DIRTY_FILE)) or bool(self._scan_holders()[1])
+
+    def collect_garbage(self, list_profiles, held_digests):
+        """Recount references from every manifest plus the acquire()d digests, and remove orphaned blobs.
+
+        list_profiles() and held_digests() are called with the store lock held,
+        so no profile or snapshot can commit references in between. Blobs a
+        running job of any process holds as pending, and its files in tmp/, are kept.
+        """
+        with self.locked():
+            refs = Counter(held_digests())
+            for profile_dir in list_profiles():
+                manifest = load_manifest(profile_dir)
+                if manifest and manifest.get('algorithm') == STORE_ALGORITHM:
+                    refs.update(entry['digest'] for entry in manifest['files'].values())
+            self._refs = refs
+            foreign, unused = self._scan_holders()
+            if os.path.isdir(self.blobs_dir):
+                for prefix in os.listdir(self.blobs_dir):
+                    for digest in os.listdir(os.path.join(self.blobs_dir, prefix)):
+                        if digest not in refs and digest not in self._pending and digest not in foreign:
+                            remove_file(os.path.join(self.blobs_dir, prefix, digest))
+            for path in unused:
+                if os.path.isdir(path):
+                    rmtree(path, ignore_errors=True)
+                else:
+                    remove_file(path)  # Left by a version that kept tmp/ flat
+            self._save_refs()
@@ -0,0 +1,103 @@
+import os
+import json
+import zipfile
+from worker import check_cancel
+from blobstore import STORE_ALGORITHM, PROFILE_FOLDERS
+from linking import is_read_only_asset
+
+BUNDLE_EXTENSION = ".tf2profile"
+BUNDLE_VERSION = 1
+META_ENTRY = "profile.json"
+MANIFEST_ENTRY = "manifest.json"
+
+class BundleError(ValueError):
+    """Raised for a file that is not a readable profile bundle."""
+
+def _bundle_manifest(manifest):
+    # mtimes only mean something on the machine that made the bundle
+    files = {relpath: {'size': entry['size'], 'digest': entry['digest']} for relpath, entry in manifest['files'].items()}
+    return {'version': BUNDLE_VERSION, 'algorithm': manifest['algorithm'], 'files': files}
+
+def export_bundle(profile_dir, manifest, meta, bundle_path, progress=None, cancel=None):
+    """Write a profile to a single zip bundle, streaming each file straight into it.
+
+    profile.json and manifest.json come first. Assets that are already
+    compressed (vpk, vtf, sounds...) are stored rather than deflated, so
+    reading one back later is a plain seek into the bundle.
+    """
+    tmp_path = bundle_path + '.tmp'
+    files = total = 0
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(META_ENTRY, json.dumps(meta))
+            zf.writestr(MANIFEST_ENTRY, json.dumps(_bundle_manifest(manifest)))
+            for relpath, entry in sorted(manifest['files'].items()):
+                check_cancel(cancel)
+                compress_type = zipfile.ZIP_STORED if is_read_only_asset(relpath) else zipfile.ZIP_DEFLATED
+                zf.write(os.path.join(profile_dir, relpath), relpath, compress_type)
+                files += 1
+                total += entry['size']
+                if progress:
+                    progress(files, total)
+        os.replace(tmp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return files, total
+
+def _check_relpath(relpath):
+    parts = relpath.split('/')
+    if parts[0] not in PROFILE_FOLDERS or len(parts) < 2 or any(p in ('', '.', '..') for p in parts) or '\\' in relpath:
+        raise BundleError(f"Bundle entry has an unsafe path: {relpath}")
+
+class ProfileBundle:
+    """A profile bundle opened for reading without extracting it.
+
+    Opening reads only the zip central directory plus profile.json and
+    manifest.json, which together index every file by relpath, size and
+    digest. open() then reads a single entry on demand.
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._zip = zipfile.ZipFile(path)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise BundleError(f"Not a profile bundle: {e}")
+        try:
+            self.meta = json.loads(self._zip.read(META_ENTRY))
+            self.manifest = json.loads(self._zip.read(MANIFEST_ENTRY))
+            if self.manifest.get('version') != BUNDLE_VERSION or self.manifest.get('algorithm') != STORE_ALGORITHM:
+                raise BundleError("Unsupported bundle version.")
+            names = set(self._zip.namelist())
+            for relpath in self.manifest['files']:
+                _check_relpath(relpath)
+                if relpath not in names:
+                    raise BundleError(f"Bundle is missing {relpath}")
+        except BundleError:
+            self._zip.close()
+            raise
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            self._zip.close()
+            raise BundleError(f"Not a profile bundle: {e}")
+
+    @property
+    def files(self):
+        return self.manifest['files']
+
+    @property
+    def total_size(self):
+        return sum(entry['size'] for entry in self.files.values())
+
+    def open(self, relpath):
+        """Stream one file out of the bundle. Safe to call from several threads."""
+        return self._zip.open(relpath)
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
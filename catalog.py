@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from blobstore import MANIFEST_FILE, load_manifest
+
+CATALOG_FILE = ".catalog.sqlite"
+CATALOG_VERSION = 1
+META_FILE = "profile.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    launch_options TEXT NOT NULL,
+    meta_mtime_ns INTEGER,
+    manifest_mtime_ns INTEGER,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    manifest_digest TEXT,
+    last_applied REAL
+)
+"""
+_COLUMNS = ('id', 'name', 'description', 'launch_options', 'meta_mtime_ns', 'manifest_mtime_ns',
+            'file_count', 'total_size', 'manifest_digest', 'last_applied')
+
+def manifest_digest(manifest):
+    """One digest for a profile's whole content: equal for profiles holding the same files."""
+    h = hashlib.sha256()
+    for relpath, entry in sorted(manifest['files'].items()):
+        h.update(f"{relpath}\0{entry['digest']}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _read_meta(profile_dir):
+    try:
+        with open(os.path.join(profile_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+    except Exception:
+        meta = {}
+    return {
+        'name': meta.get('name') or os.path.basename(profile_dir),
+        'description': meta.get('description', ''),
+        'launch_options': meta.get('launch_options', ''),
+    }
+
+class ProfileCatalog:
+    """SQLite index of every profile's metadata and content summary.
+
+    profile.json and manifest.json stay the source of truth; the catalog
+    keeps what they say along with the mtimes it was read at, so listing
+    every profile costs one directory scan, a stat per profile and a single
+    query. A file whose mtime moved, for instance after editing it by hand,
+    is read again.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, CATALOG_FILE)
+        self._lock = threading.RLock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                self._db = self._open()
+            except sqlite3.DatabaseError:
+                # Only a cache of files on disk, so a damaged catalog is simply rebuilt
+                os.remove(self.path)
+                self._db = self._open()
+        return self._db
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        if db.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+            db.execute("DROP TABLE IF EXISTS profiles")
+            db.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        db.execute(_SCHEMA)
+        db.commit()
+        return db
+
+    def profile_dir(self, profile_id):
+        return os.path.join(self.root, profile_id)
+
+    def _scan(self):
+        found = {}
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    found[entry.name] = (_mtime_ns(os.path.join(entry.path, META_FILE)),
+                                         _mtime_ns(os.path.join(entry.path, MANIFEST_FILE)))
+        return found
+
+    def _refresh(self, db, profile_id, row, meta_mtime_ns, manifest_mtime_ns, force=False):
+        profile_dir = self.profile_dir(profile_id)
+        if row is None:
+            row, force = {'id': profile_id, 'last_applied': None}, True
+        row = dict(row)
+        if force or row['meta_mtime_ns'] != meta_mtime_ns:
+            row.update(_read_meta(profile_dir), meta_mtime_ns=meta_mtime_ns)
+        if force or row['manifest_mtime_ns'] != manifest_mtime_ns:
+            manifest = load_manifest(profile_dir) if manifest_mtime_ns is not None else None
+            files = manifest['files'] if manifest else {}
+            row.update(manifest_mtime_ns=manifest_mtime_ns, file_count=len(files),
+                       total_size=sum(entry['size'] for entry in files.values()),
+                       manifest_digest=manifest_digest(manifest) if manifest else None)
+        db.execute(f"INSERT OR REPLACE INTO profiles ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                   [row[c] for c in _COLUMNS])
+        return row
+
+    def entries(self):
+        """Every profile as a dict of catalog columns plus 'path', ordered by folder name."""
+        with self._lock:
+            db = self._connect()
+            found = self._scan()
+            rows = {r[0]: dict(zip(_COLUMNS, r)) for r in db.execute(f"SELECT {', '.join(_COLUMNS)} FROM profiles")}
+            with db:
+                for profile_id in set(rows) - set(found):
+                    db.execute("DELETE FROM profiles WHERE id = ?", (profile_id,))
+                for profile_id, (meta_mtime_ns, manifest_mtime_ns) in found.items():
+                    row = rows.get(profile_id)
+                    if row is None or row['meta_mtime_ns'] != meta_mtime_ns or row['manifest_mtime_ns'] != manifest_mtime_ns:
+                        rows[profile_id] = self._refresh(db, profile_id, row, meta_mtime_ns, manifest_mtime_ns)
+            return [dict(rows[profile_id], path=self.profile_dir(profile_id)) for profile_id in sorted(found)]
+
+    def get(self, profile_dir, force=False):
+        """One profile's catalog entry, re-read first if its files changed since (or when forced)."""
+        profile_id = os.path.basename(os.path.normpath(profile_dir))
+        meta_mtime_ns = _mtime_ns(os.path.join(profile_dir, META_FILE))
+        manifest_mtime_ns = _mtime_ns(os.path.join(profile_dir, MANIFEST_FILE))
+        with self._lock:
+            db = self._connect()
+            r = db.execute(f"SELECT {', '.join(_COLUMNS)} FROM profiles WHERE id = ?", (profile_id,)).fetchone()
+            row = dict(zip(_COLUMNS, r)) if r else None
+            if force or row is None or row['meta_mtime_ns'] != meta_mtime_ns or row['manifest_mtime_ns'] != manifest_mtime_ns:
+                with db:
+                    row = self._refresh(db, profile_id, row, meta_mtime_ns, manifest_mtime_ns, force)
+            return dict(row, path=profile_dir)
+
+    def update(self, profile_dir):
+        """Re-read a profile after the app changed it, in one transaction."""
+        return self.get(profile_dir, force=True)
+
+    def remove(self, profile_dir):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM profiles WHERE id = ?", (os.path.basename(os.path.normpath(profile_dir)),))
+
+    def mark_applied(self, profile_dir, when=None):
+        with self._lock:
+            self.get(profile_dir)
+            db = self._connect()
+            with db:
+                db.execute("UPDATE profiles SET last_applied = ? WHERE id = ?",
+                           (time.time() if when is None else when, os.path.basename(os.path.normpath(profile_dir))))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
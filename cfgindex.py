@@ -0,0 +1,189 @@
+import os
+import re
+import sqlite3
+import threading
+from worker import check_cancel
+import tracing
+
+INDEX_FILE = ".cfgindex.sqlite"
+INDEX_VERSION = 1
+CFG_EXTENSION = ".cfg"
+MAX_CFG_SIZE = 4 * 1024 * 1024
+# Postings counted per query token to find the rarest one, which drives the lookup
+RARITY_PROBE = 10000
+
+_SCHEMA = (
+    # manifest_digest is the catalog's; a profile is re-indexed only when it changes
+    "CREATE TABLE IF NOT EXISTS profiles (id TEXT PRIMARY KEY, manifest_digest TEXT)",
+    # Content is tokenized once per digest, however many profiles share it; postings
+    # refer to it by its integer id, which keeps the biggest table small
+    "CREATE TABLE IF NOT EXISTS contents (id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS files (profile_id TEXT NOT NULL, relpath TEXT NOT NULL, content INTEGER NOT NULL,"
+    " PRIMARY KEY (profile_id, relpath))",
+    "CREATE INDEX IF NOT EXISTS files_content ON files (content)",
+    "CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, content INTEGER NOT NULL, line INTEGER NOT NULL,"
+    " PRIMARY KEY (token, content, line)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS postings_content ON postings (content)",
+)
+_TABLES = ('profiles', 'files', 'contents', 'postings')
+
+_TOKEN = re.compile(r'[^\s;"]+')
+
+def _strip_comment(line):
+    quoted = False
+    for i, c in enumerate(line):
+        if c == '"':
+            quoted = not quoted
+        elif c == '/' and not quoted and line.startswith('//', i):
+            return line[:i]
+    return line
+
+def tokenize(text):
+    """Lowercased tokens of a cfg line: commands, arguments and the words inside quoted alias bodies."""
+    return _TOKEN.findall(_strip_comment(text).lower())
+
+def is_cfg(relpath):
+    return relpath.lower().endswith(CFG_EXTENSION)
+
+class CfgIndex:
+    """SQLite inverted index from cfg tokens to the profiles and lines that use them.
+
+    Like the catalog it is only a cache: manifests stay the source of truth.
+    Each distinct cfg content is tokenized once, by digest, so re-indexing a
+    profile only reads the cfg files whose content is new to the index.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.RLock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                self._db = self._open()
+            except sqlite3.DatabaseError:
+                os.remove(self.path)
+                self._db = self._open()
+        return self._db
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        if db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            for table in _TABLES:
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+            db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        for statement in _SCHEMA:
+            db.execute(statement)
+        db.commit()
+        return db
+
+    def profile_dir(self, profile_id):
+        return os.path.join(self.root, profile_id)
+
+    def update(self, entry, load_manifest):
+        """Bring one profile (a catalog entry) up to date; load_manifest(path) is only called if its content changed."""
+        with self._lock:
+            db = self._connect()
+            row = db.execute("SELECT manifest_digest FROM profiles WHERE id = ?", (entry['id'],)).fetchone()
+            if row is not None and row[0] == entry['manifest_digest']:
+                return
+            manifest = load_manifest(entry['path'])
+            files = {relpath: e['digest'] for relpath, e in manifest['files'].items() if is_cfg(relpath)}
+            with db:
+                old_contents = {r[0] for r in db.execute("SELECT content FROM files WHERE profile_id = ?", (entry['id'],))}
+                db.execute("DELETE FROM files WHERE profile_id = ?", (entry['id'],))
+                new_contents = set()
+                for relpath, digest in files.items():
+                    row = db.execute("SELECT id FROM contents WHERE digest = ?", (digest,)).fetchone()
+                    content = row[0] if row else self._index_content(db, digest, os.path.join(entry['path'], relpath))
+                    db.execute("INSERT INTO files (profile_id, relpath, content) VALUES (?, ?, ?)", (entry['id'], relpath, content))
+                    new_contents.add(content)
+                self._drop_orphans(db, old_contents - new_contents)
+                db.execute("INSERT OR REPLACE INTO profiles (id, manifest_digest) VALUES (?, ?)",
+                           (entry['id'], entry['manifest_digest']))
+
+    def _index_content(self, db, digest, path):
+        content = db.execute("INSERT INTO contents (digest) VALUES (?)", (digest,)).lastrowid
+        postings = set()
+        try:
+            if os.path.getsize(path) <= MAX_CFG_SIZE:
+                with open(path, 'rb') as f:
+                    text = f.read().decode('utf-8', errors='replace')
+                tracing.count('cfgs_indexed')
+                for line_no, line in enumerate(text.splitlines(), 1):
+                    postings.update((token, content, line_no) for token in tokenize(line))
+        except OSError:
+            pass  # Indexed as empty; the profile is re-indexed when its manifest changes
+        db.executemany("INSERT INTO postings (token, content, line) VALUES (?, ?, ?)", sorted(postings))
+        return content
+
+    def _drop_orphans(self, db, contents):
+        orphans = [(content,) for content in contents
+                   if db.execute("SELECT 1 FROM files WHERE content = ? LIMIT 1", (content,)).fetchone() is None]
+        db.executemany("DELETE FROM postings WHERE content = ?", orphans)
+        db.executemany("DELETE FROM contents WHERE id = ?", orphans)
+
+    def remove(self, profile_dir):
+        profile_id = os.path.basename(os.path.normpath(profile_dir))
+        with self._lock:
+            db = self._connect()
+            with db:
+                contents = {r[0] for r in db.execute("SELECT content FROM files WHERE profile_id = ?", (profile_id,))}
+                db.execute("DELETE FROM files WHERE profile_id = ?", (profile_id,))
+                db.execute("DELETE FROM profiles WHERE id = ?", (profile_id,))
+                self._drop_orphans(db, contents)
+
+    @tracing.timed('cfg_index')
+    def sync(self, entries, load_manifest, cancel=None):
+        """Re-index the catalog entries whose content changed and forget profiles that are gone."""
+        with self._lock:
+            db = self._connect()
+            ids = {entry['id'] for entry in entries}
+            for (profile_id,) in db.execute("SELECT id FROM profiles").fetchall():
+                if profile_id not in ids:
+                    self.remove(self.profile_dir(profile_id))
+            for entry in entries:
+                check_cancel(cancel)
+                if entry['manifest_digest'] is not None:
+                    self.update(entry, load_manifest)
+
+    def search(self, query, limit=500):
+        """Lines of profile cfgs holding every token of query, as dicts of profile, path, line and text."""
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self._lock:
+            db = self._connect()
+            # Scan the postings of the rarest token and probe the others by primary key
+            tokens = sorted(tokens, key=lambda token: db.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE token = ? LIMIT ?)", (token, RARITY_PROBE)).fetchone()[0])
+            joins = "".join(f" JOIN postings AS p{i} ON p{i}.token = ? AND p{i}.content = p0.content AND p{i}.line = p0.line"
+                            for i in range(1, len(tokens)))
+            rows = db.execute(
+                f"SELECT f.profile_id, f.relpath, f.content, p0.line FROM postings AS p0{joins}"
+                " JOIN files AS f ON f.content = p0.content WHERE p0.token = ? LIMIT ?",
+                tokens[1:] + tokens[:1] + [limit]).fetchall()
+        rows.sort()  # Sorted here: an ORDER BY would have to visit every match of a common token first
+        lines = {}
+        hits = []
+        for profile_id, relpath, content, line in rows:
+            if content not in lines:
+                lines[content] = _read_lines(os.path.join(self.profile_dir(profile_id), relpath))
+            text = lines[content][line - 1] if line <= len(lines[content]) else ""
+            hits.append({'profile': profile_id, 'path': relpath, 'line': line, 'text': text.strip()})
+        return hits
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+def _read_lines(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', errors='replace').splitlines()
+    except OSError:
+        return []
@@ -0,0 +1,286 @@
+import os
+import json
+import threading
+from collections import OrderedDict, namedtuple
+import tracing
+
+# What a set of cfg files does once the game runs them: the exec graph across
+# cfg/ and custom/*/cfg/, the aliases it defines and runs, and the cvars and
+# binds in effect for each class.
+
+CLASSES = ('scout', 'soldier', 'pyro', 'demoman', 'heavyweapons', 'engineer', 'medic', 'sniper', 'spy')
+# Run by the game at startup, in this order, before any class config
+STARTUP_CFGS = ('config.cfg', 'autoexec.cfg')
+CACHE_FILE = "cfg_cache.json"
+CACHE_VERSION = 1
+MAX_ALIAS_DEPTH = 64
+MAX_CACHED_FILES = 4096
+MAX_CFG_SIZE = 4 * 1024 * 1024
+
+# Commands whose single argument is not a cvar value
+COMMANDS = {
+    'echo', 'exec', 'alias', 'bind', 'unbind', 'unbindall', 'bindtoggle', 'toggle', 'incrementvar',
+    'multvar', 'say', 'say_team', 'wait', 'play', 'playgamesound', 'connect', 'disconnect', 'map',
+    'join_class', 'joinclass', 'build', 'destroy', 'voicemenu', 'slot1', 'slot2', 'slot3', 'slot4',
+    'slot5', 'slot6', 'slot7', 'slot8', 'slot9', 'slot10', 'use', 'load_itempreset', 'taunt_by_name',
+    'hud_reloadscheme', 'record', 'stop', 'screenshot', 'developer', 'clear', 'host_writeconfig',
+}
+
+Command = namedtuple('Command', 'name args line')
+
+def split_commands(text):
+    """Split cfg text into (line number, [words]) per command, the way the console tokenizes it.
+
+    ; and newlines end a command and // starts a comment, except inside
+    quotes; a quoted string is one word without its quotes, and an unclosed
+    quote runs to the end of the line.
+    """
+    for line_no, line in enumerate(text.splitlines(), 1):
+        words = []
+        word = None
+        quoted = False
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if quoted:
+                if c == '"':
+                    quoted = False
+                    words.append(word)
+                    word = None
+                else:
+                    word += c
+            elif c == '"':
+                if word is not None:
+                    words.append(word)
+                quoted = True
+                word = ''
+            elif c == '/' and line.startswith('//', i):
+                break
+            elif c == ';' or c.isspace():
+                if word is not None:
+                    words.append(word)
+                    word = None
+                if c == ';' and words:
+                    yield line_no, words
+                    words = []
+            else:
+                word = c if word is None else word + c
+            i += 1
+        if word is not None:
+            words.append(word)
+        if words:
+            yield line_no, words
+
+def parse_cfg(text):
+    """The commands of a cfg file as a tuple of Command, names lowercased."""
+    return tuple(Command(words[0].lower(), tuple(words[1:]), line_no) for line_no, words in split_commands(text))
+
+def parse_file(path):
+    try:
+        if os.path.getsize(path) > MAX_CFG_SIZE:
+            return ()
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8', errors='replace')
+    except OSError:
+        return ()
+    tracing.count('cfgs_parsed')
+    return parse_cfg(text)
+
+class AstCache:
+    """Persistent cache of parsed cfg files by content digest, so a file is only parsed again once it changes.
+
+    Like the digest cache it keeps the most recently used max_entries files.
+    """
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_CACHED_FILES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                for digest, commands in data.get('entries', {}).items():
+                    self._entries[digest] = tuple(Command(name, tuple(args), line) for name, args, line in commands)
+        except Exception:
+            pass
+
+    def get(self, digest, path):
+        if digest is None:
+            return parse_file(path)
+        with self._lock:
+            self._load()
+            commands = self._entries.get(digest)
+            if commands is not None:
+                self._entries.move_to_end(digest)
+                tracing.count('cfg_cache_hits')
+                return commands
+        commands = parse_file(path)
+        with self._lock:
+            self._entries[digest] = commands
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return commands
+
+    def save(self):
+        """Write the cache to disk if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({'version': CACHE_VERSION, 'entries': self._entries}, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError:
+                pass
+
+ast_cache = AstCache()
+
+class CfgTree:
+    """The cfg files of a tf folder or profile, from a manifest, resolved the way exec finds them.
+
+    Every custom/*/cfg folder is searched before cfg/, custom folders in
+    name order, and names are matched case-insensitively like on Windows.
+    """
+    def __init__(self, root, manifest):
+        self.root = root
+        self.digests = {}
+        found = {}  # lowercased name under a cfg folder -> [(search order, relpath)]
+        for relpath, entry in manifest['files'].items():
+            parts = relpath.split('/')
+            if parts[0] == 'cfg' and len(parts) > 1:
+                name, order = '/'.join(parts[1:]), (1, '')
+            elif parts[0] == 'custom' and len(parts) > 3 and parts[2].lower() == 'cfg':
+                name, order = '/'.join(parts[3:]), (0, parts[1].lower())
+            else:
+                continue
+            self.digests[relpath] = entry.get('digest')
+            found.setdefault(name.lower(), []).append((order, relpath))
+        self._names = {name: min(candidates)[1] for name, candidates in found.items()}
+
+    def resolve(self, name):
+        """relpath of the file `exec name` runs, or None."""
+        name = name.replace('\\', '/').strip('/').lower()
+        if not name.endswith('.cfg'):
+            name += '.cfg'
+        return self._names.get(name)
+
+    def commands(self, relpath):
+        return ast_cache.get(self.digests.get(relpath), os.path.join(self.root, relpath))
+
+class CfgState:
+    """Console state while cfgs run: values are (value, relpath, line) so each can be traced to its source."""
+    def __init__(self):
+        self.cvars = {}
+        self.binds = {}
+        self.aliases = {}
+
+    def copy(self):
+        state = CfgState()
+        state.cvars = dict(self.cvars)
+        state.binds = dict(self.binds)
+        state.aliases = dict(self.aliases)
+        return state
+
+class CfgRunner:
+    """Runs cfgs from a CfgTree against a CfgState, recording the exec graph, missing files and cycles."""
+    def __init__(self, tree):
+        self.tree = tree
+        self.graph = {}  # relpath -> [relpaths it execs]
+        self.missing = set()  # (relpath, exec argument)
+        self.cycles = []  # ('exec' or 'alias', [chain])
+        self._cycle_keys = set()
+
+    def run_file(self, state, relpath, stack=()):
+        stack = stack + (relpath,)
+        self.graph.setdefault(relpath, [])
+        for command in self.tree.commands(relpath):
+            self._run(state, command, relpath, stack, ())
+
+    def _cycle(self, kind, chain):
+        key = (kind, tuple(chain))
+        if key not in self._cycle_keys:
+            self._cycle_keys.add(key)
+            self.cycles.append((kind, list(chain)))
+
+    def _run(self, state, command, relpath, stack, aliases):
+        name, args = command.name, command.args
+        if name == 'exec':
+            if not args:
+                return
+            target = self.tree.resolve(args[0])
+            if target is None:
+                self.missing.add((relpath, args[0]))
+                return
+            if target not in self.graph[relpath]:
+                self.graph[relpath].append(target)
+            if target in stack:
+                self._cycle('exec', stack[stack.index(target):] + (target,))
+                return
+            self.run_file(state, target, stack)
+        elif name == 'alias':
+            if args:
+                state.aliases[args[0].lower()] = (' '.join(args[1:]), relpath, command.line)
+        elif name == 'bind':
+            if len(args) > 1:
+                state.binds[args[0].lower()] = (' '.join(args[1:]), relpath, command.line)
+        elif name == 'unbind':
+            if args:
+                state.binds.pop(args[0].lower(), None)
+        elif name == 'unbindall':
+            state.binds.clear()
+        elif name in state.aliases:
+            if name in aliases:
+                self._cycle('alias', aliases[aliases.index(name):] + (name,))
+                return
+            if len(aliases) >= MAX_ALIAS_DEPTH:
+                return
+            body = state.aliases[name][0]
+            for line_no, words in split_commands(body):
+                self._run(state, Command(words[0].lower(), tuple(words[1:]), command.line), relpath, stack, aliases + (name,))
+        elif len(args) == 1 and name not in COMMANDS and not name.startswith(('+', '-')):
+            state.cvars[name] = (args[0], relpath, command.line)
+
+@tracing.timed('cfg_resolve')
+def effective_config(root, manifest, classes=CLASSES):
+    """What the cfgs under root do: the startup state and the state each class ends up with.
+
+    Returns a dict with 'startup' and 'classes' ({class: state}, states as
+    {'cvars', 'binds', 'aliases'} of name -> (value, relpath, line)), the exec
+    'graph' ({relpath: [relpaths]}), 'missing' exec targets as (relpath, name),
+    and 'cycles' as ('exec' or 'alias', chain).
+    """
+    tree = CfgTree(root, manifest)
+    runner = CfgRunner(tree)
+    startup = CfgState()
+    for name in STARTUP_CFGS:
+        relpath = tree.resolve(name)
+        if relpath:
+            runner.run_file(startup, relpath)
+    per_class = {}
+    for cls in classes:
+        state = startup.copy()
+        relpath = tree.resolve(cls)
+        if relpath:
+            runner.run_file(state, relpath)
+        per_class[cls] = state
+    ast_cache.save()
+    return {
+        'startup': _state_dict(startup),
+        'classes': {cls: _state_dict(state) for cls, state in per_class.items()},
+        'graph': runner.graph,
+        'missing': sorted(runner.missing),
+        'cycles': runner.cycles,
+    }
+
+def _state_dict(state):
+    return {'cvars': state.cvars, 'binds': state.binds, 'aliases': state.aliases}
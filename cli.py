@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tracing
+from jobs import Job
+from applier import JOURNAL_FILE, ADD, REPLACE, DELETE, format_size, recover_apply
+from linking import STRATEGIES
+from profilediff import ADDED, REMOVED, CHANGED, UNVERIFIED, has_line_diff
+from cfgparse import CLASSES
+from core import (
+    load_config, get_tf2_dir, get_apply_strategy, apply_hash_settings, apply_trace_settings, tf_sources,
+    restore_folders, load_profile_metadata, profile_path_for, profile_catalog, match_profile_set,
+    tolerant_profile_match, plan_profile_apply, create_profile_job, import_bundle_job,
+    apply_profile_job, delete_profile_job, diff_profiles, diff_profile_tf, get_snapshot_limits, snapshot_store,
+    restore_snapshot_job, search_cfgs, profile_cfg_report, tf_cfg_report,
+)
+
+# Everything the GUI can do to profiles, without importing tkinter or customtkinter,
+# so it works in scripts, on headless machines and in benchmarks.
+
+class CliError(Exception):
+    """A problem with the command line or its arguments, reported without a traceback."""
+
+class ConsoleJob(Job):
+    """Job that reports progress on stderr, for running the GUI's job functions directly."""
+    def __init__(self, title, interval=0.2):
+        super().__init__(title, (), None, (), None, None)
+        self.interval = interval
+        self._shown = 0.0
+        self._lock = threading.Lock()
+
+    def progress(self, files, nbytes):
+        super().progress(files, nbytes)
+        if not sys.stderr.isatty():
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._shown >= self.interval:
+                self._shown = now
+                sys.stderr.write(f"\r{self.title}: {self.files_done}/{self.files_total} files, "
+                                 f"{format_size(self.bytes_done)} of {format_size(self.bytes_total)}")
+                sys.stderr.flush()
+
+    def run(self, fn, *args):
+        try:
+            return fn(self, *args)
+        finally:
+            if self._shown:
+                sys.stderr.write("\n")
+
+def find_profile(name):
+    """Look a profile up by folder name, or case-insensitively by folder or display name if unambiguous."""
+    entries = profile_catalog.entries()
+    for entry in entries:
+        if entry['id'] == name:
+            return entry
+    matches = [entry for entry in entries if name.lower() in (entry['id'].lower(), entry['name'].lower())]
+    if len(matches) == 1:
+        return matches[0]
+    if matches:
+        raise CliError(f"'{name}' matches several profiles, use its folder name: {', '.join(e['id'] for e in matches)}")
+    raise CliError(f"No profile named '{name}'.")
+
+def require_tf2_dir(args):
+    if not args.tf or not os.path.isdir(args.tf):
+        raise CliError("No valid tf folder; pass --tf or choose one in the app first.")
+    return args.tf
+
+def current_profile(tf2_dir, exclude=None):
+    paths = [entry['path'] for entry in profile_catalog.entries() if entry['path'] != exclude]
+    for path, is_current in zip(paths, match_profile_set(paths, tf2_dir)):
+        if is_current:
+            return path
+    return None
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "never"
+
+def cmd_list(args, out):
+    entries = profile_catalog.entries()
+    if args.json:
+        keys = ('id', 'name', 'description', 'launch_options', 'file_count', 'total_size', 'manifest_digest', 'last_applied')
+        json.dump([{k: entry[k] for k in keys} for entry in entries], out, indent=2)
+        out.write("\n")
+        return 0
+    for entry in entries:
+        out.write(f"{entry['id']:<24} {entry['name']:<24} {entry['file_count']:>7} files {format_size(entry['total_size']):>10}"
+                  f"  applied {_format_time(entry['last_applied'])}\n")
+    return 0
+
+def cmd_status(args, out):
+    tf2_dir = require_tf2_dir(args)
+    if os.path.exists(os.path.join(tf2_dir, JOURNAL_FILE)):
+        out.write("An interrupted apply is pending; it is finished by the next apply.\n")
+    if args.profile:
+        entry = find_profile(args.profile)
+        matches = tolerant_profile_match(entry['path'], tf2_dir)
+        out.write(f"{entry['name']} {'matches' if matches else 'does not match'} {tf2_dir}\n")
+        return 0 if matches else 1
+    current = current_profile(tf2_dir)
+    if current is None:
+        out.write(f"No profile matches {tf2_dir}\n")
+        return 1
+    out.write(f"Current profile: {load_profile_metadata(current)['name']} ({os.path.basename(current)})\n")
+    return 0
+
+def _plan(entry, tf2_dir):
+    return plan_profile_apply(None, entry['path'], current_profile(tf2_dir, exclude=entry['path']), tf2_dir)
+
+def _write_plan(plan, out):
+    marks = {ADD: '+', REPLACE: '~', DELETE: '-'}
+    for action, relpath, size, _ in sorted(plan.changes, key=lambda op: op[1]):
+        out.write(f"{marks[action]} {relpath} ({format_size(size)})\n")
+
+def cmd_diff(args, out):
+    entry = find_profile(args.profile)
+    if args.other:
+        diff = diff_profiles(None, entry['path'], find_profile(args.other)['path'])
+    else:
+        diff = diff_profile_tf(None, entry['path'], require_tf2_dir(args), args.verify or args.lines)
+    if args.json:
+        result = diff.to_dict()
+        if args.lines:
+            for item in result['files']:
+                if item['status'] != UNVERIFIED and has_line_diff(item['path']):
+                    item['lines'] = diff.line_diff(item['path'])
+        json.dump(result, out, indent=2)
+        out.write("\n")
+        return 1 if diff.entries else 0
+    marks = {ADDED: '+', REMOVED: '-', CHANGED: '~', UNVERIFIED: '?'}
+    for status, relpath, old_size, new_size in diff.entries:
+        sizes = format_size(new_size if old_size is None else old_size)
+        if old_size is not None and new_size is not None and old_size != new_size:
+            sizes += f" -> {format_size(new_size)}"
+        out.write(f"{marks[status]} {relpath} ({sizes})\n")
+        if args.lines and status != UNVERIFIED and has_line_diff(relpath):
+            lines = diff.line_diff(relpath)
+            out.writelines(lines if lines is not None else ["  (binary or too large to show)\n"])
+    out.write(diff.summary() + "\n")
+    return 1 if diff.entries else 0
+
+def cmd_search(args, out):
+    hits = search_cfgs(None, args.query, args.limit)
+    if args.json:
+        json.dump([{k: hit[k] for k in ('profile', 'name', 'path', 'line', 'text')} for hit in hits], out, indent=2)
+        out.write("\n")
+    else:
+        for hit in hits:
+            out.write(f"{hit['name']}: {hit['path']}:{hit['line']}: {hit['text']}\n")
+    return 0 if hits else 1
+
+def _write_settings(settings, out, base=None):
+    # Only what differs from base, when given
+    for kind, prefix in (('cvars', ''), ('binds', 'bind ')):
+        for name, (value, relpath, line) in sorted(settings[kind].items()):
+            if base is None or base[kind].get(name, (None,))[0] != value:
+                setting = f'{prefix}{name} "{value}"'
+                out.write(f"  {setting:<48} {relpath}:{line}\n")
+        if base is not None:
+            for name in sorted(base[kind].keys() - settings[kind].keys()):
+                out.write(f"  {prefix}{name} (unset)\n")
+
+def cmd_cfg(args, out):
+    if args.profile:
+        entry = find_profile(args.profile)
+        report = profile_cfg_report(None, entry['path'])
+    else:
+        report = tf_cfg_report(None, require_tf2_dir(args))
+    classes = [args.cls] if args.cls else list(CLASSES)
+    if args.json:
+        json.dump({'startup': report['startup'], 'classes': {cls: report['classes'][cls] for cls in classes},
+                   'graph': report['graph'], 'missing': report['missing'], 'cycles': report['cycles']}, out, indent=2)
+        out.write("\n")
+        return 1 if report['cycles'] else 0
+    for relpath, targets in sorted(report['graph'].items()):
+        if targets:
+            out.write(f"{relpath} -> {', '.join(targets)}\n")
+    for relpath, name in report['missing']:
+        out.write(f"missing: {relpath} execs {name}\n")
+    for kind, chain in report['cycles']:
+        out.write(f"{kind} cycle: {' -> '.join(chain)}\n")
+    if args.cls:
+        out.write(f"[{args.cls}]\n")
+        _write_settings(report['classes'][args.cls], out)
+    else:
+        startup = report['startup']
+        out.write(f"[startup] {len(startup['cvars'])} cvars, {len(startup['binds'])} binds\n")
+        _write_settings(startup, out)
+        for cls in classes:
+            out.write(f"[{cls}] changes from startup\n")
+            _write_settings(report['classes'][cls], out, startup)
+    return 1 if report['cycles'] else 0
+
+def cmd_apply(args, out):
+    tf2_dir = require_tf2_dir(args)
+    entry = find_profile(args.profile)
+    strategy = args.strategy or get_apply_strategy(args.config)
+    action = recover_apply(tf2_dir)
+    if action:
+        out.write(f"A previous interrupted apply was {action}.\n")
+    if args.full:
+        # Replaces tf/cfg and tf/custom wholesale instead of applying a diff
+        if args.dry_run:
+            out.write(f"Would replace tf/cfg and tf/custom with {entry['name']}.\n")
+        else:
+            restore_folders(entry['path'], tf2_dir, strategy)
+            profile_catalog.mark_applied(entry['path'])
+    else:
+        plan = _plan(entry, tf2_dir)
+        if args.dry_run:
+            _write_plan(plan, out)
+        out.write(plan.summary() + "\n")
+        if not args.dry_run:
+            limits = None if args.no_snapshot else get_snapshot_limits(args.config)
+            ConsoleJob("Applying profile").run(apply_profile_job, plan, strategy, limits)
+    if not args.dry_run:
+        out.write(f"Applied {entry['name']}.\n")
+    return 0
+
+def find_snapshot(snapshot_id):
+    snapshot = snapshot_store.find(snapshot_id)
+    if snapshot is None:
+        raise CliError(f"No single snapshot with an id starting with '{snapshot_id}'; see 'snapshots'.")
+    return snapshot
+
+def cmd_snapshots(args, out):
+    if args.prune:
+        limits = get_snapshot_limits(args.config)
+        removed = snapshot_store.prune(*limits) if limits else []
+        out.write(f"Pruned {len(removed)} snapshot(s).\n")
+    snapshots = snapshot_store.list()
+    if args.json:
+        keys = ('id', 'created', 'label', 'tf2_dir', 'absent', 'stored_bytes')
+        json.dump([dict({k: s[k] for k in keys}, files=sorted(s['files'])) for s in snapshots], out, indent=2)
+        out.write("\n")
+        return 0
+    for s in snapshots:
+        count = len(s['files']) + len(s['absent'])
+        out.write(f"{s['id']:<24} {_format_time(s['created']):<16} {count:>7} files {format_size(s['stored_bytes']):>10}"
+                  f"  {s['label']}\n")
+    return 0
+
+def cmd_restore(args, out):
+    tf2_dir = require_tf2_dir(args)
+    snapshot = find_snapshot(args.snapshot)
+    strategy = args.strategy or get_apply_strategy(args.config)
+    action = recover_apply(tf2_dir)
+    if action:
+        out.write(f"A previous interrupted apply was {action}.\n")
+    if args.dry_run:
+        with snapshot_store.restoring(snapshot['id'], tf2_dir) as (plan, _):
+            _write_plan(plan, out)
+            out.write(plan.summary() + "\n")
+        return 0
+    limits = None if args.no_snapshot else get_snapshot_limits(args.config)
+    ConsoleJob("Restoring snapshot").run(restore_snapshot_job, snapshot['id'], tf2_dir, strategy, limits)
+    out.write(f"Restored {snapshot['id']} ({snapshot['label']}).\n")
+    return 0
+
+def cmd_create(args, out):
+    try:
+        profile_path = profile_path_for(args.name)
+    except ValueError as e:
+        raise CliError(str(e))
+    if os.path.exists(profile_path):
+        raise CliError("A profile with this name already exists.")
+    if args.bundle:
+        ConsoleJob("Importing bundle").run(import_bundle_job, args.bundle, profile_path, args.name)
+    else:
+        if args.cfg or args.custom:
+            sources = {'cfg': args.cfg, 'custom': args.custom}
+        else:
+            sources = tf_sources(require_tf2_dir(args))
+        ConsoleJob("Creating profile").run(create_profile_job, profile_path, sources, args.name,
+                                           args.description, args.launch_options)
+    entry = profile_catalog.get(profile_path)
+    out.write(f"Created {entry['name']} ({entry['file_count']} files, {format_size(entry['total_size'])}).\n")
+    return 0
+
+def cmd_delete(args, out):
+    entry = find_profile(args.profile)
+    tf2_dir = require_tf2_dir(args) if args.tf_config else None
+    if not args.yes:
+        what = f"profile '{entry['name']}'" + (" and its config in the tf folder" if tf2_dir else "")
+        if not sys.stdin.isatty() or input(f"Delete {what}? This cannot be undone. [y/N] ").strip().lower() != 'y':
+            raise CliError("Not deleted; pass --yes to skip the question.")
+    ConsoleJob("Deleting profile").run(delete_profile_job, entry['path'], tf2_dir)
+    out.write(f"Deleted {entry['name']}.\n")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tf2cm", description="Manage TF2 config profiles from the command line.")
+    parser.add_argument('--tf', help="tf folder to use instead of the one saved in config.ini")
+    parser.add_argument('-v', '--verbose', action='count', default=0, help="log more to stderr (-vv for every file checked)")
+    parser.add_argument('--trace', metavar='DIR', help="write a JSON trace of the command to this folder")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('list', help="list profiles")
+    p.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('status', help="show which profile the tf folder matches (exit code 1 if none)")
+    p.add_argument('profile', nargs='?', help="only check this profile")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser('diff', help="compare a profile with the tf folder or with another profile (exit code 1 if they differ)")
+    p.add_argument('profile')
+    p.add_argument('other', nargs='?', help="profile to compare with instead of the tf folder")
+    p.add_argument('--lines', action='store_true', help="show line diffs of changed text files (.cfg, .txt, .res) and the changed entries of .vpk files")
+    p.add_argument('--verify', action='store_true', help="hash same-sized tf files the digest cache does not know instead of reporting them as unverified (implied by --lines)")
+    p.add_argument('--json', action='store_true', help="print JSON instead of a list")
+    p.set_defaults(func=cmd_diff)
+
+    p = sub.add_parser('search', help="find cfg lines in every profile that use all the given words (exit code 1 if none)")
+    p.add_argument('query', help="e.g. 'bind mouse4', 'alias +jump' or 'cl_interp'")
+    p.add_argument('--limit', type=int, default=500, help="at most this many lines (default: 500)")
+    p.add_argument('--json', action='store_true', help="print JSON instead of a list")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser('cfg', help="show the cvars and binds each class ends up with once the cfgs run (exit code 1 on exec or alias cycles)")
+    p.add_argument('profile', nargs='?', help="profile to read instead of the tf folder")
+    p.add_argument('--class', dest='cls', choices=CLASSES, help="only this class, in full")
+    p.add_argument('--json', action='store_true', help="print JSON, with the exec graph and source of every value")
+    p.set_defaults(func=cmd_cfg)
+
+    p = sub.add_parser('apply', help="apply a profile to the tf folder")
+    p.add_argument('profile')
+    p.add_argument('--strategy', choices=STRATEGIES, help="how files are placed (default: apply_strategy from config.ini)")
+    p.add_argument('--full', action='store_true', help="replace tf/cfg and tf/custom entirely instead of applying only the differences")
+    p.add_argument('--dry-run', action='store_true', help="only print what would change, file by file")
+    p.add_argument('--no-snapshot', action='store_true', help="do not snapshot the files the apply replaces or removes")
+    p.set_defaults(func=cmd_apply)
+
+    p = sub.add_parser('snapshots', help="list the snapshots taken before each apply")
+    p.add_argument('--prune', action='store_true', help="first delete snapshots past snapshot_max_age_days / snapshot_max_mb")
+    p.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    p.set_defaults(func=cmd_snapshots)
+
+    p = sub.add_parser('restore', help="put the tf folder back the way a snapshot recorded it")
+    p.add_argument('snapshot', help="snapshot id, or the start of one")
+    p.add_argument('--strategy', choices=STRATEGIES, help="how files are placed (default: apply_strategy from config.ini)")
+    p.add_argument('--dry-run', action='store_true', help="only print what would change, file by file")
+    p.add_argument('--no-snapshot', action='store_true', help="do not snapshot the current files first")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser('create', help="create a profile from the tf folder, cfg/custom folders or a bundle")
+    p.add_argument('name')
+    p.add_argument('--description', default='')
+    p.add_argument('--launch-options', default='')
+    p.add_argument('--cfg', help="cfg folder to import instead of the tf folder's")
+    p.add_argument('--custom', help="custom folder to import instead of the tf folder's")
+    p.add_argument('--bundle', help="profile bundle file to import")
+    p.set_defaults(func=cmd_create)
+
+    p = sub.add_parser('delete', help="delete a profile")
+    p.add_argument('profile')
+    p.add_argument('--tf-config', action='store_true', help="also delete its config from the tf folder")
+    p.add_argument('-y', '--yes', action='store_true', help="do not ask for confirmation")
+    p.set_defaults(func=cmd_delete)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.config = load_config()
+    if 'DEFAULT' not in args.config:
+        args.config['DEFAULT'] = {}
+    args.tf = args.tf or get_tf2_dir(args.config)
+    apply_trace_settings(args.config)
+    if args.verbose:
+        tracing.configure(level=tracing.DEBUG if args.verbose > 1 else tracing.INFO)
+    if args.trace:
+        tracing.configure(trace_dir=args.trace)
+    try:
+        apply_hash_settings(args.config)
+        with tracing.operation(args.command, argv=sys.argv[1:] if argv is None else list(argv)):
+            return args.func(args, sys.stdout)
+    except CliError as e:
+        sys.stderr.write(f"error: {e}\n")
+        return 1
+    except KeyboardInterrupt:
+        sys.stderr.write("Cancelled.\n")
+        return 130
+    except Exception as e:
+        sys.stderr.write(f"error: {e}\n")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+import os
+import sys
+import stat
+import errno
+import shutil
+import threading
+from worker import Cancelled, check_cancel
+import tracing
+
+COPY_WORKERS = 8
+BUFFER_SIZE = 8 * 1024 * 1024
+# Files below SMALL_FILE are grouped so thousands of tiny cfg/material files
+# cost a handful of pool tasks instead of one each.
+SMALL_FILE = 256 * 1024
+BATCH_FILES = 64
+BATCH_BYTES = 4 * 1024 * 1024
+_KERNEL_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+def _kernel_copy(copy_call, fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        sent = copy_call(fsrc.fileno(), fdst.fileno(), offset, min(size - offset, BUFFER_SIZE))
+        if not sent:
+            break
+        offset += sent
+    return offset
+
+def _copy_file_range(in_fd, out_fd, offset, count):
+    return os.copy_file_range(in_fd, out_fd, count, offset, offset)
+
+def _sendfile(in_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+def copy_file(src, dst):
+    """Copy data and metadata, letting the kernel move the bytes where it can.
+
+    Uses copy_file_range (which filesystems may turn into a server-side or
+    CoW copy), then sendfile, and plain large-buffer reads/writes elsewhere.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = False
+        for name, copy_call in (('copy_file_range', _copy_file_range), ('sendfile', _sendfile)):
+            if not hasattr(os, name) or not sys.platform.startswith('linux'):
+                continue
+            try:
+                if _kernel_copy(copy_call, fsrc, fdst, size) == size:
+                    copied = True
+                    break
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_ERRORS:
+                    raise
+            fdst.seek(0)
+            fdst.truncate()
+        if not copied:
+            fsrc.seek(0)
+            shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+    tracing.count('files_opened')
+    tracing.count('bytes_read', size)
+    tracing.count('bytes_written', size)
+    shutil.copystat(src, dst)
+
+class BatchCopier:
+    """Copies files on a bounded thread pool, grouping small files into batches.
+
+    copy_function(src, dst) does the actual work, so callers can plug in
+    link_file() or a blob-store ingest. progress(files, bytes) is called from
+    worker threads with running totals. The first error cancels the rest and
+    is re-raised by finish().
+    """
+    def __init__(self, copy_function=copy_file, workers=COPY_WORKERS, progress=None, cancel=None):
+        self.copy_function = copy_function
+        self.progress = progress
+        self.cancel = cancel
+        self._abort = threading.Event()
+        self.files_done = 0
+        self.bytes_done = 0
+        from concurrent.futures import ThreadPoolExecutor  # Kept off the CLI's startup path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tf2cm-copy",
+                                        initializer=tracing.bind, initargs=(tracing.current(),))
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._batch = []
+        self._batch_bytes = 0
+
+    def add(self, src, dst, size=None):
+        if size is None:
+            size = os.path.getsize(src)
+        if size >= SMALL_FILE:
+            self._submit([(src, dst, size)])
+            return
+        self._batch.append((src, dst, size))
+        self._batch_bytes += size
+        if len(self._batch) >= BATCH_FILES or self._batch_bytes >= BATCH_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self._submit(self._batch)
+            self._batch = []
+            self._batch_bytes = 0
+
+    def _check(self):
+        check_cancel(self.cancel)
+        if self._abort.is_set():
+            raise Cancelled()
+
+    def _submit(self, batch):
+        try:
+            self._check()
+        except Cancelled as e:
+            # Hand a failed copy's own error to whoever is still adding files
+            raise self._first_error() or e
+        self._slots.acquire()  # Keeps the walk from racing ahead of the copies
+        future = self._pool.submit(self._run, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _run(self, batch):
+        try:
+            for src, dst, size in batch:
+                self._check()
+                self.copy_function(src, dst)
+                with self._lock:
+                    self.files_done += 1
+                    self.bytes_done += size
+                    files, total = self.files_done, self.bytes_done
+                if self.progress:
+                    self.progress(files, total)
+        except BaseException:
+            self._abort.set()
+            raise
+
+    def abort(self):
+        self._abort.set()
+
+    def _first_error(self):
+        error = None
+        for future in self._futures:
+            try:
+                future.result()
+            except Cancelled as e:
+                if self.cancel is not None and self.cancel.is_set():
+                    error = error or e
+            except BaseException as e:
+                if error is None or isinstance(error, Cancelled):
+                    error = e
+        return error
+
+    def finish(self):
+        """Wait for every copy and raise the first error, if any."""
+        try:
+            self._flush()
+            error = self._first_error()
+            if error:
+                raise error
+        finally:
+            self._pool.shutdown(wait=True)
+        return self.files_done, self.bytes_done
+
+@tracing.timed('copy')
+def copy_tree(src, dst, copy_function=copy_file, workers=COPY_WORKERS, progress=None, cancel=None):
+    """Parallel copytree(): directories are created during the walk while files copy behind it."""
+    copier = BatchCopier(copy_function, workers, progress, cancel)
+    try:
+        for root, _, files in os.walk(src):
+            rel_root = os.path.relpath(root, src)
+            dst_root = os.path.normpath(os.path.join(dst, rel_root))
+            os.makedirs(dst_root, exist_ok=True)
+            for fname in files:
+                copier.add(os.path.join(root, fname), os.path.join(dst_root, fname))
+    except BaseException:
+        copier.abort()
+        try:
+            copier.finish()
+        except BaseException:
+            pass
+        raise
+    result = copier.finish()
+    for root, _, _ in os.walk(src):
+        shutil.copystat(root, os.path.normpath(os.path.join(dst, os.path.relpath(root, src))))
+    return result
+
+def tree_size(path):
+    """Return (files, bytes) under path, or for path itself if it is a file."""
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            return 1, os.lstat(path).st_size
+        except OSError:
+            return 0, 0
+    files = total = 0
+    for root, _, fnames in os.walk(path):
+        for fname in fnames:
+            try:
+                total += os.lstat(os.path.join(root, fname)).st_size
+                files += 1
+            except OSError:
+                continue
+    return files, total
+
+def total_size(paths):
+    files = total = 0
+    for path in paths:
+        f, b = tree_size(path)
+        files += f
+        total += b
+    return files, total
+
+def remove_file(path):
+    """os.remove() that also removes read-only files on Windows, such as links to the blob store."""
+    try:
+        os.remove(path)
+    except PermissionError:
+        if os.name != 'nt':
+            raise
+        os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
+
+def rmtree(path, ignore_errors=False):
+    """shutil.rmtree() that clears the read-only attribute blocking a delete on Windows."""
+    def onerror(function, failed, exc_info):
+        try:
+            if os.name != 'nt' or not issubclass(exc_info[0], PermissionError):
+                raise exc_info[1]
+            os.chmod(failed, stat.S_IWRITE)
+            function(failed)
+        except OSError:
+            if not ignore_errors:
+                raise
+    shutil.rmtree(path, onerror=onerror)
+
+def _remove_link_or_dir(path):
+    if os.path.islink(path) and os.name != 'nt':
+        os.remove(path)
+    else:
+        os.rmdir(path)  # Directory symlinks are removed like directories on Windows
+
+def remove_tree(path, progress=None, cancel=None):
+    """rmtree() that reports progress(files, bytes) and stops between files when cancelled.
+
+    Directory symlinks are removed, never followed. Returns (files, bytes) removed.
+    """
+    files = total = 0
+    def removed(size):
+        nonlocal files, total
+        files += 1
+        total += size
+        if progress:
+            progress(files, total)
+    if not os.path.isdir(path) or os.path.islink(path):
+        size = os.lstat(path).st_size
+        if os.path.isdir(path):
+            _remove_link_or_dir(path)
+        else:
+            remove_file(path)
+        removed(size)
+        return files, total
+    for root, dirs, fnames in os.walk(path, topdown=False):
+        for fname in fnames:
+            check_cancel(cancel)
+            fpath = os.path.join(root, fname)
+            size = os.lstat(fpath).st_size
+            remove_file(fpath)
+            removed(size)
+        for dname in dirs:
+            _remove_link_or_dir(os.path.join(root, dname))
+    os.rmdir(path)
+    return files, total
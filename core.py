@@ -0,0 +1,616 @@
+import os
+import re
+import configparser
+import json
+import sys
+from hashcache import digest_cache, new_hash, configure as configure_hashing
+from filecompare import compare_files
+from worker import Cancelled, check_cancel
+from blobstore import BlobStore, STORE_DIR, STORE_ALGORITHM
+from applier import plan_apply, execute_plan, ADD, DELETE
+from linking import link_tree, STRATEGIES
+from copyengine import tree_size, total_size, remove_tree, rmtree
+from catalog import ProfileCatalog, manifest_digest
+from cfgindex import CfgIndex
+from vpk import is_vpk, same_vpk, cached_tree_digest
+from snapshots import SnapshotStore, SNAPSHOTS_DIR, DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_BYTES
+import tracing
+
+APP_NAME = "TF2 Config Manager"
+CONFIG_FILE = "config.ini"
+STATE_FILE = "state.json"
+STATE_VERSION = 1
+PROFILES_DIR = "profiles"
+
+IGNORED_FILES = {
+    "config.cfg",
+    "motd_entries.txt",
+    "sound.cache",
+}
+
+# Helper functions
+def ensure_dir(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+def load_config():
+    config = configparser.ConfigParser()
+    if os.path.exists(CONFIG_FILE):
+        config.read(CONFIG_FILE)
+    return config
+
+def save_config(config):
+    with open(CONFIG_FILE, 'w') as f:
+        config.write(f)
+
+def load_state():
+    """The last verified profile match (see match_profiles), or None."""
+    try:
+        with open(STATE_FILE, 'r') as f:
+            state = json.load(f)
+    except Exception:
+        return None
+    return state if state.get('version') == STATE_VERSION else None
+
+def save_state(state):
+    tmp_path = STATE_FILE + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(state, version=STATE_VERSION), f)
+        os.replace(tmp_path, STATE_FILE)
+    except OSError:
+        pass
+
+def get_tf2_dir(config):
+    return config['DEFAULT'].get('tf2_dir', '')
+
+def get_apply_strategy(config):
+    """How profile files are placed in tf: auto, reflink, hardlink, symlink or copy."""
+    strategy = config['DEFAULT'].get('apply_strategy', 'auto')
+    return strategy if strategy in STRATEGIES else 'auto'
+
+def get_snapshot_limits(config):
+    """(max age in days, max bytes) for pre-apply snapshots, or None when snapshots = off."""
+    section = config['DEFAULT']
+    if section.get('snapshots', 'on').lower() in ('off', 'no', 'false', '0'):
+        return None
+    try:
+        max_age = float(section.get('snapshot_max_age_days', DEFAULT_MAX_AGE_DAYS))
+        max_bytes = int(float(section.get('snapshot_max_mb', DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024)
+    except ValueError as e:
+        tracing.warning("Ignoring snapshot settings: %s", e)
+        return DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_BYTES
+    return max_age, max_bytes
+
+def set_tf2_dir(config, path):
+    config['DEFAULT']['tf2_dir'] = path
+    save_config(config)
+
+def apply_hash_settings(config):
+    """Read the optional hash_buffer_size / hash_workers settings."""
+    section = config['DEFAULT']
+    try:
+        configure_hashing(section.get('hash_buffer_size'), section.get('hash_workers'))
+    except ValueError as e:
+        tracing.warning("Ignoring hash settings: %s", e)
+
+def apply_trace_settings(config):
+    """Read the optional log_level (debug, info, warning, error) and trace_dir settings."""
+    section = config['DEFAULT']
+    try:
+        tracing.configure(section.get('log_level'), section.get('trace_dir'))
+    except ValueError as e:
+        tracing.warning("Ignoring log settings: %s", e)
+
+def tf_sources(tf2_dir):
+    return {folder: os.path.join(tf2_dir, folder) for folder in ['cfg', 'custom']}
+
+def backup_folders(tf2_dir, backup_dir, progress=None, cancel=None):
+    # Goes through the blob store, so content other profiles already hold is linked, not copied
+    profile_store.import_profile(backup_dir, tf_sources(tf2_dir), progress, cancel)
+
+def restore_folders(profile_dir, tf2_dir, strategy='auto'):
+    for folder in ['cfg', 'custom']:
+        src = os.path.join(profile_dir, folder)
+        dst = os.path.join(tf2_dir, folder)
+        if os.path.exists(dst):
+            rmtree(dst)
+        if os.path.exists(src):
+            link_tree(src, dst, strategy)
+
+def folders_to_delete(tf2_dir):
+    """Paths delete_folders() removes: all of tf/custom and the non-default entries of tf/cfg."""
+    import os
+    # List of default files/folders in tf/cfg (provided by user)
+    DEFAULT_CFG = set([
+        'unencrypted',
+        '360controller.cfg',
+        '360controller-linux.cfg',
+        'chapter1.cfg',
+        'chapter2.cfg',
+        'chapter3.cfg',
+        'config_default.cfg',
+        'mapcycle_beta_asteroid.txt',
+        'mapcycle_beta_ctf_2fort.txt',
+        'mapcycle_beta_mannpower.txt',
+        'mapcycle_default.txt',
+        'mapcycle_doomsday_event_247.txt',
+        'mapcycle_featured_maps.txt',
+        'mapcycle_halloween.txt',
+        'mapcycle_halloween_event_247.txt',
+        'mapcycle_hightower_event_247.txt',
+        'mapcycle_invasion_maps.txt',
+        'mapcycle_ladder.txt',
+        'mapcycle_lakeside_event_247.txt',
+        'mapcycle_mannpower.txt',
+        'mapcycle_quickplay_arena.txt',
+        'mapcycle_quickplay_attackdefense.txt',
+        'mapcycle_quickplay_ctf.txt',
+        'mapcycle_quickplay_koth.txt',
+        'mapcycle_quickplay_misc.txt',
+        'mapcycle_quickplay_passtime.txt',
+        'mapcycle_quickplay_payload.txt',
+        'mapcycle_quickplay_payloadrace.txt',
+        'motd_default.txt',
+        'motd_text_default.txt',
+        'mtp.cfg',
+        'pure_server_full.txt',
+        'pure_server_minimal.txt',
+        'pure_server_whitelist_example.txt',
+        'replay_example.cfg',
+        'server_247_mannpower.cfg',
+        'server_247_rounds.cfg',
+        'server_bootcamp.cfg',
+        'server_casual.cfg',
+        'server_casual_max_rounds_win_conditions.cfg',
+        'server_casual_max_rounds_win_conditions_custom.cfg',
+        'server_casual_max_rounds_win_conditions_mannpower.cfg',
+        'server_casual_rounds_win_conditions.cfg',
+        'server_casual_stopwatch_win_conditions.cfg',
+        'server_competitive.cfg',
+        'server_competitive_max_rounds_win_conditions.cfg',
+        'server_competitive_max_rounds_win_conditions_high_skill.cfg',
+        'server_competitive_rounds_win_conditions.cfg',
+        'server_competitive_rounds_win_conditions_high_skill.cfg',
+        'server_competitive_stopwatch_win_conditions.cfg',
+        'server_competitive_stopwatch_win_conditions_high_skill.cfg',
+        'server_custom.cfg',
+        'server_limited_rounds.cfg',
+        'server_limited_time.cfg',
+        'server_mannup.cfg',
+        'server_matchmaking_base.cfg',
+        'server_mvm.cfg',
+        'server_net_chan_extend.cfg',
+        'sfm_defaultanimationgroups.txt',
+        'sourcevr_tf.cfg',
+        'trusted_keys_base.txt',
+        'trusted_keys_example.txt',
+        'undo360controller.cfg',
+        'vscript_convar_allowlist.txt',
+    ])
+    targets = []
+    # Delete everything in tf/custom
+    custom_path = os.path.join(tf2_dir, 'custom')
+    if os.path.exists(custom_path):
+        targets.append(custom_path)
+    # Delete only non-default files/folders in tf/cfg
+    cfg_path = os.path.join(tf2_dir, 'cfg')
+    if os.path.exists(cfg_path):
+        for entry in os.listdir(cfg_path):
+            if entry not in DEFAULT_CFG:
+                targets.append(os.path.join(cfg_path, entry))
+    return targets
+
+def delete_folders(tf2_dir, progress=None, cancel=None):
+    files = total = 0
+    for path in folders_to_delete(tf2_dir):
+        check_cancel(cancel)
+        report = progress and (lambda f, b: progress(files + f, total + b))
+        try:
+            removed = remove_tree(path, report, cancel)
+        except Cancelled:
+            raise
+        except Exception:
+            if path == os.path.join(tf2_dir, 'custom'):
+                raise
+            continue  # A cfg entry that cannot be removed is left in place
+        files += removed[0]
+        total += removed[1]
+
+def save_profile_metadata(profile_path, name, desc, launch_options):
+    meta = {
+        'name': name,
+        'description': desc,
+        'launch_options': launch_options
+    }
+    with open(os.path.join(profile_path, 'profile.json'), 'w') as f:
+        json.dump(meta, f)
+    entry = profile_catalog.update(profile_path)
+    if entry['manifest_digest'] is not None:
+        cfg_index.update(entry, profile_store.manifest)
+
+def load_profile_metadata(profile_path):
+    # Served from the catalog, which only re-reads profile.json if its mtime changed
+    entry = profile_catalog.get(profile_path)
+    return {'name': entry['name'], 'description': entry['description'], 'launch_options': entry['launch_options']}
+
+def resource_path(relative_path):
+    try:
+        base_path = sys._MEIPASS
+    except AttributeError:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+# Characters Windows does not allow in a file name, path separators included
+_UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+def profile_path_for(name):
+    """Folder for a new profile named name; raises ValueError if nothing usable is left of the name.
+
+    Spaces become underscores, and separators, '..' and leading or trailing dots
+    are dropped, so no name (e.g. from a bundle) can point outside profiles/.
+    """
+    profile_id = _UNSAFE_NAME_CHARS.sub('', name.strip().replace(' ', '_')).replace('..', '').strip('.')
+    if not profile_id:
+        raise ValueError(f"'{name}' cannot be used as a profile name.")
+    profile_path = os.path.join(resource_path(PROFILES_DIR), profile_id)
+    check_profile_path(profile_path)
+    return profile_path
+
+def check_profile_path(profile_path):
+    """Raise ValueError unless profile_path is a folder directly inside the profiles folder."""
+    root = os.path.normcase(os.path.realpath(resource_path(PROFILES_DIR)))
+    if os.path.dirname(os.path.normcase(os.path.realpath(profile_path))) != root:
+        raise ValueError(f"{profile_path} is not inside the profiles folder.")
+
+def list_profiles():
+    return [entry['path'] for entry in profile_catalog.entries()]
+
+profile_store = BlobStore(os.path.join(resource_path(PROFILES_DIR), STORE_DIR))
+profile_catalog = ProfileCatalog(resource_path(PROFILES_DIR))
+cfg_index = CfgIndex(resource_path(PROFILES_DIR))
+snapshot_store = SnapshotStore(os.path.join(resource_path(PROFILES_DIR), SNAPSHOTS_DIR), profile_store)
+
+def adopt_profiles(cancel, profiles):
+    """Background job: bring every profile's manifest up to date, adopting profiles created before the blob store."""
+    for p in profiles:
+        check_cancel(cancel)
+        profile_store.manifest(p)
+
+@tracing.timed('match')
+def folder_hash_subset(target_folder, reference_folder, cancel=None):
+    """Hash files in target_folder that match files in reference_folder. Shows debug info for missing or different files.
+
+    Files are compared size-first and then chunk by chunk, stopping at the first difference;
+    a differing file contributes a mismatch marker instead of its digest.
+    """
+    subset_hash = new_hash()
+    any_files = False
+    for root, _, files in os.walk(reference_folder):
+        for fname in sorted(files):
+            check_cancel(cancel)
+            if fname in IGNORED_FILES:
+                tracing.debug("IGNORING: %s", fname)
+                continue
+            any_files = True
+            ref_fpath = os.path.join(root, fname)
+            relpath = os.path.relpath(ref_fpath, reference_folder)
+            tgt_fpath = os.path.join(target_folder, relpath)
+            tracing.debug("CHECKING: %s", relpath)
+            subset_hash.update(relpath.encode())
+            if os.path.exists(tgt_fpath):
+                try:
+                    same = same_vpk(tgt_fpath, ref_fpath) if is_vpk(fname) else None
+                    if same is None:
+                        equal, digest = compare_files(tgt_fpath, ref_fpath)
+                    else:
+                        equal, digest = same, cached_tree_digest(ref_fpath)
+                    if equal:
+                        subset_hash.update(digest.encode())
+                    else:
+                        tracing.info("MISMATCH: %s", relpath)
+                        subset_hash.update(b'__MISMATCH__')
+                except Exception as e:
+                    tracing.warning("ERROR reading %s: %s", relpath, e)
+                    continue
+            else:
+                tracing.info("MISSING: %s", relpath)
+                subset_hash.update(b'__MISSING__')
+    digest_cache.save()
+    if not any_files:
+        return None  # Special value for empty reference
+    return subset_hash.hexdigest()
+
+def match_profile_set(profiles, tf2_dir, cancel=None):
+    """Check every profile against tf2_dir in one pass, ignoring extra files in tf2_dir."""
+    return match_manifests([profile_store.manifest(p) for p in profiles], tf2_dir, cancel)
+
+@tracing.timed('match')
+def match_manifests(manifests, tf2_dir, cancel=None):
+    """Check store or bundle manifests against tf2_dir, returning one bool per manifest.
+
+    An inverted index maps each relpath to the (manifest, size, digest) entries expecting it,
+    so every tf file is stat'ed and read at most once however many manifests there are.
+    Manifests drop out at their first missing or differing file, found from stat(),
+    cached digests and .vpk directory trees first; only then are the uncached files
+    the remaining manifests still need hashed, all together on the hash_workers pool.
+    A .vpk is compared with the store's copy by directory tree (names, sizes and
+    CRCs), which reads kilobytes instead of the whole pack.
+    """
+    index = {}
+    for i, manifest in enumerate(manifests):
+        for relpath, entry in manifest['files'].items():
+            if os.path.basename(relpath) not in IGNORED_FILES:
+                index.setdefault(relpath, []).append((i, entry['size'], entry['digest']))
+    candidates = set(range(len(manifests)))
+    unhashed = []  # (relpath, tf path, [(manifest, digest)]) of files with no cached digest
+    for relpath, expected in index.items():
+        check_cancel(cancel)
+        if not candidates:
+            break
+        expected = [e for e in expected if e[0] in candidates]
+        if not expected:
+            continue
+        tf_path = os.path.join(tf2_dir, relpath)
+        tracing.count('files_stat')
+        try:
+            st = os.stat(tf_path)
+        except OSError:
+            tracing.info("MISSING: %s", relpath)
+            candidates.difference_update(i for i, _, _ in expected)
+            continue
+        sized = []
+        for i, size, expected_digest in expected:
+            if size == st.st_size:
+                sized.append((i, expected_digest))
+            else:
+                tracing.info("MISMATCH: %s", relpath)
+                candidates.discard(i)
+        digest = digest_cache.lookup(tf_path, st, STORE_ALGORITHM) if sized else None
+        if digest is None and sized and is_vpk(relpath):
+            undecided = []
+            for i, expected_digest in sized:
+                same = same_vpk(tf_path, profile_store.blob_path(expected_digest))
+                if same is None:
+                    undecided.append((i, expected_digest))
+                elif not same:
+                    tracing.info("MISMATCH: %s", relpath)
+                    candidates.discard(i)
+            sized = undecided
+        if digest is None:
+            if sized:
+                unhashed.append((relpath, tf_path, sized))
+            continue
+        for i, expected_digest in sized:
+            if digest != expected_digest:
+                tracing.info("MISMATCH: %s", relpath)
+                candidates.discard(i)
+    unhashed = [(relpath, tf_path, [e for e in sized if e[0] in candidates]) for relpath, tf_path, sized in unhashed]
+    unhashed = [u for u in unhashed if u[2]]
+    digests = digest_cache.digest_many([tf_path for _, tf_path, _ in unhashed], STORE_ALGORITHM, cancel)
+    for (relpath, _, sized), digest in zip(unhashed, digests):
+        for i, expected_digest in sized:
+            if digest != expected_digest:
+                tracing.info("MISMATCH: %s", relpath)
+                candidates.discard(i)
+    digest_cache.save()
+    return [i in candidates for i in range(len(manifests))]
+
+def tolerant_profile_match(profile_path, tf2_dir, cancel=None):
+    """Check if tf2_dir matches the profile, ignoring extra files in tf2_dir."""
+    return match_profile_set([profile_path], tf2_dir, cancel)[0]
+
+def tf_fingerprint(tf2_dir):
+    """Digest of the names, sizes and mtimes under tf/cfg and tf/custom; no file is read."""
+    from watcher import stat_snapshot
+    h = new_hash('sha256')
+    for relpath, (size, mtime_ns) in sorted(stat_snapshot(tf2_dir, IGNORED_FILES).items()):
+        h.update(f"{relpath}\0{size}\0{mtime_ns}\n".encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+def _discard_profile(profile_path):
+    check_profile_path(profile_path)
+    profile_store.release_profile(profile_path)
+    rmtree(profile_path, ignore_errors=True)
+    profile_catalog.remove(profile_path)
+    cfg_index.remove(profile_path)
+
+def create_profile_job(job, profile_path, sources, name, desc, launch_opts):
+    """Job: import sources {folder: path} into a new profile, removing it again on failure."""
+    check_profile_path(profile_path)
+    job.set_total(*total_size(p for p in sources.values() if p and os.path.exists(p)))
+    try:
+        ensure_dir(profile_path)
+        profile_store.import_profile(profile_path, sources, job.progress, job.cancel)
+        save_profile_metadata(profile_path, name, desc, launch_opts or "")
+    except BaseException:
+        _discard_profile(profile_path)
+        raise
+
+def save_profile_job(job, profile_path, name, desc, launch_opts):
+    """Job: save edited metadata, bringing the profile's manifest up to date first.
+
+    Not done on the Tk thread: the manifest needs the blob store, which an
+    import holds for as long as it copies.
+    """
+    profile_store.manifest(profile_path)
+    save_profile_metadata(profile_path, name, desc, launch_opts)
+
+def inspect_bundle(cancel, bundle_path, tf2_dir):
+    """Background job: (metadata, file count, size, matches tf2_dir) from a bundle's index alone."""
+    from bundle import ProfileBundle  # zipfile is only needed when bundles are used
+    with ProfileBundle(bundle_path) as bundle:
+        matches = bool(tf2_dir) and match_manifests([bundle.manifest], tf2_dir, cancel)[0]
+        return bundle.meta, len(bundle.files), bundle.total_size, matches
+
+def import_bundle_job(job, bundle_path, profile_path, name):
+    """Job: create a profile from a bundle, streaming its entries into the store."""
+    from bundle import ProfileBundle
+    check_profile_path(profile_path)
+    with ProfileBundle(bundle_path) as bundle:
+        job.set_total(len(bundle.files), bundle.total_size)
+        try:
+            ensure_dir(profile_path)
+            profile_store.import_bundle(profile_path, bundle, job.progress, job.cancel)
+            save_profile_metadata(profile_path, name, bundle.meta.get('description', ''), bundle.meta.get('launch_options', ''))
+        except BaseException:
+            _discard_profile(profile_path)
+            raise
+
+def export_profile_job(job, profile_path, bundle_path):
+    """Job: write a profile and its metadata to a single bundle file."""
+    from bundle import export_bundle
+    manifest = profile_store.manifest(profile_path)
+    job.set_total(len(manifest['files']), sum(entry['size'] for entry in manifest['files'].values()))
+    export_bundle(profile_path, manifest, load_profile_metadata(profile_path), bundle_path, job.progress, job.cancel)
+
+def _execute_with_snapshot(job, plan, manifest, strategy, snapshot_limits, label):
+    # The snapshot is taken in a first phase and kept only if the apply commits. The plan is
+    # settled first, so the snapshot and the commit both cover exactly plan.changes.
+    plan.settle()
+    copies = sum(1 for op in plan.changes if op[0] != DELETE)
+    if not snapshot_limits:
+        job.set_total(copies, plan.bytes_to_copy)
+        execute_plan(plan, strategy, job.progress, job.cancel)
+        return
+    saved = [op for op in plan.changes if op[0] != ADD]
+    job.set_total(len(saved) + copies, sum(size for _, _, size, _ in saved) + plan.bytes_to_copy)
+    snapshot = snapshot_store.take(plan, manifest, label, job.progress, job.cancel)
+    job.next_phase()
+    try:
+        execute_plan(plan, strategy, job.progress, job.cancel)
+    except BaseException:
+        if snapshot:
+            snapshot_store.delete(snapshot['id'])
+        raise
+    snapshot_store.prune(*snapshot_limits)
+
+def apply_profile_job(job, plan, strategy, snapshot_limits=None):
+    """Job: carry out an ApplyPlan; cancelling before the commit leaves tf untouched.
+
+    With snapshot_limits (see get_snapshot_limits) the tf files the plan
+    overwrites or deletes are snapshotted first, so the apply can be undone.
+    """
+    name = load_profile_metadata(plan.profile_path).get('name') or os.path.basename(plan.profile_path)
+    _execute_with_snapshot(job, plan, profile_store.manifest(plan.profile_path), strategy, snapshot_limits,
+                           f"Before applying {name}")
+    profile_catalog.mark_applied(plan.profile_path)
+
+def restore_snapshot_job(job, snapshot_id, tf2_dir, strategy, snapshot_limits=None):
+    """Job: put the tf folder back the way a snapshot recorded it, in one transaction like an apply."""
+    with snapshot_store.restoring(snapshot_id, tf2_dir, job.cancel) as (plan, manifest):
+        _execute_with_snapshot(job, plan, manifest, strategy, snapshot_limits, f"Before restoring {snapshot_id}")
+
+def delete_snapshot_job(job, snapshot_id):
+    """Job: delete a snapshot, dropping its references to the blob store."""
+    snapshot_store.delete(snapshot_id)
+
+def delete_profile_job(job, profile_path, tf2_dir=None):
+    """Job: delete a profile and, when tf2_dir is given, the config it put in tf."""
+    job.set_total(*total_size([profile_path] + (folders_to_delete(tf2_dir) if tf2_dir else [])))
+    profile_store.delete_profile(profile_path, job.progress, job.cancel)
+    profile_catalog.remove(profile_path)
+    cfg_index.remove(profile_path)
+    if tf2_dir:
+        job.next_phase()
+        delete_folders(tf2_dir, job.progress, job.cancel)
+
+def _profile_folders():
+    # Every folder in profiles/, not just the catalog's: a profile being created has no catalog entry yet
+    root = resource_path(PROFILES_DIR)
+    return [os.path.join(root, name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))]
+
+def store_needs_collection(cancel):
+    """Background job: whether an interrupted job left the blob store needing collect_garbage_job."""
+    return profile_store.needs_collection()
+
+def collect_garbage_job(job):
+    """Job: recount the blob store's references from every profile and snapshot, removing unused blobs.
+
+    This also clears tmp/ files left behind by interrupted imports. Blobs that
+    running imports and snapshots hold as pending are kept.
+    """
+    profile_store.collect_garbage(_profile_folders, snapshot_store.held_digests)
+
+def fresh_install_job(job, tf2_dir):
+    """Job: delete the whole tf folder."""
+    job.set_total(*tree_size(tf2_dir))
+    remove_tree(tf2_dir, job.progress, job.cancel)
+
+def plan_profile_apply(cancel, profile_path, prev_profile_path, tf2_dir):
+    """Background job: dry-run an apply and return the ApplyPlan."""
+    prev_manifest = profile_store.manifest(prev_profile_path) if prev_profile_path else None
+    return plan_apply(profile_path, profile_store.manifest(profile_path), tf2_dir, prev_manifest, cancel)
+
+def diff_profiles(cancel, old_path, new_path):
+    """Background job: ManifestDiff from one profile to another, without reading any file."""
+    from profilediff import diff_manifests  # Like cfgparse, only loaded for the diff and report views
+    return diff_manifests(profile_store.manifest(old_path), profile_store.manifest(new_path), old_path, new_path, IGNORED_FILES)
+
+def diff_profile_tf(cancel, profile_path, tf2_dir, verify=False):
+    """Background job: ManifestDiff from the tf folder to a profile.
+
+    tf files are only read with verify, and then only those the profile also has
+    at the same size and the digest cache has no digest for; otherwise such files
+    come out unverified.
+    """
+    from profilediff import tf_manifest, diff_manifests
+    profile_manifest = profile_store.manifest(profile_path)
+    manifest = tf_manifest(tf2_dir, IGNORED_FILES, profile_manifest if verify else None, cancel)
+    return diff_manifests(manifest, profile_manifest, tf2_dir, profile_path, IGNORED_FILES)
+
+def search_cfgs(cancel, query, limit=500):
+    """Background job: the cfg lines, across every profile, that hold all the tokens of query.
+
+    The index is brought up to date first, which only reads cfgs whose content
+    it has not seen; each hit gets the profile's 'name' and 'profile_path'.
+    """
+    entries = profile_catalog.entries()
+    cfg_index.sync(entries, profile_store.manifest, cancel)
+    names = {entry['id']: entry['name'] for entry in entries}
+    hits = cfg_index.search(query, limit)
+    for hit in hits:
+        hit['name'] = names.get(hit['profile'], hit['profile'])
+        hit['profile_path'] = profile_catalog.profile_dir(hit['profile'])
+    return hits
+
+def profile_cfg_report(cancel, profile_path):
+    """Background job: effective_config() of a profile's cfgs; parsed files are cached by their manifest digest."""
+    from cfgparse import effective_config
+    return effective_config(profile_path, profile_store.manifest(profile_path))
+
+def tf_cfg_report(cancel, tf2_dir):
+    """Background job: effective_config() of the tf folder's cfgs, hashing only .cfg files the digest cache lacks."""
+    from profilediff import tf_manifest
+    from cfgparse import effective_config
+    manifest = tf_manifest(tf2_dir, cancel=cancel)
+    for relpath, entry in manifest['files'].items():
+        if entry['digest'] is None and relpath.lower().endswith('.cfg'):
+            check_cancel(cancel)
+            try:
+                entry['digest'] = digest_cache.digest(os.path.join(tf2_dir, relpath), None, STORE_ALGORITHM)
+            except OSError:
+                continue
+    digest_cache.save()
+    return effective_config(tf2_dir, manifest)
+
+def match_profiles(cancel, profiles, tf2_dir, known=None):
+    """Background job: match every profile against tf2_dir, returned as a state dict for save_state().
+
+    The state records a stat-only fingerprint of the tf folder and a digest of
+    each profile's manifest. When known, an earlier state, has the same ones,
+    its matches still hold and no file content is read at all.
+    """
+    manifests = []
+    for p in profiles:
+        check_cancel(cancel)
+        manifests.append(profile_store.manifest(p))
+    digests = [manifest_digest(m) for m in manifests]
+    # Taken before matching, so a change made meanwhile shows up as a mismatch next time
+    fingerprint = tf_fingerprint(tf2_dir)
+    if (known and known.get('tf2_dir') == tf2_dir and known.get('profiles') == profiles
+            and known.get('digests') == digests and known.get('fingerprint') == fingerprint):
+        matches = known['matches']
+    else:
+        matches = match_manifests(manifests, tf2_dir, cancel)
+    return {'tf2_dir': tf2_dir, 'profiles': profiles, 'digests': digests, 'fingerprint': fingerprint, 'matches': matches}
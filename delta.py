@@ -0,0 +1,168 @@
+import os
+import zlib
+import mmap
+import struct
+import hashlib
+
+# rsync-style binary deltas: the target is described as runs of blocks copied
+# from a basis file plus literal bytes. Blocks are found with a rolling
+# Adler-32 checksum and confirmed with a strong hash.
+
+MAGIC = b'TF2D'
+DELTA_VERSION = 1
+BLOCK_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+ADLER_MOD = 65521
+# The byte-by-byte roll runs in Python, so one delta rolls at most this many
+# bytes; after that only block-aligned content is matched, which still covers
+# files edited in place.
+ROLL_BUDGET = 4 * 1024 * 1024
+
+_HEADER = struct.Struct('<4sHIQ')  # magic, version, block size, target size
+_COPY = struct.Struct('<II')  # first basis block, number of blocks
+_LITERAL = struct.Struct('<I')  # length, followed by the bytes
+
+def _strong(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+def signature(basis_path, block_size=BLOCK_SIZE):
+    """{weak checksum: {strong digest: block index}} for every full block of the basis file."""
+    sig = {}
+    with open(basis_path, 'rb') as f:
+        index = 0
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            sig.setdefault(zlib.adler32(block), {}).setdefault(_strong(block), index)
+            index += 1
+    return sig
+
+class _DeltaWriter:
+    def __init__(self, out):
+        self.out = out
+        self.literal_bytes = 0
+        self._run = None  # [first block, count] of the copy run being extended
+
+    def copy(self, index):
+        if self._run and self._run[0] + self._run[1] == index:
+            self._run[1] += 1
+            return
+        self._flush_run()
+        self._run = [index, 1]
+
+    def literal(self, mm, start, end):
+        if start >= end:
+            return
+        self._flush_run()
+        for offset in range(start, end, CHUNK_SIZE):
+            data = mm[offset:min(end, offset + CHUNK_SIZE)]
+            self.out.write(b'L' + _LITERAL.pack(len(data)))
+            self.out.write(data)
+        self.literal_bytes += end - start
+
+    def _flush_run(self):
+        if self._run:
+            self.out.write(b'C' + _COPY.pack(*self._run))
+            self._run = None
+
+    def finish(self, digest):
+        self._flush_run()
+        self.out.write(b'E' + bytes([len(digest)]) + digest)
+
+def make_delta(basis_path, target_path, delta_path, max_ratio=0.5, block_size=BLOCK_SIZE, algorithm='sha256'):
+    """Write a delta that rebuilds target_path from basis_path.
+
+    Returns the target's hex digest, or None (and writes nothing) when more
+    than max_ratio of the target would have to be stored as literal bytes.
+    """
+    size = os.path.getsize(target_path)
+    sig = signature(basis_path, block_size)
+    if not size or not sig:
+        return None
+    max_literal = int(size * max_ratio)
+    tmp_path = delta_path + '.tmp'
+    try:
+        with open(target_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                open(tmp_path, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, DELTA_VERSION, block_size, size))
+            writer = _DeltaWriter(out)
+            budget = ROLL_BUDGET
+            pos = literal_start = 0
+            while pos + block_size <= size:
+                block = mm[pos:pos + block_size]
+                weak = zlib.adler32(block)
+                candidates = sig.get(weak)
+                index = candidates.get(_strong(block)) if candidates else None
+                if index is None:
+                    start = pos
+                    if budget > 0:
+                        # Slide the window a byte at a time, at most one block, looking for a known block
+                        a, b = weak & 0xffff, weak >> 16
+                        limit = min(size - block_size, pos + block_size, pos + budget)
+                        while pos < limit:
+                            out_byte, in_byte = mm[pos], mm[pos + block_size]
+                            a = (a - out_byte + in_byte) % ADLER_MOD
+                            b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+                            pos += 1
+                            candidates = sig.get((b << 16) | a)
+                            if candidates is not None:
+                                index = candidates.get(_strong(mm[pos:pos + block_size]))
+                                if index is not None:
+                                    break
+                        budget -= pos - start
+                    if index is None:
+                        if pos == start:
+                            pos += block_size  # Nothing left to roll over: the block becomes literal
+                        if writer.literal_bytes + pos - literal_start > max_literal:
+                            return None
+                        continue
+                writer.literal(mm, literal_start, pos)
+                writer.copy(index)
+                pos += block_size
+                literal_start = pos
+            writer.literal(mm, literal_start, size)
+            if writer.literal_bytes > max_literal:
+                return None
+            h = hashlib.new(algorithm)
+            h.update(mm)
+            writer.finish(h.digest())
+        os.replace(tmp_path, delta_path)
+        return h.hexdigest()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def apply_delta(basis_path, delta_path, out_path, algorithm='sha256'):
+    """Rebuild the target of a delta at out_path; raises ValueError if the result does not check out."""
+    h = hashlib.new(algorithm)
+    with open(delta_path, 'rb') as delta, open(basis_path, 'rb') as basis, open(out_path, 'wb') as out:
+        magic, version, block_size, size = _HEADER.unpack(delta.read(_HEADER.size))
+        if magic != MAGIC or version != DELTA_VERSION:
+            raise ValueError(f"{delta_path} is not a delta file")
+        while True:
+            kind = delta.read(1)
+            if kind == b'C':
+                first, count = _COPY.unpack(delta.read(_COPY.size))
+                basis.seek(first * block_size)
+                remaining = count * block_size
+                while remaining:
+                    data = basis.read(min(remaining, CHUNK_SIZE))
+                    if not data:
+                        raise ValueError(f"{basis_path} is shorter than the delta expects")
+                    out.write(data)
+                    h.update(data)
+                    remaining -= len(data)
+            elif kind == b'L':
+                (length,) = _LITERAL.unpack(delta.read(_LITERAL.size))
+                data = delta.read(length)
+                out.write(data)
+                h.update(data)
+            elif kind == b'E':
+                expected = delta.read(delta.read(1)[0])
+                break
+            else:
+                raise ValueError(f"{delta_path} is corrupt")
+        if out.tell() != size or h.digest() != expected:
+            raise ValueError(f"{delta_path} does not rebuild the original file")
+    return h.hexdigest()
@@ -0,0 +1,54 @@
+import os
+from hashcache import digest_cache, new_hash, settings
+import tracing
+
+def _compare_streams(fa, fb, h, chunk_size):
+    # Two reusable buffers filled with readinto(): memory stays at 2 * chunk_size however
+    # big the files are, and bytearray == bytearray is a plain memcmp.
+    buf_a, buf_b = bytearray(chunk_size), bytearray(chunk_size)
+    view_a, view_b = memoryview(buf_a), memoryview(buf_b)
+    while True:
+        n = fa.readinto(view_a)
+        m = fb.readinto(view_b)
+        tracing.count('bytes_read', n + m)
+        if m != n:
+            return False
+        if n < chunk_size:
+            if buf_a[:n] != buf_b[:n]:
+                return False
+            h.update(view_a[:n])
+            return True
+        if buf_a != buf_b:
+            return False
+        h.update(view_a)
+
+def compare_files(path_a, path_b, algorithm=None, chunk_size=None):
+    """Compare two files and return (equal, digest), with digest None when they differ.
+
+    Sizes are checked first and cached digests are used when both are known.
+    Otherwise the files are read side by side in fixed-size chunks, stopping at
+    the first difference; when they are equal the digest comes out of the same
+    pass and is cached for both paths.
+    """
+    algorithm = algorithm or settings['algorithm']
+    chunk_size = chunk_size or settings['buffer_size']
+    st_a = os.stat(path_a)
+    st_b = os.stat(path_b)
+    tracing.count('files_stat', 2)
+    if st_a.st_size != st_b.st_size:
+        return False, None
+    if os.path.samestat(st_a, st_b):
+        return True, digest_cache.digest(path_a, st_a, algorithm)
+    digest_a = digest_cache.lookup(path_a, st_a, algorithm)
+    digest_b = digest_cache.lookup(path_b, st_b, algorithm)
+    if digest_a is not None and digest_b is not None:
+        return (True, digest_a) if digest_a == digest_b else (False, None)
+    h = new_hash(algorithm)
+    with open(path_a, 'rb') as fa, open(path_b, 'rb') as fb:
+        tracing.count('files_opened', 2)
+        if not _compare_streams(fa, fb, h, chunk_size):
+            return False, None
+    digest = h.hexdigest()
+    digest_cache.remember(path_a, st_a, algorithm, digest)
+    digest_cache.remember(path_b, st_b, algorithm, digest)
+    return True, digest
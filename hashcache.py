@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from worker import check_cancel
+import tracing
+
+CACHE_FILE = "hash_cache.json"
+CACHE_VERSION = 2
+MAX_ENTRIES = 200000
+CHUNK_SIZE = 1024 * 1024
+# Files modified this recently are hashed but not cached, since a second write
+# inside the same mtime tick would otherwise go unnoticed.
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+# Buffer size and workers are tunable from config.ini through configure(). The
+# algorithm is the blob store's, since matching compares against manifest digests
+# and a second algorithm would only mean a second digest cached per file.
+settings = {
+    'algorithm': 'sha256',
+    'buffer_size': CHUNK_SIZE,
+    'workers': min(32, (os.cpu_count() or 1) + 4),
+}
+
+def configure(buffer_size=None, workers=None):
+    if buffer_size is not None:
+        settings['buffer_size'] = max(4096, int(buffer_size))
+    if workers is not None:
+        settings['workers'] = max(1, int(workers))
+
+def new_hash(algorithm=None):
+    return hashlib.new(algorithm or settings['algorithm'])
+
+def file_digest(path, algorithm=None, chunk_size=None):
+    """Hash a single file's contents."""
+    h = new_hash(algorithm)
+    buf = bytearray(chunk_size or settings['buffer_size'])
+    view = memoryview(buf)
+    total = 0
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(view)
+            if not n:
+                break
+            h.update(view[:n])
+            total += n
+    tracing.count('files_opened')
+    tracing.count('bytes_read', total)
+    return h.hexdigest()
+
+class DigestCache:
+    """Persistent file digest cache keyed by path, size, mtime_ns and inode.
+
+    Entries are kept in least-recently-used order and the oldest ones are
+    evicted once the cache holds more than max_entries files. One entry can
+    hold digests for several algorithms; a stat change invalidates all of them.
+    """
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self._entries.update(data.get('entries', {}))
+        except Exception:
+            pass
+
+    def lookup(self, fpath, st, algorithm=None):
+        """Return the cached digest of fpath, or None if it has to be read."""
+        algorithm = algorithm or settings['algorithm']
+        key = os.path.normcase(os.path.abspath(fpath))
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            digest = None
+            if entry is not None and entry[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+                self._entries.move_to_end(key)
+                digest = entry[3].get(algorithm)
+        tracing.count('digest_cache_misses' if digest is None else 'digest_cache_hits')
+        return digest
+
+    def remember(self, fpath, st, algorithm, digest):
+        """Record a digest computed elsewhere, e.g. while copying the file."""
+        if time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+            return
+        key = os.path.normcase(os.path.abspath(fpath))
+        sig = [st.st_size, st.st_mtime_ns, st.st_ino]
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None or entry[:3] != sig:
+                entry = sig + [{}]
+                self._entries[key] = entry
+            entry[3][algorithm] = digest
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def digest(self, fpath, st=None, algorithm=None):
+        """Return the digest of fpath, reading it only if its stat signature changed."""
+        algorithm = algorithm or settings['algorithm']
+        if st is None:
+            st = os.stat(fpath)
+            tracing.count('files_stat')
+        digest = self.lookup(fpath, st, algorithm)
+        if digest is None:
+            digest = file_digest(fpath, algorithm)
+            self.remember(fpath, st, algorithm, digest)
+        return digest
+
+    def digest_many(self, paths, algorithm=None, cancel=None):
+        """Digest many files, hashing the uncached ones concurrently.
+
+        hashlib and file reads release the GIL, so a thread pool keeps every core
+        busy. Unreadable files come back as None.
+        """
+        algorithm = algorithm or settings['algorithm']
+        digests = [None] * len(paths)
+        misses = []
+        tracing.count('files_stat', len(paths))
+        for i, fpath in enumerate(paths):
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            digests[i] = self.lookup(fpath, st, algorithm)
+            if digests[i] is None:
+                misses.append((i, fpath, st))
+        def work(item):
+            i, fpath, st = item
+            check_cancel(cancel)
+            try:
+                digests[i] = file_digest(fpath, algorithm)
+            except OSError:
+                return
+            self.remember(fpath, st, algorithm, digests[i])
+        if len(misses) == 1:
+            work(misses[0])
+        elif misses:
+            from concurrent.futures import ThreadPoolExecutor  # Only loaded once there is work for it
+            # Pool threads report into the caller's trace
+            pool = ThreadPoolExecutor(max_workers=settings['workers'], thread_name_prefix="tf2cm-hash",
+                                      initializer=tracing.bind, initargs=(tracing.current(),))
+            with tracing.span('hash', files=len(misses)), pool:
+                for _ in pool.map(work, misses):
+                    pass
+        return digests
+
+    def clear(self):
+        """Forget every digest, in memory only until the next save()."""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if anything changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump({'version': CACHE_VERSION, 'entries': self._entries}, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError:
+                pass
+
+# Shared by every hashing helper so the tf folder and all profiles hit one cache
+digest_cache = DigestCache()
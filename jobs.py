@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+from worker import Cancelled
+import tracing
+
+QUEUED = 'queued'
+RUNNING = 'running'
+
+class JobConflict(Exception):
+    """Raised when a job would touch a folder another job is still working on."""
+
+def _resource_key(path):
+    return os.path.normcase(os.path.realpath(path))
+
+class Job:
+    """One long file operation, run as fn(job, *args) off the Tk thread.
+
+    fn reports running totals through progress() (it fits BatchCopier's
+    progress callback) and passes job.cancel to anything that loops. A job
+    with several steps calls next_phase() between them so totals keep adding up.
+    """
+    def __init__(self, title, resources, fn, args, on_done, on_error):
+        self.title = title
+        self.resources = {_resource_key(path) for path in resources if path}
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel = threading.Event()
+        self.state = QUEUED
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self._base = (0, 0)
+
+    def set_total(self, files, nbytes=0):
+        self.files_total = files
+        self.bytes_total = nbytes
+
+    def progress(self, files, nbytes):
+        self.files_done = self._base[0] + files
+        self.bytes_done = self._base[1] + nbytes
+
+    def next_phase(self):
+        self._base = (self.files_done, self.bytes_done)
+
+    @property
+    def fraction(self):
+        if self.bytes_total:
+            return min(1.0, self.bytes_done / self.bytes_total)
+        if self.files_total:
+            return min(1.0, self.files_done / self.files_total)
+        return 0.0
+
+class JobQueue:
+    """Queue of file-operation jobs run on worker threads and reported back to Tk.
+
+    A job whose folders overlap one that is queued or running is refused with
+    JobConflict rather than run alongside it. While jobs are active,
+    on_progress(jobs) is called on the Tk thread every interval ms, which also
+    throttles the progress display however often the workers report.
+    """
+    def __init__(self, widget, on_progress, max_workers=2, interval=100):
+        from concurrent.futures import ThreadPoolExecutor  # Job itself is also used by the CLI, which has no queue
+        self.widget = widget
+        self.on_progress = on_progress
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tf2cm-job")
+        self._results = queue.Queue()
+        self._jobs = []
+        self._after_id = None
+
+    @property
+    def jobs(self):
+        return list(self._jobs)
+
+    def busy(self, path=None):
+        """True if any job is active, or one involving path when it is given."""
+        if path is None:
+            return bool(self._jobs)
+        key = _resource_key(path)
+        return any(key in job.resources for job in self._jobs)
+
+    def submit(self, title, resources, fn, args, on_done, on_error=None):
+        """Queue fn(job, *args); on_done(result) or on_error(exc) runs on the Tk thread.
+
+        on_error receives Cancelled when the job was cancelled.
+        """
+        job = Job(title, resources, fn, args, on_done, on_error)
+        for other in self._jobs:
+            if job.resources & other.resources:
+                raise JobConflict(f"'{other.title}' is still running on the same folder. "
+                                  f"Wait for it to finish or cancel it first.")
+        self._jobs.append(job)
+        self._executor.submit(self._run, job)
+        if self._after_id is None:
+            self._after_id = self.widget.after(0, self._drain)
+        return job
+
+    def cancel_all(self):
+        for job in self._jobs:
+            job.cancel.set()
+
+    def _run(self, job):
+        if job.cancel.is_set():
+            self._results.put((job, None, Cancelled()))
+            return
+        job.state = RUNNING
+        try:
+            with tracing.operation(job.title):
+                result = job.fn(job, *job.args)
+            self._results.put((job, result, None))
+        except Exception as e:
+            self._results.put((job, None, e))
+
+    def _drain(self):
+        self._after_id = None
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        for job, _, _ in finished:
+            self._jobs.remove(job)
+        self.on_progress(self.jobs)
+        for job, result, error in finished:
+            if error is None:
+                job.on_done(result)
+            elif job.on_error:
+                job.on_error(error)
+        if self._jobs:
+            self._after_id = self.widget.after(self.interval, self._drain)
+
+    def shutdown(self):
+        # Running jobs stop at their next cancellation check; an apply rolls itself back
+        self.cancel_all()
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,117 @@
+import os
+import sys
+import stat
+import errno
+import shutil
+from copyengine import copy_file, copy_tree, rmtree
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+STRATEGIES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from <linux/fs.h>
+# Compiled or binary assets nobody edits in place; these are the only ones safe to
+# share with a profile through a hardlink, since an in-place edit would change the
+# profile too. Text formats (.cfg, .res, .vmt, .txt...) are always reflinked or copied.
+READ_ONLY_EXTENSIONS = {
+    '.vpk', '.mdl', '.vtx', '.vvd', '.phy', '.ani', '.vtf',
+    '.wav', '.mp3', '.ttf', '.otf', '.bsp', '.pcf',
+}
+
+# (source st_dev, destination st_dev) -> whether FICLONE worked there
+_reflink_support = {}
+
+def is_read_only_asset(path):
+    return os.path.splitext(path)[1].lower() in READ_ONLY_EXTENSIONS
+
+def reflink(src, dst):
+    """Copy-on-write clone of src at dst (btrfs, XFS); raises OSError where unsupported."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    shutil.copystat(src, dst)
+
+def _make_writable(path):
+    # Blobs are read-only; a reflink or copy of one is a file of its own and must stay editable
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if not mode & stat.S_IWUSR:
+        os.chmod(path, mode | stat.S_IWUSR)
+
+def link_file(src, dst, strategy='auto'):
+    """Put src's content at dst as cheaply as the strategy and filesystems allow.
+
+    Tries a reflink first (detected once per filesystem pair), then a hardlink
+    for read-only assets, and falls back to a full copy. Returns the method used.
+    A reflink or copy is writable even when src is not.
+    """
+    if strategy in ('auto', 'reflink', 'symlink'):
+        key = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or '.').st_dev)
+        if _reflink_support.get(key, True):
+            try:
+                reflink(src, dst)
+                _reflink_support[key] = True
+                _make_writable(dst)
+                return 'reflink'
+            except OSError:
+                _reflink_support[key] = False
+    if strategy in ('auto', 'hardlink', 'symlink') and is_read_only_asset(src):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    copy_file(src, dst)
+    _make_writable(dst)
+    return 'copy'
+
+def link_tree(src, dst, strategy='auto'):
+    """Parallel copytree() that places every file with link_file().
+
+    With the symlink strategy, directories directly under a custom folder
+    (one per addon) become directory symlinks into the profile instead.
+    """
+    copy_function = lambda s, d: link_file(s, d, strategy)
+    if strategy != 'symlink' or os.path.basename(os.path.normpath(dst)) != 'custom':
+        copy_tree(src, dst, copy_function)
+        return
+    os.makedirs(dst, exist_ok=True)
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir():
+            try:
+                os.symlink(os.path.abspath(entry.path), target, target_is_directory=True)
+            except OSError:  # e.g. no symlink privilege on Windows
+                copy_tree(entry.path, target, copy_function)
+        else:
+            link_file(entry.path, target, strategy)
+
+def detach_symlinked_dirs(root, relpaths, strategy='auto'):
+    """Replace symlinked directories on the way to relpaths with real ones.
+
+    Changing files through a directory symlink would change the profile it
+    points into, so those directories are materialized before an apply.
+    """
+    seen = set()
+    for relpath in relpaths:
+        parts = relpath.split('/')
+        for depth in range(1, len(parts)):
+            path = os.path.join(root, *parts[:depth])
+            if path in seen:
+                continue
+            seen.add(path)
+            if os.path.islink(path):
+                tmp_path = path + '.tf2cm-detach'
+                rmtree(tmp_path, ignore_errors=True)
+                copy_tree(os.path.realpath(path), tmp_path, lambda s, d: link_file(s, d, strategy))
+                if os.name == 'nt':
+                    os.rmdir(path)  # Directory symlinks are removed like directories there
+                else:
+                    os.remove(path)
+                os.rename(tmp_path, path)
@@ -1,172 +1,28 @@
 import os
-import shutil
+import time
+import difflib
 import customtkinter as ctk
 import tkinter as tk  # Add this import for Listbox and Text
 from tkinter import filedialog, messagebox, simpledialog
-import configparser
-import json
-import hashlib
-import sys
-
-APP_NAME = "TF2 Config Manager"
-CONFIG_FILE = "config.ini"
-PROFILES_DIR = "profiles"
-
-IGNORED_FILES = {
-    "config.cfg",
-    "motd_entries.txt",
-    "sound.cache",
-}
-
-# Helper functions
-def ensure_dir(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-def load_config():
-    config = configparser.ConfigParser()
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-    return config
-
-def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        config.write(f)
-
-def get_tf2_dir(config):
-    return config['DEFAULT'].get('tf2_dir', '')
-
-def set_tf2_dir(config, path):
-    config['DEFAULT']['tf2_dir'] = path
-    save_config(config)
-
-def backup_folders(tf2_dir, backup_dir):
-    for folder in ['cfg', 'custom']:
-        src = os.path.join(tf2_dir, folder)
-        dst = os.path.join(backup_dir, folder)
-        if os.path.exists(src):
-            if os.path.exists(dst):
-                shutil.rmtree(dst)
-            shutil.copytree(src, dst)
-
-def restore_folders(profile_dir, tf2_dir):
-    for folder in ['cfg', 'custom']:
-        src = os.path.join(profile_dir, folder)
-        dst = os.path.join(tf2_dir, folder)
-        if os.path.exists(dst):
-            shutil.rmtree(dst)
-        if os.path.exists(src):
-            shutil.copytree(src, dst)
-
-def delete_folders(tf2_dir):
-    import os
-    # List of default files/folders in tf/cfg (provided by user)
-    DEFAULT_CFG = set([
-        'unencrypted',
-        '360controller.cfg',
-        '360controller-linux.cfg',
-        'chapter1.cfg',
-        'chapter2.cfg',
-        'chapter3.cfg',
-        'config_default.cfg',
-        'mapcycle_beta_asteroid.txt',
-        'mapcycle_beta_ctf_2fort.txt',
-        'mapcycle_beta_mannpower.txt',
-        'mapcycle_default.txt',
-        'mapcycle_doomsday_event_247.txt',
-        'mapcycle_featured_maps.txt',
-        'mapcycle_halloween.txt',
-        'mapcycle_halloween_event_247.txt',
-        'mapcycle_hightower_event_247.txt',
-        'mapcycle_invasion_maps.txt',
-        'mapcycle_ladder.txt',
-        'mapcycle_lakeside_event_247.txt',
-        'mapcycle_mannpower.txt',
-        'mapcycle_quickplay_arena.txt',
-        'mapcycle_quickplay_attackdefense.txt',
-        'mapcycle_quickplay_ctf.txt',
-        'mapcycle_quickplay_koth.txt',
-        'mapcycle_quickplay_misc.txt',
-        'mapcycle_quickplay_passtime.txt',
-        'mapcycle_quickplay_payload.txt',
-        'mapcycle_quickplay_payloadrace.txt',
-        'motd_default.txt',
-        'motd_text_default.txt',
-        'mtp.cfg',
-        'pure_server_full.txt',
-        'pure_server_minimal.txt',
-        'pure_server_whitelist_example.txt',
-        'replay_example.cfg',
-        'server_247_mannpower.cfg',
-        'server_247_rounds.cfg',
-        'server_bootcamp.cfg',
-        'server_casual.cfg',
-        'server_casual_max_rounds_win_conditions.cfg',
-        'server_casual_max_rounds_win_conditions_custom.cfg',
-        'server_casual_max_rounds_win_conditions_mannpower.cfg',
-        'server_casual_rounds_win_conditions.cfg',
-        'server_casual_stopwatch_win_conditions.cfg',
-        'server_competitive.cfg',
-        'server_competitive_max_rounds_win_conditions.cfg',
-        'server_competitive_max_rounds_win_conditions_high_skill.cfg',
-        'server_competitive_rounds_win_conditions.cfg',
-        'server_competitive_rounds_win_conditions_high_skill.cfg',
-        'server_competitive_stopwatch_win_conditions.cfg',
-        'server_competitive_stopwatch_win_conditions_high_skill.cfg',
-        'server_custom.cfg',
-        'server_limited_rounds.cfg',
-        'server_limited_time.cfg',
-        'server_mannup.cfg',
-        'server_matchmaking_base.cfg',
-        'server_mvm.cfg',
-        'server_net_chan_extend.cfg',
-        'sfm_defaultanimationgroups.txt',
-        'sourcevr_tf.cfg',
-        'trusted_keys_base.txt',
-        'trusted_keys_example.txt',
-        'undo360controller.cfg',
-        'vscript_convar_allowlist.txt',
-    ])
-    # Delete everything in tf/custom
-    custom_path = os.path.join(tf2_dir, 'custom')
-    if os.path.exists(custom_path):
-        shutil.rmtree(custom_path)
-    # Delete only non-default files/folders in tf/cfg
-    cfg_path = os.path.join(tf2_dir, 'cfg')
-    if os.path.exists(cfg_path):
-        for entry in os.listdir(cfg_path):
-            if entry not in DEFAULT_CFG:
-                full_path = os.path.join(cfg_path, entry)
-                try:
-                    if os.path.isdir(full_path):
-                        shutil.rmtree(full_path)
-                    else:
-                        os.remove(full_path)
-                except Exception:
-                    pass
-
-def save_profile_metadata(profile_path, name, desc, launch_options):
-    meta = {
-        'name': name,
-        'description': desc,
-        'launch_options': launch_options
-    }
-    with open(os.path.join(profile_path, 'profile.json'), 'w') as f:
-        json.dump(meta, f)
-
-def load_profile_metadata(profile_path):
-    try:
-        with open(os.path.join(profile_path, 'profile.json'), 'r') as f:
-            return json.load(f)
-    except Exception:
-        return {'name': os.path.basename(profile_path), 'description': '', 'launch_options': ''}
+from worker import BackgroundWorker, Cancelled
+from jobs import JobQueue, JobConflict, RUNNING
+from applier import recover_apply, format_size
+from profilediff import ADDED, REMOVED, CHANGED, UNVERIFIED, has_line_diff
+from profileindex import ProfileIndex
+import tracing
+from core import (
+    APP_NAME, CONFIG_FILE, PROFILES_DIR, IGNORED_FILES, ensure_dir, load_config, get_tf2_dir,
+    get_apply_strategy, set_tf2_dir, apply_hash_settings, apply_trace_settings, tf_sources,
+    load_profile_metadata, resource_path, list_profiles, profile_catalog, adopt_profiles,
+    create_profile_job, inspect_bundle, import_bundle_job, export_profile_job, apply_profile_job,
+    delete_profile_job, fresh_install_job, plan_profile_apply, match_profiles, load_state, save_state,
+    diff_profiles, diff_profile_tf, get_snapshot_limits, snapshot_store, restore_snapshot_job, search_cfgs,
+    store_needs_collection, collect_garbage_job, save_profile_job, delete_snapshot_job, profile_path_for,
+)
 
-def resource_path(relative_path):
-    try:
-        base_path = sys._MEIPASS
-    except AttributeError:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
+def bundle_filetypes():
+    from bundle import BUNDLE_EXTENSION  # zipfile is only loaded once bundles are used
+    return BUNDLE_EXTENSION, [("TF2 profile bundle", "*" + BUNDLE_EXTENSION), ("All files", "*.*")]
 
 def apply_icon(widget):
     """Set icon on a CTk window and ensure it sticks (CTk overrides after 200 ms)."""
@@ -181,95 +37,6 @@ def apply_icon(widget):
         except Exception:
             pass
 
-def list_profiles():
-    ensure_dir(resource_path(PROFILES_DIR))
-    return [os.path.join(resource_path(PROFILES_DIR), d) for d in os.listdir(resource_path(PROFILES_DIR)) if os.path.isdir(os.path.join(resource_path(PROFILES_DIR), d))]
-
-def folder_hash(folder):
-    """Make a hash of everything in a folder."""
-    if not os.path.exists(folder):
-        return None
-    hash_md5 = hashlib.md5()
-    for root, _, files in os.walk(folder):
-        for fname in sorted(files):
-            fpath = os.path.join(root, fname)
-            relpath = os.path.relpath(fpath, folder)
-            hash_md5.update(relpath.encode())
-            try:
-                with open(fpath, 'rb') as f:
-                    while True:
-                        chunk = f.read(4096)
-                        if not chunk:
-                            break
-                        hash_md5.update(chunk)
-            except Exception:
-                continue
-    return hash_md5.hexdigest()
-
-def folder_hash_subset(target_folder, reference_folder):
-    """Hash files in target_folder that match files in reference_folder. Shows debug info for missing or different files."""
-    import os, hashlib
-    hash_md5 = hashlib.md5()
-    any_files = False
-    for root, _, files in os.walk(reference_folder):
-        for fname in sorted(files):
-            if fname in IGNORED_FILES:
-                print(f"[DEBUG] IGNORING: {fname}")
-                continue
-            any_files = True
-            ref_fpath = os.path.join(root, fname)
-            relpath = os.path.relpath(ref_fpath, reference_folder)
-            tgt_fpath = os.path.join(target_folder, relpath)
-            print(f"[DEBUG] CHECKING: {relpath}")
-            hash_md5.update(relpath.encode())
-            if os.path.exists(tgt_fpath):
-                try:
-                    with open(tgt_fpath, 'rb') as f1, open(ref_fpath, 'rb') as f2:
-                        t1 = f1.read()
-                        t2 = f2.read()
-                        if t1 != t2:
-                            print(f"[DEBUG] MISMATCH: {relpath}")
-                        hash_md5.update(t1)
-                except Exception as e:
-                    print(f"[DEBUG] ERROR reading {relpath}: {e}")
-                    continue
-            else:
-                print(f"[DEBUG] MISSING: {relpath}")
-                hash_md5.update(b'__MISSING__')
-    if not any_files:
-        return None  # Special value for empty reference
-    return hash_md5.hexdigest()
-
-def tolerant_profile_match(profile_path, tf2_dir):
-    """Check if tf2_dir matches the profile, ignoring extra files in tf2_dir."""
-    profile_cfg = os.path.join(profile_path, 'cfg')
-    profile_custom = os.path.join(profile_path, 'custom')
-    tf_cfg = os.path.join(tf2_dir, 'cfg')
-    tf_custom = os.path.join(tf2_dir, 'custom')
-    cfg_hash = folder_hash_subset(tf_cfg, profile_cfg)
-    custom_hash = folder_hash_subset(tf_custom, profile_custom)
-    profile_cfg_hash = folder_hash_subset(profile_cfg, profile_cfg)
-    profile_custom_hash = folder_hash_subset(profile_custom, profile_custom)
-    # If the profile's cfg/custom is empty, only match if tf2's is also empty
-    cfg_match = (cfg_hash == profile_cfg_hash) and (cfg_hash is not None)
-    custom_match = (custom_hash == profile_custom_hash) and (custom_hash is not None)
-    # If profile's cfg/custom is empty, both hashes will be None
-    if profile_cfg_hash is None:
-        cfg_match = (cfg_hash is None)
-    if profile_custom_hash is None:
-        custom_match = (custom_hash is None)
-    return cfg_match and custom_match
-
-def profile_hash(profile_path):
-    cfg_hash = folder_hash(os.path.join(profile_path, 'cfg'))
-    custom_hash = folder_hash(os.path.join(profile_path, 'custom'))
-    return (cfg_hash, custom_hash)
-
-def current_tf_hash(tf2_dir):
-    cfg_hash = folder_hash(os.path.join(tf2_dir, 'cfg'))
-    custom_hash = folder_hash(os.path.join(tf2_dir, 'custom'))
-    return (cfg_hash, custom_hash)
-
 class ThemedInfoDialog(ctk.CTkToplevel):
     def __init__(self, master, message, title="Info"):
         super().__init__(master)
@@ -394,7 +161,7 @@ class DeleteProfileDialog(ctk.CTkToplevel):
         self.destroy()
 
 class NewProfileDialog(ctk.CTkToplevel):
-    def __init__(self, master, on_import_tf, on_import_custom):
+    def __init__(self, master, on_import_tf, on_import_custom, on_import_bundle):
         super().__init__(master)
         self.transient(master)
         self.grab_set()
@@ -403,13 +170,14 @@ class NewProfileDialog(ctk.CTkToplevel):
         apply_icon(self)
         self.configure(fg_color="#181818")
         self.title("New Profile")
-        self.geometry("350x160")
+        self.geometry("350x205")
         self.resizable(False, False)
         ctk.CTkLabel(self, text="How would you like to import the new profile?", font=("Segoe UI", 11), wraplength=320, text_color="#FFFFFF").pack(pady=(20,10))
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
         btn_frame.pack(pady=10)
         ctk.CTkButton(btn_frame, text="Import from current tf folder", width=220, height=36, font=("Segoe UI", 11), command=lambda: self._choose(on_import_tf), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(pady=5)
         ctk.CTkButton(btn_frame, text="Import from cfg/custom folders", width=220, height=36, font=("Segoe UI", 11), command=lambda: self._choose(on_import_custom), fg_color="#232323", text_color="#FFFFFF", corner_radius=12, hover_color="#FFA559").pack(pady=5)
+        ctk.CTkButton(btn_frame, text="Import from bundle file", width=220, height=36, font=("Segoe UI", 11), command=lambda: self._choose(on_import_bundle), fg_color="#232323", text_color="#FFFFFF", corner_radius=12, hover_color="#FFA559").pack(pady=5)
     def _choose(self, callback):
         self.destroy()
         callback()
@@ -520,10 +288,14 @@ class HelpDialog(ctk.CTkToplevel):
         text = (
             "TF2 Config Manager - Help & FAQ\n\n"
             "- Use the 'TF Folder' section to set or change your tf directory.\n"
+            "- 'Search cfgs' finds the lines in every profile's cfg files that use all the words you type, e.g. which profiles bind mouse4.\n"
+            "- Type in the search box above the list to show only profiles whose name or description contains the text.\n"
             "- 'New Profile' lets you save your current tf folder or import from other cfg/custom folders.\n"
             "- 'Apply Profile' will always delete your current profile files and replace them with those from the selected profile. No extra confirmation is required.\n"
             "- 'Edit' lets you change a profile's name, description, or launch options.\n"
+            "- 'Compare' lists how a profile differs from your tf folder or another profile, with line-by-line changes for cfg files.\n"
             "- 'Delete' removes a profile, and optionally deletes the config from your tf folder.\n"
+            "- Before every apply, the files it replaces or removes are snapshotted. 'Snapshots' restores or deletes them; old ones are pruned (snapshot_max_age_days / snapshot_max_mb in config.ini).\n"
             "- 'Fresh Install' will delete your entire tf folder (not just cfg/custom). This cannot be undone. You must verify integrity of your TF2 game files after.\n"
             "- The '[Current]' tag shows which profile (if any) matches your tf folder.\n"
             "- The program auto-detects changes to your tf/cfg and tf/custom folders."
@@ -535,7 +307,7 @@ class HelpDialog(ctk.CTkToplevel):
         ctk.CTkButton(self, text="Close", command=self.destroy, width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(pady=10)
 
 class ApplyProfileDialog(ctk.CTkToplevel):
-    def __init__(self, master, on_apply):
+    def __init__(self, master, on_apply, details=None):
         super().__init__(master)
         self.transient(master)
         self.grab_set()
@@ -544,11 +316,13 @@ class ApplyProfileDialog(ctk.CTkToplevel):
         apply_icon(self)
         self.configure(fg_color="#181818")
         self.title("Apply Profile")
-        self.geometry("400x180")
+        self.geometry("400x210" if details else "400x180")
         self.resizable(False, False)
         msg = (
             "This will delete the current config and apply the new profile."
         )
+        if details:
+            msg += f"\n\nChanges: {details}"
         ctk.CTkLabel(self, text=msg, font=("Segoe UI", 11), wraplength=370, justify='left', text_color="#FFFFFF").pack(padx=20, pady=(20,10))
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
         btn_frame.pack(pady=15)
@@ -647,7 +421,7 @@ class ThemedNewProfileDialog(ctk.CTkToplevel):
         self.destroy()
 
 class ThemedConfirmDialog(ctk.CTkToplevel):
-    def __init__(self, master, message, on_confirm, title="Confirm Delete"):
+    def __init__(self, master, message, on_confirm, title="Confirm Delete", confirm_text="Delete"):
         super().__init__(master)
         self.transient(master)
         self.grab_set()
@@ -661,12 +435,278 @@ class ThemedConfirmDialog(ctk.CTkToplevel):
         ctk.CTkLabel(self, text=message, font=("Segoe UI", 11), wraplength=380, justify='left', text_color="#FFA559").pack(padx=20, pady=(30,10))
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
         btn_frame.pack(pady=10)
-        ctk.CTkButton(btn_frame, text="Delete", command=lambda: self._confirm(on_confirm), width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=10)
+        ctk.CTkButton(btn_frame, text=confirm_text, command=lambda: self._confirm(on_confirm), width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=10)
         ctk.CTkButton(btn_frame, text="Cancel", command=self.destroy, width=120, height=36, font=("Segoe UI", 11), fg_color="#232323", text_color="#FFFFFF", corner_radius=12, hover_color="#FFA559").pack(side='left', padx=10)
     def _confirm(self, on_confirm):
         on_confirm()
         self.destroy()
 
+class CompareDialog(ctk.CTkToplevel):
+    """Lists how a profile differs from the tf folder or another profile, with line diffs for text files."""
+    TF_FOLDER = "tf folder"
+    MARKS = {ADDED: ('+', '#39ff14'), REMOVED: ('-', '#FF5555'), CHANGED: ('~', '#FFA559'), UNVERIFIED: ('?', '#888888')}
+
+    def __init__(self, master, worker, profile_path, profiles, profile_names, tf2_dir):
+        super().__init__(master)
+        self.transient(master)
+        self.grab_set()
+        self.focus()
+        self.lift()
+        apply_icon(self)
+        self.configure(fg_color="#181818")
+        self.worker = worker
+        self.profile_path = profile_path
+        self.tf2_dir = tf2_dir
+        self.others = {name: path for path, name in zip(profiles, profile_names) if path != profile_path}
+        self.diff = None
+        name = profile_names[profiles.index(profile_path)]
+        self.title(f"Compare {name}")
+        self.geometry("640x540")
+        top = ctk.CTkFrame(self, fg_color="transparent")
+        top.pack(pady=(14, 4))
+        ctk.CTkLabel(top, text=f"Compare {name} with", font=("Segoe UI", 11), text_color="#FFFFFF").pack(side='left', padx=6)
+        choices = ([self.TF_FOLDER] if tf2_dir else []) + list(self.others)
+        self.against = ctk.CTkOptionMenu(top, values=choices or [""], command=lambda _: self.compare(), width=180, font=("Segoe UI", 11), fg_color="#232323", button_color="#FFA559", button_hover_color="#FFB877")
+        self.against.pack(side='left', padx=6)
+        # Hashing tf files is opt-in: it reads the same-sized files the digest cache does not know yet
+        self.verify_btn = ctk.CTkButton(top, text="Verify", command=lambda: self.compare(verify=True), width=80, height=28, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877", state='disabled')
+        self.verify_btn.pack(side='left', padx=6)
+        self.summary_label = ctk.CTkLabel(self, text="", font=("Segoe UI", 10), text_color="#FFFFFF")
+        self.summary_label.pack(pady=(0, 4))
+        list_frame = ctk.CTkFrame(self, fg_color="transparent")
+        list_frame.pack(fill='x', padx=10)
+        scrollbar = tk.Scrollbar(list_frame, orient="vertical")
+        self.file_listbox = tk.Listbox(list_frame, height=10, bg="#232323", highlightthickness=0, selectbackground="#FFA559", selectforeground="#181818", relief="flat", font=("Consolas", 10), bd=0, fg="#ffffff", activestyle='none', yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.file_listbox.yview)
+        self.file_listbox.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        self.file_listbox.bind('<<ListboxSelect>>', self.on_select)
+        self.lines_text = ctk.CTkTextbox(self, height=200, font=("Consolas", 10), wrap='none', fg_color="#232323", text_color="#FFFFFF", border_color="#444444", corner_radius=8, state='disabled')
+        self.lines_text.pack(fill='both', expand=True, padx=10, pady=8)
+        ctk.CTkButton(self, text="Close", command=self.destroy, width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(pady=(0, 10))
+        if choices:
+            self.compare()
+
+    def compare(self, verify=False):
+        choice = self.against.get()
+        self.summary_label.configure(text="Verifying..." if verify else "Comparing...")
+        self.verify_btn.configure(state='disabled')
+        self.file_listbox.delete(0, tk.END)
+        self._show_lines("")
+        # The profile is the "new" side, so + means only in the profile and - only in the other side
+        if choice == self.TF_FOLDER:
+            self.worker.submit('compare', diff_profile_tf, (self.profile_path, self.tf2_dir, verify), self._show_diff, self._show_error)
+        else:
+            self.worker.submit('compare', diff_profiles, (self.others[choice], self.profile_path), self._show_diff, self._show_error)
+
+    def _show_diff(self, diff):
+        if not self.winfo_exists():
+            return
+        self.diff = diff
+        self.summary_label.configure(text=diff.summary())
+        if diff.count(UNVERIFIED):
+            self.verify_btn.configure(state='normal')
+        for i, (status, relpath, old_size, new_size) in enumerate(diff.entries):
+            mark, color = self.MARKS[status]
+            self.file_listbox.insert(tk.END, f"{mark} {relpath} ({format_size(new_size if old_size is None else old_size)})")
+            self.file_listbox.itemconfig(i, {'fg': color})
+
+    def _show_error(self, e):
+        if self.winfo_exists():
+            self.summary_label.configure(text=f"Could not compare: {e}")
+
+    def on_select(self, event):
+        idx = self.file_listbox.curselection()
+        if not idx or self.diff is None:
+            return
+        status, relpath = self.diff.entries[idx[0]][:2]
+        if status == UNVERIFIED or not has_line_diff(relpath):
+            self._show_lines("No line diff for this file.")
+            return
+        diff = self.diff
+        self.worker.submit('compare-lines', lambda cancel: diff.line_diff(relpath), (),
+                           lambda lines: self._show_lines("".join(lines) if lines is not None else "Binary or too large to show."),
+                           self._show_error)
+
+    def _show_lines(self, text):
+        if not self.winfo_exists():
+            return
+        self.lines_text.configure(state='normal')
+        self.lines_text.delete('1.0', 'end')
+        self.lines_text.insert('1.0', text)
+        self.lines_text.configure(state='disabled')
+
+class SnapshotsDialog(ctk.CTkToplevel):
+    """Lists the snapshots taken before each apply, to restore or delete them."""
+    def __init__(self, master, on_restore, on_delete):
+        super().__init__(master)
+        self.transient(master)
+        self.grab_set()
+        self.focus()
+        self.lift()
+        apply_icon(self)
+        self.configure(fg_color="#181818")
+        self.title("Snapshots")
+        self.geometry("520x360")
+        self.on_restore = on_restore
+        self.on_delete = on_delete
+        ctk.CTkLabel(self, text="Your tf folder as it was before each apply", font=("Segoe UI", 11), text_color="#FFFFFF").pack(pady=(14, 6))
+        list_frame = ctk.CTkFrame(self, fg_color="transparent")
+        list_frame.pack(fill='both', expand=True, padx=10)
+        scrollbar = tk.Scrollbar(list_frame, orient="vertical")
+        self.listbox = tk.Listbox(list_frame, height=10, bg="#232323", highlightthickness=0, selectbackground="#FFA559", selectforeground="#181818", relief="flat", font=("Segoe UI", 10), bd=0, fg="#ffffff", activestyle='none', yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.listbox.yview)
+        self.listbox.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        btn_frame = ctk.CTkFrame(self, fg_color="transparent")
+        btn_frame.pack(pady=10)
+        button_style = {"width": 110, "height": 36, "font": ("Segoe UI", 11), "fg_color": "#FFA559", "text_color": "#181818", "corner_radius": 12, "hover_color": "#FFB877"}
+        ctk.CTkButton(btn_frame, text="Restore", command=self.restore, **button_style).pack(side='left', padx=6)
+        ctk.CTkButton(btn_frame, text="Delete", command=self.delete, **button_style).pack(side='left', padx=6)
+        ctk.CTkButton(btn_frame, text="Close", command=self.destroy, **button_style).pack(side='left', padx=6)
+        self.refresh()
+
+    def refresh(self):
+        self.listbox.delete(0, tk.END)
+        self.snapshots = snapshot_store.list()
+        for snapshot in self.snapshots:
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot['created']))
+            count = len(snapshot['files']) + len(snapshot['absent'])
+            self.listbox.insert(tk.END, f"{created}  {snapshot['label']} ({count} files, {format_size(snapshot['stored_bytes'])})")
+        if not self.snapshots:
+            self.listbox.insert(tk.END, "No snapshots yet.")
+
+    def _selected(self):
+        idx = self.listbox.curselection()
+        if not idx or idx[0] >= len(self.snapshots):
+            NoProfileSelectedDialog(self, "Please select a snapshot.")
+            return None
+        return self.snapshots[idx[0]]
+
+    def restore(self):
+        snapshot = self._selected()
+        if snapshot:
+            ThemedConfirmDialog(self, f"Put your cfg and custom folders back as they were ({snapshot['label']})? "
+                                "The current files are snapshotted first.",
+                                lambda: (self.on_restore(snapshot), self.destroy()), title="Restore Snapshot", confirm_text="Restore")
+
+    def delete(self):
+        snapshot = self._selected()
+        if snapshot:
+            ThemedConfirmDialog(self, f"Delete the snapshot {snapshot['label']}?",
+                                lambda: self.on_delete(snapshot, lambda: self.winfo_exists() and self.refresh()),
+                                title="Delete Snapshot")
+
+class CfgSearchDialog(ctk.CTkToplevel):
+    """Finds cfg lines in every profile that use all the typed words, e.g. 'bind mouse4'."""
+    def __init__(self, master, worker, on_open):
+        super().__init__(master)
+        self.transient(master)
+        self.focus()
+        self.lift()
+        apply_icon(self)
+        self.configure(fg_color="#181818")
+        self.title("Search cfgs")
+        self.geometry("640x440")
+        self.worker = worker
+        self.on_open = on_open
+        self.hits = []
+        self.query_var = ctk.StringVar()
+        self.query_var.trace_add('write', lambda *_: self.search())
+        entry = ctk.CTkEntry(self, textvariable=self.query_var, placeholder_text="bind mouse4, alias +jump, cl_interp...", width=420, height=32, font=("Segoe UI", 11), fg_color="#232323", text_color="#FFFFFF", border_color="#444444", corner_radius=8)
+        entry.pack(pady=(14, 4))
+        entry.focus_set()
+        self.status_label = ctk.CTkLabel(self, text="", font=("Segoe UI", 10), text_color="#FFFFFF")
+        self.status_label.pack(pady=(0, 4))
+        list_frame = ctk.CTkFrame(self, fg_color="transparent")
+        list_frame.pack(fill='both', expand=True, padx=10)
+        scrollbar = tk.Scrollbar(list_frame, orient="vertical")
+        self.listbox = tk.Listbox(list_frame, bg="#232323", highlightthickness=0, selectbackground="#FFA559", selectforeground="#181818", relief="flat", font=("Consolas", 10), bd=0, fg="#ffffff", activestyle='none', yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.listbox.yview)
+        self.listbox.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        self.listbox.bind('<Double-Button-1>', lambda e: self.open_selected())
+        btn_frame = ctk.CTkFrame(self, fg_color="transparent")
+        btn_frame.pack(pady=10)
+        ctk.CTkButton(btn_frame, text="Show Profile", command=self.open_selected, width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=6)
+        ctk.CTkButton(btn_frame, text="Close", command=self.destroy, width=120, height=36, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=6)
+
+    def search(self):
+        query = self.query_var.get()
+        if not query.strip():
+            self.worker.cancel('cfg-search')
+            self._show_hits([])
+            return
+        self.worker.submit('cfg-search', search_cfgs, (query,), self._show_hits,
+                           lambda e: self.winfo_exists() and self.status_label.configure(text=f"Search failed: {e}"))
+
+    def _show_hits(self, hits):
+        if not self.winfo_exists():
+            return
+        self.hits = hits
+        self.listbox.delete(0, tk.END)
+        for hit in hits:
+            self.listbox.insert(tk.END, f"{hit['name']}: {hit['path']}:{hit['line']}: {hit['text']}")
+        profiles = len({hit['profile'] for hit in hits})
+        self.status_label.configure(text=f"{len(hits)} lines in {profiles} profiles" if hits else "")
+
+    def open_selected(self):
+        idx = self.listbox.curselection()
+        if idx:
+            self.on_open(self.hits[idx[0]]['profile_path'])
+
+class ListboxRows:
+    """Keeps a tk.Listbox showing rows of (key, text, colour), touching only the rows that differ.
+
+    A selected row that is filtered out is selected again when it comes back.
+    """
+    def __init__(self, listbox):
+        self.listbox = listbox
+        self.rows = []
+        self._chosen = None
+
+    def selected(self):
+        idx = self.listbox.curselection()
+        return self.rows[idx[0]][0] if idx else None
+
+    def select(self, key):
+        self._chosen = key
+        self.listbox.selection_clear(0, tk.END)
+        for i, row in enumerate(self.rows):
+            if row[0] == key:
+                self.listbox.selection_set(i)
+                self.listbox.see(i)
+                return True
+        return False
+
+    def update(self, rows):
+        selected = self.selected() or self._chosen
+        old_keys = [row[0] for row in self.rows]
+        new_keys = [row[0] for row in rows]
+        # Applied back to front so the indices of the earlier opcodes stay valid
+        for tag, i1, i2, j1, j2 in reversed(difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes()):
+            if tag == 'equal':
+                for k in range(i2 - i1):
+                    self._update_row(i1 + k, self.rows[i1 + k], rows[j1 + k])
+                continue
+            if tag in ('delete', 'replace'):
+                self.listbox.delete(i1, i2 - 1)
+            for k, (_, text, color) in enumerate(rows[j1:j2]):
+                self.listbox.insert(i1 + k, text)
+                self.listbox.itemconfig(i1 + k, {'fg': color})
+        self.rows = list(rows)
+        if selected is not None and self.selected() != selected:
+            self.select(selected)
+        self._chosen = selected
+
+    def _update_row(self, i, old, new):
+        if old[1] != new[1]:
+            self.listbox.delete(i)
+            self.listbox.insert(i, new[1])
+            self.listbox.itemconfig(i, {'fg': new[2]})
+        elif old[2] != new[2]:
+            self.listbox.itemconfig(i, {'fg': new[2]})
+
 class ProfileManager(ctk.CTkFrame):
     def __init__(self, master, config, on_change_tf2_dir):
         super().__init__(master)
@@ -674,22 +714,62 @@ class ProfileManager(ctk.CTkFrame):
         self.tf2_dir = get_tf2_dir(config)
         self.on_change_tf2_dir = on_change_tf2_dir
         self.launch_opts_var = ctk.StringVar()
+        self._watcher = None
+        self._worker = BackgroundWorker(self)
+        self._jobs = JobQueue(self, self._show_jobs)
+        self._job_bar_shown = False
+        self._state = load_state()  # Last verified match, shown until the new check finishes
+        self.profiles = []
+        self.profile_names = []
+        self._matches = None  # Per profile, from the last (or the saved) match; see _tag_current
+        self._verified = False
+        self._index = ProfileIndex()
         self.create_widgets()
+        self._recover_interrupted_apply()
         self.refresh_profiles()
-        self._last_hash = current_tf_hash(self.tf2_dir)
+        self._worker.submit('adopt', adopt_profiles, (list_profiles(),), lambda _: None)
+        self._worker.submit('store-check', store_needs_collection, (), self._on_store_checked)
+        # ctypes and the inotify thread can wait until the window is up
+        self.after_idle(self._start_watcher)
         self._poll_tf_folder()  # Start polling with after()
 
     def destroy(self):
         if hasattr(self, '_after_id'):
             self.after_cancel(self._after_id)
+        if self._watcher:
+            self._watcher.stop()
+        self._worker.shutdown()
+        self._jobs.shutdown()
         super().destroy()
 
+    def _recover_interrupted_apply(self):
+        try:
+            action = recover_apply(self.tf2_dir)
+        except Exception as e:
+            ThemedErrorDialog(self, f"Failed to recover an interrupted profile apply: {e}")
+            return
+        if action:
+            ThemedInfoDialog(self, f"A profile apply was interrupted last time and has been {action}.", title="Recovered")
+
+    def _on_store_checked(self, needed):
+        # Only after an interrupted job; the collection holds no folder another job needs
+        if needed:
+            self._jobs.submit("Cleaning up profile store", [resource_path(PROFILES_DIR)], collect_garbage_job,
+                              (), lambda _: None)
+
+    def _start_watcher(self):
+        from watcher import create_watcher
+        if self._watcher:
+            self._watcher.stop()
+        self._watcher = create_watcher(self.tf2_dir, IGNORED_FILES)
+        self._watcher.start()
+
     def _poll_tf_folder(self):
-        new_hash = current_tf_hash(self.tf2_dir)
-        if new_hash != self._last_hash:
-            self._last_hash = new_hash
+        # The watcher runs on its own thread; only its flag is checked here. Changes made
+        # by our own jobs are skipped, each job refreshes the list when it finishes.
+        if self._watcher and self._watcher.poll_changed() and not self._jobs.busy(self.tf2_dir):
             self.event_generate('<<TFRefresh>>', when='tail')
-        self._after_id = self.after(2000, self._poll_tf_folder)  # Poll every 2 seconds
+        self._after_id = self.after(250, self._poll_tf_folder)
 
     def create_widgets(self):
         # Top bar with tf folder label and entry (in rounded frame)
@@ -709,12 +789,18 @@ class ProfileManager(ctk.CTkFrame):
         ctk.CTkButton(btn_bar, text="Change tf Folder", command=self.change_tf2_dir, width=140, height=32, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=5)
         ctk.CTkButton(btn_bar, text="Fresh Install", command=self.fresh_install, width=140, height=32, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=5)
         ctk.CTkButton(btn_bar, text="Refresh Profiles", command=self.refresh_profiles, width=140, height=32, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=5)
+        ctk.CTkButton(btn_bar, text="Snapshots", command=self.show_snapshots, width=100, height=32, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=5)
+        ctk.CTkButton(btn_bar, text="Search cfgs", command=self.search_cfgs, width=100, height=32, font=("Segoe UI", 11), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left', padx=5)
 
         # Profile section as a contained card
-        profile_section = ctk.CTkFrame(self, fg_color="#232323", corner_radius=16, width=420, height=340)
+        profile_section = ctk.CTkFrame(self, fg_color="#232323", corner_radius=16, width=420, height=380)
         profile_section.pack(pady=(0, 10), anchor='center')
         profile_section.pack_propagate(False)
-        ctk.CTkLabel(profile_section, text="Profiles", font=("Segoe UI", 14, "bold"), text_color="#FFFFFF").pack(pady=(10, 4))
+        self.profiles_label = ctk.CTkLabel(profile_section, text="Profiles", font=("Segoe UI", 14, "bold"), text_color="#FFFFFF")
+        self.profiles_label.pack(pady=(10, 4))
+        self.search_var = ctk.StringVar()
+        self.search_var.trace_add('write', lambda *_: self._on_search())
+        ctk.CTkEntry(profile_section, textvariable=self.search_var, placeholder_text="Search profiles", width=340, height=28, font=("Segoe UI", 10), fg_color="#232323", text_color="#FFFFFF", border_color="#444444", corner_radius=8).pack(pady=(0, 6))
 
         # Profile listbox with modern style
         listbox_frame = ctk.CTkFrame(profile_section, fg_color="transparent")
@@ -734,11 +820,13 @@ class ProfileManager(ctk.CTkFrame):
             bd=0,
             fg="#ffffff",
             activestyle='none',
+            exportselection=False,
             yscrollcommand=scrollbar.set
         )
         scrollbar.config(command=self.profile_listbox.yview)
         self.profile_listbox.pack(side="left", padx=8, pady=2, fill="y")
         self.profile_listbox.bind('<<ListboxSelect>>', self.on_select)
+        self.profile_rows = ListboxRows(self.profile_listbox)
         self.bind('<<TFRefresh>>', lambda e: self.refresh_profiles())
 
         # Description section
@@ -765,52 +853,132 @@ class ProfileManager(ctk.CTkFrame):
         # Main action buttons
         btn_frame = ctk.CTkFrame(self, fg_color="transparent")
         btn_frame.pack(pady=(0, 10))
-        button_style = {"width": 120, "height": 36, "font": ("Segoe UI", 11), "fg_color": "#FFA559", "text_color": "#181818", "corner_radius": 12, "hover_color": "#FFB877"}
+        button_style = {"width": 100, "height": 36, "font": ("Segoe UI", 11), "fg_color": "#FFA559", "text_color": "#181818", "corner_radius": 12, "hover_color": "#FFB877"}
         ctk.CTkButton(btn_frame, text="Apply Profile", command=self.apply_profile, **button_style).pack(side='left', padx=6)
         ctk.CTkButton(btn_frame, text="New Profile", command=self.new_profile, **button_style).pack(side='left', padx=6)
         ctk.CTkButton(btn_frame, text="Delete", command=self.delete_profile, **button_style).pack(side='left', padx=6)
         ctk.CTkButton(btn_frame, text="Edit", command=self.edit_profile, **button_style).pack(side='left', padx=6)
+        ctk.CTkButton(btn_frame, text="Export", command=self.export_profile, **button_style).pack(side='left', padx=6)
+        ctk.CTkButton(btn_frame, text="Compare", command=self.compare_profile, **button_style).pack(side='left', padx=6)
+
+        # Progress of running file operations, only shown while a job is active
+        self.job_frame = ctk.CTkFrame(self, fg_color="#232323", corner_radius=16, width=420, height=70)
+        self.job_frame.pack_propagate(False)
+        self.job_label = ctk.CTkLabel(self.job_frame, text="", font=("Segoe UI", 10), text_color="#FFFFFF")
+        self.job_label.pack(pady=(8, 2))
+        job_row = ctk.CTkFrame(self.job_frame, fg_color="transparent")
+        job_row.pack()
+        self.job_progress = ctk.CTkProgressBar(job_row, width=300, progress_color="#FFA559")
+        self.job_progress.set(0)
+        self.job_progress.pack(side='left', padx=(0, 8))
+        ctk.CTkButton(job_row, text="Cancel", command=lambda: self._jobs.cancel_all(), width=70, height=24, font=("Segoe UI", 10), fg_color="#FFA559", text_color="#181818", corner_radius=12, hover_color="#FFB877").pack(side='left')
 
         # Add help button in the bottom right
         help_btn = ctk.CTkButton(self, text="?", width=32, height=32, font=("Segoe UI", 14, "bold"), command=self.show_help, fg_color="#232323", text_color="#FFA559", corner_radius=12, hover_color="#FFA559")
         help_btn.place(relx=1.0, rely=1.0, x=-14, y=-14, anchor='se')
         HelpTooltip(help_btn, "Click for help and FAQ.\n\n- Set your tf folder\n- Create, apply, edit, or delete profiles\n- Use Fresh Install for a clean config\n- '[Current]' tag shows which profile is active\n- See full help for more!")
 
-    def refresh_profiles(self):
-        self.profile_listbox.delete(0, tk.END)
-        self.profiles = list_profiles()
-        tf2_dir = self.tf2_dir
+    def refresh_profiles(self, select=None):
+        entries = profile_catalog.entries()
+        profiles = [entry['path'] for entry in entries]
+        if profiles != self.profiles:
+            self._matches = None
+        self.profiles = profiles
+        self.profile_names = [entry['name'] for entry in entries]
         self.current_profile_idx = None
-        for i, p in enumerate(self.profiles):
-            meta = load_profile_metadata(p)
-            is_current = tolerant_profile_match(p, tf2_dir)
-            print(f"[DEBUG] profile {meta['name']} is_current: {is_current}")
-            tag = ''
-            display_name = meta['name']
-            if is_current:
-                tag = ' [Current]'
-                self.current_profile_idx = i
-            if tag:
-                self.profile_listbox.insert(tk.END, f"{display_name}{tag}")
+        self._index.update(entries)
+        # Show the last verified result straight away, dimmed since it may be stale;
+        # current_profile_idx is only set once the background check confirms it
+        state = self._state
+        if state and state.get('tf2_dir') == self.tf2_dir and state.get('profiles') == profiles:
+            self._matches, self._verified = state['matches'], False
+        elif self._matches is not None:
+            self._verified = False
+        self._render_profiles()
+        if select in profiles:
+            self.show_profile(select)
+        else:
+            self.on_select(None)
+        self.profiles_label.configure(text="Profiles - verifying...")
+        # Matching reads files, so it runs in the background and tags rows when done
+        self._worker.submit('refresh', match_profiles, (profiles, self.tf2_dir, state),
+                            lambda result: self._show_matches(profiles, result),
+                            lambda e: self.profiles_label.configure(text="Profiles - check failed"))
+
+    def _tag_current(self, matches, verified):
+        self._matches, self._verified = matches, verified
+        self._render_profiles()
+
+    def _on_search(self):
+        self._render_profiles()
+        self.on_select(None)  # The selected profile may have been filtered out
+
+    def _render_profiles(self):
+        # Only rows that appear, disappear or change are touched, so typing in the
+        # search box or re-tagging [Current] does not rebuild the list
+        shown = self._index.search(self.search_var.get())
+        current_color = '#39ff14' if self._verified else '#7fbf6a'
+        rows = []
+        for i, (profile_path, display_name) in enumerate(zip(self.profiles, self.profile_names)):
+            if profile_path not in shown:
+                continue
+            if self._matches and self._matches[i]:
+                rows.append((profile_path, f"{display_name} [Current]", current_color))
             else:
-                self.profile_listbox.insert(tk.END, display_name)
-        self.desc_text.configure(state='normal')
-        self.desc_text.delete('1.0', 'end')
-        self.desc_text.configure(state='disabled')
-        self.launch_opts_var.set("")
-        for i in range(self.profile_listbox.size()):
-            text = self.profile_listbox.get(i)
-            if '[Current]' in text:
-                self.profile_listbox.itemconfig(i, {'fg': '#39ff14'})
+                rows.append((profile_path, display_name, '#ffffff'))
+        self.profile_rows.update(rows)
+
+    def _show_matches(self, profiles, state):
+        if profiles != self.profiles:
+            return
+        matches = state['matches']
+        for i, is_current in enumerate(matches):
+            tracing.debug("profile %s is_current: %s", self.profile_names[i], is_current)
+        self.current_profile_idx = matches.index(True) if True in matches else None
+        self._tag_current(matches, verified=True)
+        self.profiles_label.configure(text="Profiles")
+        if state != self._state:
+            self._state = state
+            save_state(state)
+
+    def _show_jobs(self, jobs):
+        if not jobs:
+            if self._job_bar_shown:
+                self.job_frame.pack_forget()
+                self._job_bar_shown = False
+            return
+        if not self._job_bar_shown:
+            self.job_frame.pack(pady=(0, 10))
+            self._job_bar_shown = True
+        job = next((j for j in jobs if j.state == RUNNING), jobs[0])
+        text = f"{job.title}: {job.files_done}/{job.files_total} files, {format_size(job.bytes_done)} of {format_size(job.bytes_total)}"
+        if len(jobs) > 1:
+            text += f" (+{len(jobs) - 1} more)"
+        if job.cancel.is_set():
+            text += " - cancelling..."
+        self.job_label.configure(text=text)
+        self.job_progress.set(job.fraction)
+
+    def _start_job(self, title, resources, fn, args, on_done, failure):
+        """Queue a file operation; failure prefixes the error message if it fails."""
+        def on_error(e):
+            self.refresh_profiles()
+            if isinstance(e, Cancelled):
+                ThemedInfoDialog(self, f"{title} was cancelled.", title="Cancelled")
             else:
-                self.profile_listbox.itemconfig(i, {'fg': '#ffffff'})
+                ThemedErrorDialog(self, f"{failure}: {e}")
+        try:
+            self._jobs.submit(title, resources, fn, args, on_done, on_error)
+        except JobConflict as e:
+            ThemedErrorDialog(self, str(e))
+
+    def _job_succeeded(self, message, title="Success"):
+        ThemedInfoDialog(self, message, title=title)
+        self.refresh_profiles()
 
     def on_select(self, event):
-        idx = self.profile_listbox.curselection()
-        if not idx:
-            return
-        profile_path = self.profiles[idx[0]]
-        meta = load_profile_metadata(profile_path)
+        profile_path = self.profile_rows.selected()
+        meta = load_profile_metadata(profile_path) if profile_path else {}
         self.desc_text.configure(state='normal')
         self.desc_text.delete('1.0', 'end')
         self.desc_text.insert('1.0', meta.get('description', ''))
@@ -818,67 +986,24 @@ class ProfileManager(ctk.CTkFrame):
         self.launch_opts_var.set(meta.get('launch_options', ''))
 
     def apply_profile(self):
-        idx = self.profile_listbox.curselection()
-        if not idx:
+        profile_path = self.profile_rows.selected()
+        if not profile_path:
             NoProfileSelectedDialog(self, "Please select a profile to apply.")
             return
-        profile_path = self.profiles[idx[0]]
         prev_profile_path = self.profiles[self.current_profile_idx] if self.current_profile_idx is not None else None
-        def delete_matching_files(src_folder, dst_folder):
-            if not os.path.exists(src_folder) or not os.path.exists(dst_folder):
-                return
-            for root, dirs, files in os.walk(src_folder):
-                rel_root = os.path.relpath(root, src_folder)
-                dst_root = os.path.join(dst_folder, rel_root) if rel_root != '.' else dst_folder
-                for file in files:
-                    dst_file = os.path.join(dst_root, file)
-                    if os.path.exists(dst_file):
-                        os.remove(dst_file)
-        def delete_cache_files(folder):
-            if not os.path.exists(folder):
+        def do_apply(plan):
+            self._start_job("Applying profile", [self.tf2_dir, profile_path], apply_profile_job,
+                            (plan, get_apply_strategy(self.config), get_snapshot_limits(self.config)),
+                            lambda _: self._job_succeeded("Profile applied successfully."), "Failed to apply profile")
+        def on_plan(plan):
+            # The plan is a dry run: nothing in the tf folder has changed yet
+            tracing.debug("apply plan: %s", plan.summary())
+            if self.current_profile_idx is not None:
+                ApplyProfileDialog(self, lambda: do_apply(plan), details=plan.summary())
                 return
-            for root, dirs, files in os.walk(folder):
-                for file in files:
-                    if file.endswith('.cache'):
-                        try:
-                            os.remove(os.path.join(root, file))
-                        except Exception:
-                            pass
-        def do_apply():
-            try:
-                # Delete only files that exist in the previous [current] profile
-                if prev_profile_path:
-                    for folder in ['cfg', 'custom']:
-                        prev_src = os.path.join(prev_profile_path, folder)
-                        dst = os.path.join(self.tf2_dir, folder)
-                        delete_matching_files(prev_src, dst)
-                # Copy/merge files from new profile to tf2_dir
-                for folder in ['cfg', 'custom']:
-                    src = os.path.join(profile_path, folder)
-                    dst = os.path.join(self.tf2_dir, folder)
-                    if os.path.exists(src):
-                        if not os.path.exists(dst):
-                            shutil.copytree(src, dst)
-                        else:
-                            for root, dirs, files in os.walk(src):
-                                rel_root = os.path.relpath(root, src)
-                                dst_root = os.path.join(dst, rel_root) if rel_root != '.' else dst
-                                if not os.path.exists(dst_root):
-                                    os.makedirs(dst_root)
-                                for file in files:
-                                    shutil.copy2(os.path.join(root, file), os.path.join(dst_root, file))
-                # Delete .cache files in tf/cfg and tf/custom AFTER copying
-                for folder in ['cfg', 'custom']:
-                    delete_cache_files(os.path.join(self.tf2_dir, folder))
-                ThemedInfoDialog(self, "Profile applied successfully.", title="Success")
-            except Exception as e:
-                ThemedErrorDialog(self, f"Failed to apply profile: {e}")
-        if self.current_profile_idx is not None:
-            def on_apply():
-                do_apply()
-            ApplyProfileDialog(self, on_apply)
-            return
-        do_apply()
+            do_apply(plan)
+        self._worker.submit('plan', plan_profile_apply, (profile_path, prev_profile_path, self.tf2_dir), on_plan,
+                            lambda e: ThemedErrorDialog(self, f"Failed to apply profile: {e}"))
 
     def new_profile(self):
         def import_from_tf():
@@ -889,62 +1014,72 @@ class ProfileManager(ctk.CTkFrame):
             self._create_profile_from_folder(tf_folder)
         def import_from_custom():
             def on_submit(name, desc, launch_opts, cfg_folder, custom_folder):
-                profile_id = name.replace(' ', '_')
-                profile_path = os.path.join(resource_path(PROFILES_DIR), profile_id)
-                if os.path.exists(profile_path):
-                    ThemedErrorDialog(self, "A profile with this name already exists.")
+                profile_path = self._new_profile_path(name)
+                if not profile_path:
                     return
-                try:
-                    ensure_dir(profile_path)
-                    dst_cfg = os.path.join(profile_path, 'cfg')
-                    dst_custom = os.path.join(profile_path, 'custom')
-                    shutil.copytree(cfg_folder, dst_cfg)
-                    shutil.copytree(custom_folder, dst_custom)
-                    save_profile_metadata(profile_path, name, desc, launch_opts or "")
-                    ThemedInfoDialog(self, "Profile created.", title="Success")
-                    self.refresh_profiles()
-                except Exception as e:
-                    ThemedErrorDialog(self, f"Failed to create profile: {e}")
+                sources = {'cfg': cfg_folder, 'custom': custom_folder}
+                self._start_job("Creating profile", [profile_path], create_profile_job,
+                                (profile_path, sources, name, desc, launch_opts),
+                                lambda _: self._job_succeeded("Profile created."), "Failed to create profile")
             CustomImportProfileDialog(self, on_submit)
-        NewProfileDialog(self, import_from_tf, import_from_custom)
+        def import_from_bundle():
+            bundle_path = filedialog.askopenfilename(title="Select a profile bundle", filetypes=bundle_filetypes()[1])
+            if not bundle_path:
+                return
+            def on_inspected(result):
+                meta, count, size, matches = result
+                name = meta.get('name') or os.path.splitext(os.path.basename(bundle_path))[0]
+                profile_path = self._new_profile_path(name)
+                if not profile_path:
+                    return
+                message = f"Import '{name}' ({count} files, {format_size(size)})?"
+                if matches:
+                    message += "\nIt matches your current tf folder."
+                def confirm_import():
+                    self._start_job("Importing bundle", [profile_path], import_bundle_job, (bundle_path, profile_path, name),
+                                    lambda _: self._job_succeeded("Profile imported."), "Failed to import bundle")
+                ThemedConfirmDialog(self, message, confirm_import, title="Import Bundle", confirm_text="Import")
+            # Only the bundle's index is read here, nothing is extracted
+            self._worker.submit('bundle', inspect_bundle, (bundle_path, self.tf2_dir), on_inspected,
+                                lambda e: ThemedErrorDialog(self, f"Failed to read bundle: {e}"))
+        NewProfileDialog(self, import_from_tf, import_from_custom, import_from_bundle)
+
+    def _new_profile_path(self, name):
+        """Folder for a new profile named name, or None after telling the user why there is none."""
+        try:
+            profile_path = profile_path_for(name)
+        except ValueError as e:
+            ThemedErrorDialog(self, str(e))
+            return None
+        if os.path.exists(profile_path):
+            ThemedErrorDialog(self, "A profile with this name already exists.")
+            return None
+        return profile_path
 
     def _create_profile_from_folder(self, tf_folder):
         def on_submit(name, desc, launch_opts):
-            profile_id = name.replace(' ', '_')
-            profile_path = os.path.join(resource_path(PROFILES_DIR), profile_id)
-            if os.path.exists(profile_path):
-                ThemedErrorDialog(self, "A profile with this name already exists.")
+            profile_path = self._new_profile_path(name)
+            if not profile_path:
                 return
-            try:
-                ensure_dir(profile_path)
-                backup_folders(tf_folder, profile_path)
-                save_profile_metadata(profile_path, name, desc, launch_opts or "")
-                ThemedInfoDialog(self, "Profile created.", title="Success")
-                self.refresh_profiles()
-            except Exception as e:
-                ThemedErrorDialog(self, f"Failed to create profile: {e}")
+            self._start_job("Creating profile", [tf_folder, profile_path], create_profile_job,
+                            (profile_path, tf_sources(tf_folder), name, desc, launch_opts),
+                            lambda _: self._job_succeeded("Profile created."), "Failed to create profile")
         ThemedNewProfileDialog(self, on_submit)
 
     def delete_profile(self):
-        idx = self.profile_listbox.curselection()
-        if not idx:
+        profile_path = self.profile_rows.selected()
+        if not profile_path:
             NoProfileSelectedDialog(self, "Please select a profile to delete.")
             return
-        profile_path = self.profiles[idx[0]]
         meta = load_profile_metadata(profile_path)
-        is_current = (self.current_profile_idx == idx[0])
+        is_current = self.current_profile_idx is not None and self.profiles[self.current_profile_idx] == profile_path
         def on_confirm(delete_tf):
-            try:
-                shutil.rmtree(profile_path)
-                if delete_tf:
-                    delete_folders(self.tf2_dir)
-                msg = "Profile deleted."
-                if delete_tf:
-                    msg += "\nTF config deleted from tf directory."
-                ThemedInfoDialog(self, msg, title="Deleted")
-                self.refresh_profiles()
-            except Exception as e:
-                ThemedErrorDialog(self, f"Failed to delete profile: {e}")
+            msg = "Profile deleted."
+            if delete_tf:
+                msg += "\nTF config deleted from tf directory."
+            tf2_dir = self.tf2_dir if delete_tf else None
+            self._start_job("Deleting profile", [profile_path, tf2_dir], delete_profile_job, (profile_path, tf2_dir),
+                            lambda _: self._job_succeeded(msg, title="Deleted"), "Failed to delete profile")
         if is_current:
             DeleteProfileDialog(self, meta.get('name', os.path.basename(profile_path)), on_confirm)
         else:
@@ -958,25 +1093,71 @@ class ProfileManager(ctk.CTkFrame):
             )
 
     def edit_profile(self):
-        idx = self.profile_listbox.curselection()
-        if not idx:
+        profile_path = self.profile_rows.selected()
+        if not profile_path:
             NoProfileSelectedDialog(self, "Please select a profile to edit.")
             return
-        profile_path = self.profiles[idx[0]]
         meta = load_profile_metadata(profile_path)
         def on_save(new_name, new_desc, new_launch_opts):
-            save_profile_metadata(profile_path, new_name, new_desc, new_launch_opts)
-            self.refresh_profiles()
-            self.profile_listbox.selection_set(idx[0])
-            self.on_select(None)
+            self._start_job("Saving profile", [profile_path], save_profile_job,
+                            (profile_path, new_name, new_desc, new_launch_opts),
+                            lambda _: self.refresh_profiles(select=profile_path), "Failed to save profile")
         EditProfileDialog(self, meta, on_save)
 
+    def export_profile(self):
+        profile_path = self.profile_rows.selected()
+        if not profile_path:
+            NoProfileSelectedDialog(self, "Please select a profile to export.")
+            return
+        extension, filetypes = bundle_filetypes()
+        bundle_path = filedialog.asksaveasfilename(title="Export profile", defaultextension=extension,
+                                                   initialfile=os.path.basename(profile_path) + extension,
+                                                   filetypes=filetypes)
+        if not bundle_path:
+            return
+        self._start_job("Exporting profile", [profile_path, bundle_path], export_profile_job, (profile_path, bundle_path),
+                        lambda _: ThemedInfoDialog(self, f"Profile exported to {bundle_path}.", title="Exported"),
+                        "Failed to export profile")
+
+    def compare_profile(self):
+        profile_path = self.profile_rows.selected()
+        if not profile_path:
+            NoProfileSelectedDialog(self, "Please select a profile to compare.")
+            return
+        CompareDialog(self, self._worker, profile_path, self.profiles, self.profile_names, self.tf2_dir)
+
+    def search_cfgs(self):
+        CfgSearchDialog(self, self._worker, self.show_profile)
+
+    def show_profile(self, profile_path):
+        if not self.profile_rows.select(profile_path):
+            self.search_var.set("")  # Filtered out: clearing the search re-renders every row
+            self.profile_rows.select(profile_path)
+        self.on_select(None)
+
+    def show_snapshots(self):
+        def restore(snapshot):
+            self._start_job("Restoring snapshot", [self.tf2_dir], restore_snapshot_job,
+                            (snapshot['id'], self.tf2_dir, get_apply_strategy(self.config), get_snapshot_limits(self.config)),
+                            lambda _: self._job_succeeded("Snapshot restored."), "Failed to restore snapshot")
+        def delete(snapshot, on_deleted):
+            # Releasing its blobs waits for the store, which an import holds while it copies
+            self._start_job("Deleting snapshot", [snapshot_store.snapshot_dir(snapshot['id'])], delete_snapshot_job,
+                            (snapshot['id'],), lambda _: on_deleted(), "Failed to delete snapshot")
+        if not self.tf2_dir:
+            ThemedErrorDialog(self, "Set your tf folder first.")
+            return
+        SnapshotsDialog(self, restore, delete)
+
     def change_tf2_dir(self):
         path = filedialog.askdirectory(title="Select your tf folder (should contain cfg and custom)")
         if path:
             set_tf2_dir(self.config, path)
             self.tf2_dir = path
             self.tf2_dir_var.set(path)
+            self._recover_interrupted_apply()
+            self._start_watcher()
+            self.refresh_profiles()
             self.on_change_tf2_dir(path)
 
     def fresh_install(self):
@@ -985,11 +1166,9 @@ class ProfileManager(ctk.CTkFrame):
             ThemedErrorDialog(self, "Please select a valid tf folder first.")
             return
         def do_delete():
-            try:
-                shutil.rmtree(tf2_dir)
-                ThemedInfoDialog(self, "The entire 'tf' folder has been deleted.\n\nYou must now verify the integrity of game files for Team Fortress 2 in Steam before launching the game or applying any new profiles.", title="Fresh Install Complete")
-            except Exception as e:
-                ThemedErrorDialog(self, f"Failed to perform fresh install: {e}")
+            self._start_job("Fresh install", [tf2_dir], fresh_install_job, (tf2_dir,),
+                            lambda _: ThemedInfoDialog(self, "The entire 'tf' folder has been deleted.\n\nYou must now verify the integrity of game files for Team Fortress 2 in Steam before launching the game or applying any new profiles.", title="Fresh Install Complete"),
+                            "Failed to perform fresh install")
         FreshInstallDialog(self, do_delete)
 
     def show_help(self):
@@ -999,7 +1178,7 @@ class TF2ConfigManagerApp(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title(APP_NAME)
-        self.geometry("620x600")  # Increased window size
+        self.geometry("700x640")  # Increased window size
         self.resizable(True, True)  # Allow resizing
         apply_icon(self)
         self.font = ("Segoe UI", 10)
@@ -1008,6 +1187,8 @@ class TF2ConfigManagerApp(ctk.CTk):
         self.config_parser = load_config()
         if 'DEFAULT' not in self.config_parser:
             self.config_parser['DEFAULT'] = {}
+        apply_trace_settings(self.config_parser)
+        apply_hash_settings(self.config_parser)
         self.first_launch = not os.path.exists(CONFIG_FILE)
         self.after(100, self.startup_flow)
 
@@ -0,0 +1,170 @@
+import os
+import difflib
+from hashcache import digest_cache
+from worker import check_cancel
+from blobstore import PROFILE_FOLDERS, STORE_ALGORITHM
+from applier import format_size
+from vpk import is_vpk, same_vpk, diff_directories, read_directory
+import tracing
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+# Same size on both sides but no known digest for one of them, so it was not compared
+UNVERIFIED = 'unverified'
+STATUSES = (ADDED, REMOVED, CHANGED, UNVERIFIED)
+TEXT_EXTENSIONS = {'.cfg', '.txt', '.res'}
+MAX_TEXT_SIZE = 1024 * 1024
+
+def is_text_file(relpath):
+    return os.path.splitext(relpath)[1].lower() in TEXT_EXTENSIONS
+
+def has_line_diff(relpath):
+    """Whether ManifestDiff.line_diff can show more than the file's status."""
+    return is_text_file(relpath) or is_vpk(relpath)
+
+def tf_manifest(tf2_dir, ignored=(), verify_against=None, cancel=None):
+    """A manifest-shaped view of tf/cfg and tf/custom built from stat() and the digest cache.
+
+    Files whose digest is not cached get None as digest. With verify_against,
+    a manifest, the uncached files it also lists at the same size are hashed
+    (and cached) on the hash_workers pool so they can be compared; tf-only
+    files and ones whose size already differs are never read. .vpk files are
+    left to diff_manifests, which compares their directory trees.
+    """
+    files = {}
+    for folder in PROFILE_FOLDERS:
+        stack = [os.path.join(tf2_dir, folder)]
+        while stack:
+            check_cancel(cancel)
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name not in ignored:
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            tracing.count('files_stat')
+                            relpath = os.path.relpath(entry.path, tf2_dir).replace(os.sep, '/')
+                            files[relpath] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                              'digest': digest_cache.lookup(entry.path, st, STORE_ALGORITHM), 'stat': st}
+            except OSError:
+                continue
+    if verify_against:
+        other = verify_against['files']
+        unhashed = [relpath for relpath, entry in files.items()
+                    if entry['digest'] is None and not is_vpk(relpath)
+                    and relpath in other and other[relpath]['size'] == entry['size']]
+        digests = digest_cache.digest_many([os.path.join(tf2_dir, relpath) for relpath in unhashed], STORE_ALGORITHM, cancel)
+        for relpath, digest in zip(unhashed, digests):
+            files[relpath]['digest'] = digest
+        digest_cache.save()
+    for entry in files.values():
+        del entry['stat']
+    return {'algorithm': STORE_ALGORITHM, 'files': files}
+
+class ManifestDiff:
+    """Differences between two manifests, going from old to new.
+
+    Entries are (status, relpath, old_size, new_size) with None for the side
+    that lacks the file. old_root and new_root are where each side's files
+    live, for line diffs of text files.
+    """
+    def __init__(self, old_root, new_root):
+        self.old_root = old_root
+        self.new_root = new_root
+        self.entries = []
+        self.unchanged = 0
+
+    def add(self, status, relpath, old_size, new_size):
+        self.entries.append((status, relpath, old_size, new_size))
+
+    def count(self, status):
+        return sum(1 for entry in self.entries if entry[0] == status)
+
+    def summary(self):
+        growth = sum((new or 0) - (old or 0) for _, _, old, new in self.entries)
+        parts = [f"{self.count(status)} {status}" for status in STATUSES if status != UNVERIFIED or self.count(status)]
+        sign = '-' if growth < 0 else '+'
+        return f"{', '.join(parts)}, {self.unchanged} identical ({sign}{format_size(abs(growth))})"
+
+    def to_dict(self):
+        return {
+            'old': self.old_root, 'new': self.new_root, 'unchanged': self.unchanged,
+            'files': [{'status': status, 'path': relpath, 'old_size': old, 'new_size': new}
+                      for status, relpath, old, new in self.entries],
+        }
+
+    def line_diff(self, relpath, context=3):
+        """Unified diff lines for a text file, entry lines for a .vpk, or None if it is binary or too big to show."""
+        if is_vpk(relpath):
+            return _vpk_lines(os.path.join(self.old_root, relpath), os.path.join(self.new_root, relpath))
+        old_lines = _read_text(self.old_root, relpath)
+        new_lines = _read_text(self.new_root, relpath)
+        if old_lines is None or new_lines is None:
+            return None
+        return list(difflib.unified_diff(old_lines, new_lines, f"a/{relpath}", f"b/{relpath}", n=context))
+
+def _vpk_lines(old_path, new_path):
+    # An added or removed pack lists all of its entries
+    try:
+        if not os.path.exists(old_path):
+            added, removed, changed = sorted(read_directory(new_path).entries), [], []
+        elif not os.path.exists(new_path):
+            added, removed, changed = [], sorted(read_directory(old_path).entries), []
+        else:
+            added, removed, changed = diff_directories(old_path, new_path)
+    except (OSError, ValueError):
+        return None
+    lines = [f"+ {p}\n" for p in added] + [f"- {p}\n" for p in removed] + [f"~ {p}\n" for p in changed]
+    return lines or ["  (same entries)\n"]
+
+def _read_text(root, relpath):
+    # A missing file reads as empty, so added and removed files diff against nothing
+    path = os.path.join(root, relpath)
+    try:
+        if os.path.getsize(path) > MAX_TEXT_SIZE:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    tracing.count('files_opened')
+    tracing.count('bytes_read', len(data))
+    if b'\0' in data:
+        return None
+    return data.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+@tracing.timed('diff')
+def diff_manifests(old, new, old_root, new_root, ignored=()):
+    """Compare two manifests by size and digest; no file is read, except the directory of a .vpk lacking a digest."""
+    diff = ManifestDiff(old_root, new_root)
+    comparable = old.get('algorithm') == new.get('algorithm')
+    old_files = {relpath: e for relpath, e in old['files'].items() if os.path.basename(relpath) not in ignored}
+    new_files = {relpath: e for relpath, e in new['files'].items() if os.path.basename(relpath) not in ignored}
+    for relpath in sorted(old_files.keys() | new_files.keys()):
+        before = old_files.get(relpath)
+        after = new_files.get(relpath)
+        if before is None:
+            diff.add(ADDED, relpath, None, after['size'])
+        elif after is None:
+            diff.add(REMOVED, relpath, before['size'], None)
+        elif before['size'] != after['size']:
+            diff.add(CHANGED, relpath, before['size'], after['size'])
+        elif not comparable or before['digest'] is None or after['digest'] is None:
+            same = same_vpk(os.path.join(old_root, relpath), os.path.join(new_root, relpath)) if is_vpk(relpath) else None
+            if same is None:
+                diff.add(UNVERIFIED, relpath, before['size'], after['size'])
+            elif same:
+                diff.unchanged += 1
+            else:
+                diff.add(CHANGED, relpath, before['size'], after['size'])
+        elif before['digest'] != after['digest']:
+            diff.add(CHANGED, relpath, before['size'], after['size'])
+        else:
+            diff.unchanged += 1
+    return diff
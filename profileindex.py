@@ -0,0 +1,64 @@
+GRAM_SIZE = 3
+
+def _grams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def _all_grams(text):
+    grams = set()
+    for size in range(1, GRAM_SIZE + 1):
+        grams |= _grams(text, size)
+    return grams
+
+class ProfileIndex:
+    """Case-insensitive substring index over profile names and descriptions, for filtering as the user types.
+
+    Every 1-, 2- and 3-character substring maps to the profiles containing it,
+    so a query only tests the profiles that have all of its trigrams (or its
+    one or two characters). A query that extends the previous one, as typing
+    does, only re-tests the previous matches. update() re-indexes only the
+    profiles whose text changed.
+    """
+    def __init__(self):
+        self._text = {}  # key -> lowercased "name\ndescription"
+        self._grams = {}  # substring -> set of keys
+        self._last = None  # (query, matches) of the previous search
+
+    def __len__(self):
+        return len(self._text)
+
+    def update(self, entries):
+        """Index catalog entries by their 'path', dropping profiles that are gone."""
+        texts = {entry['path']: f"{entry['name']}\n{entry.get('description') or ''}".lower() for entry in entries}
+        for key in [key for key, text in self._text.items() if texts.get(key) != text]:
+            self._remove(key)
+        for key, text in texts.items():
+            if key not in self._text:
+                self._add(key, text)
+        self._last = None
+
+    def _add(self, key, text):
+        self._text[key] = text
+        for gram in _all_grams(text):
+            self._grams.setdefault(gram, set()).add(key)
+
+    def _remove(self, key):
+        for gram in _all_grams(self._text.pop(key)):
+            keys = self._grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self._grams[gram]
+
+    def search(self, query):
+        """Keys of the profiles whose name or description contains query; every key for an empty query."""
+        query = query.strip().lower()
+        if not query:
+            return set(self._text)
+        if self._last and query.startswith(self._last[0]):
+            candidates = self._last[1]
+        else:
+            size = min(len(query), GRAM_SIZE)
+            sets = sorted((self._grams.get(gram, set()) for gram in _grams(query, size)), key=len)
+            candidates = sets[0].intersection(*sets[1:])
+        matches = {key for key in candidates if query in self._text[key]}
+        self._last = (query, matches)
+        return matches
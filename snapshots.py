@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from hashcache import digest_cache
+from worker import check_cancel
+from copyengine import rmtree
+from blobstore import STORE_ALGORITHM
+from applier import ADD, REPLACE, plan_apply
+from delta import make_delta, apply_delta
+import tracing
+
+SNAPSHOTS_DIR = ".snapshots"
+SNAPSHOT_FILE = "snapshot.json"
+SNAPSHOT_VERSION = 1
+# Smaller files are stored whole; a delta only pays off for big files edited in place
+DELTA_MIN_SIZE = 1024 * 1024
+MAX_DELTA_RATIO = 0.5
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+def _held_digests(snapshot):
+    return [entry.get('basis', entry['digest']) for entry in snapshot['files'].values()]
+
+class SnapshotStore:
+    """Snapshots of the tf files an apply is about to overwrite or delete.
+
+    Only those files are kept. Content the blob store already holds, usually
+    the previous profile's files, costs a reference. A large file is kept as
+    a block delta against the version the apply puts in its place, which the
+    blob store keeps for the profile anyway; other files are added to the
+    blob store. Files the apply creates are listed so a restore removes them.
+    """
+    def __init__(self, root, store):
+        self.root = root
+        self.store = store
+
+    def snapshot_dir(self, snapshot_id):
+        return os.path.join(self.root, snapshot_id)
+
+    def get(self, snapshot_id):
+        try:
+            with open(os.path.join(self.snapshot_dir(snapshot_id), SNAPSHOT_FILE), 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return snapshot if snapshot.get('version') == SNAPSHOT_VERSION else None
+
+    def list(self):
+        """Every snapshot, newest first."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        snapshots = [s for s in (self.get(name) for name in names) if s]
+        return sorted(snapshots, key=lambda s: s['created'], reverse=True)
+
+    def find(self, prefix):
+        """The snapshot whose id starts with prefix, if exactly one does."""
+        matches = [s for s in self.list() if s['id'].startswith(prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    @tracing.timed('snapshot')
+    def take(self, plan, manifest, label, progress=None, cancel=None):
+        """Snapshot what executing plan would overwrite or delete; manifest is the content the plan applies.
+
+        The plan is settle()d first, so the files snapshotted are the ones
+        execute_plan() goes on to change. Returns the snapshot, or None when the
+        plan changes nothing worth keeping.
+        """
+        plan.settle()
+        snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        snapshot_dir = self.snapshot_dir(snapshot_id)
+        files = {}
+        absent = []
+        stored = done_files = done_bytes = 0
+        os.makedirs(os.path.join(snapshot_dir, 'deltas'))
+        # Every blob is held from the moment it is found or stored until acquire() counts the snapshot's references
+        with self.store.hold() as pending:
+            try:
+                for action, relpath, _, _ in plan.changes:
+                    check_cancel(cancel)
+                    if relpath.endswith('.cache'):
+                        continue  # The game rebuilds these
+                    tf_path = os.path.join(plan.tf2_dir, relpath)
+                    try:
+                        st = os.stat(tf_path)
+                    except FileNotFoundError:
+                        absent.append(relpath)
+                        continue
+                    # Hashing is cheaper than storing: files the last apply put in place are usually in the store
+                    entry = {'size': st.st_size, 'digest': digest_cache.digest(tf_path, st, STORE_ALGORITHM)}
+                    if not pending.add(entry['digest']):
+                        basis = manifest['files'][relpath]['digest'] if action == REPLACE else None
+                        if basis and st.st_size >= DELTA_MIN_SIZE and pending.add(basis):
+                            delta_name = f"{len(files)}.delta"
+                            delta_path = os.path.join(snapshot_dir, 'deltas', delta_name)
+                            digest = make_delta(self.store.blob_path(basis), tf_path, delta_path, MAX_DELTA_RATIO,
+                                                algorithm=STORE_ALGORITHM)
+                            if digest is not None:
+                                entry.update(digest=digest, delta=delta_name, basis=basis)
+                                stored += os.path.getsize(delta_path)
+                        if 'delta' not in entry:
+                            entry['digest'] = self.store.store_file(tf_path, pending)
+                            stored += st.st_size
+                    files[relpath] = entry
+                    done_files += 1
+                    done_bytes += st.st_size
+                    if progress:
+                        progress(done_files, done_bytes)
+                if not files and not absent:
+                    rmtree(snapshot_dir, ignore_errors=True)
+                    return None
+                snapshot = {
+                    'version': SNAPSHOT_VERSION, 'id': snapshot_id, 'created': time.time(), 'label': label,
+                    'tf2_dir': plan.tf2_dir, 'algorithm': STORE_ALGORITHM, 'files': files, 'absent': absent,
+                    'stored_bytes': stored,
+                }
+                # Counted and recorded together, so collect_garbage() never sees one without the other
+                with self.store.locked():
+                    self.store.acquire(_held_digests(snapshot))
+                    try:
+                        tmp_path = os.path.join(snapshot_dir, SNAPSHOT_FILE + '.tmp')
+                        with open(tmp_path, 'w') as f:
+                            json.dump(snapshot, f)
+                        os.replace(tmp_path, os.path.join(snapshot_dir, SNAPSHOT_FILE))
+                    except BaseException:
+                        self.store.release(_held_digests(snapshot))
+                        raise
+            except BaseException:
+                # Blobs this snapshot stored that nothing else refers to go when the holds are dropped
+                rmtree(snapshot_dir, ignore_errors=True)
+                raise
+        digest_cache.save()
+        return snapshot
+
+    @contextmanager
+    def restoring(self, snapshot_id, tf2_dir, cancel=None):
+        """Yield (plan, manifest) that put tf2_dir back the way the snapshot recorded it.
+
+        The files the plan needs are laid out in a folder next to the snapshot,
+        linked from the blob store or rebuilt from deltas, and removed afterwards.
+        """
+        snapshot = self.get(snapshot_id)
+        if snapshot is None:
+            raise ValueError(f"No snapshot {snapshot_id}")
+        source = os.path.join(self.snapshot_dir(snapshot_id), 'restore')
+        rmtree(source, ignore_errors=True)
+        manifest = {'algorithm': snapshot['algorithm'], 'files': snapshot['files']}
+        created = {'files': {relpath: {} for relpath in snapshot['absent']}}
+        try:
+            plan = plan_apply(source, manifest, tf2_dir, created, cancel)
+            plan.settle()  # Only the files of plan.changes are laid out for the apply
+            for action, relpath, _, _ in plan.changes:
+                if action not in (ADD, REPLACE):
+                    continue
+                check_cancel(cancel)
+                entry = snapshot['files'][relpath]
+                dst = os.path.join(source, relpath)
+                if 'delta' in entry:
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    apply_delta(self.store.blob_path(entry['basis']),
+                                os.path.join(self.snapshot_dir(snapshot_id), 'deltas', entry['delta']), dst, STORE_ALGORITHM)
+                else:
+                    self.store.link_blob(entry['digest'], dst)
+            yield plan, manifest
+        finally:
+            rmtree(source, ignore_errors=True)
+
+    def held_digests(self):
+        """The blobs every snapshot holds a reference to, for BlobStore.collect_garbage()."""
+        return [digest for snapshot in self.list() for digest in _held_digests(snapshot)]
+
+    def delete(self, snapshot_id):
+        with self.store.locked():
+            snapshot = self.get(snapshot_id)
+            if snapshot is not None:
+                self.store.release(_held_digests(snapshot))
+                os.remove(os.path.join(self.snapshot_dir(snapshot_id), SNAPSHOT_FILE))
+        rmtree(self.snapshot_dir(snapshot_id), ignore_errors=True)
+
+    def prune(self, max_age_days=DEFAULT_MAX_AGE_DAYS, max_bytes=DEFAULT_MAX_BYTES, keep=1):
+        """Delete snapshots older than max_age_days, then the oldest ones until the rest fit in max_bytes.
+
+        The newest keep snapshots always stay. Sizes are what each snapshot added
+        when it was taken. Returns the ids of the deleted snapshots.
+        """
+        removed = []
+        total = 0
+        now = time.time()
+        for i, snapshot in enumerate(self.list()):
+            total += snapshot['stored_bytes']
+            if i < keep:
+                continue
+            too_old = max_age_days is not None and now - snapshot['created'] > max_age_days * 86400
+            if too_old or (max_bytes is not None and total > max_bytes):
+                self.delete(snapshot['id'])
+                removed.append(snapshot['id'])
+                total -= snapshot['stored_bytes']
+        return removed
@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+TRACE_VERSION = 1
+TRACE_PREFIX = "trace-"
+MAX_TRACES = 200
+MAX_EVENTS = 1000
+
+# Tunable from config.ini through configure(); traces are only written when trace_dir is set
+settings = {
+    'level': WARNING,
+    'trace_dir': None,
+}
+
+def configure(level=None, trace_dir=None):
+    if level is not None:
+        if isinstance(level, str):
+            if level.lower() not in LEVELS:
+                raise ValueError(f"Unknown log level: {level}")
+            level = LEVELS[level.lower()]
+        settings['level'] = level
+    if trace_dir is not None:
+        settings['trace_dir'] = trace_dir or None
+
+class Trace:
+    """Timed spans, counters and log events of one operation.
+
+    Counters are what the file helpers report through count(): files_stat,
+    files_opened, bytes_read, bytes_written and digest cache hits and misses.
+    """
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started = time.time()
+        self.duration = None
+        self.error = None
+        self.spans = []
+        self.counters = {}
+        self.events = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_span(self, name, start, duration, attrs):
+        with self._lock:
+            self.spans.append({'name': name, 'start': start - self._start, 'duration': duration,
+                               'thread': threading.current_thread().name, 'attrs': attrs})
+
+    def event(self, level, message):
+        with self._lock:
+            if len(self.events) < MAX_EVENTS:
+                self.events.append({'time': time.perf_counter() - self._start, 'level': LEVEL_NAMES[level], 'message': message})
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def totals(self):
+        """Time and count per span name; nested spans are included in their parents' time too."""
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span['name'], {'count': 0, 'duration': 0.0})
+            total['count'] += 1
+            total['duration'] += span['duration']
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'version': TRACE_VERSION, 'name': self.name, 'attrs': self.attrs,
+                'started': self.started, 'duration': self.duration, 'error': self.error,
+                'counters': dict(self.counters), 'totals': self.totals(),
+                'spans': list(self.spans), 'events': list(self.events),
+            }
+
+    def save(self, folder):
+        """Write the trace to folder as JSON, keeping only the newest MAX_TRACES there."""
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', self.name).strip('_').lower() or 'operation'
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        path = os.path.join(folder, f"{TRACE_PREFIX}{stamp}-{int(self.started * 1000) % 1000:03}-{slug}.json")
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=1, default=str)
+            traces = sorted(name for name in os.listdir(folder) if name.startswith(TRACE_PREFIX))
+            for name in traces[:-MAX_TRACES]:
+                os.remove(os.path.join(folder, name))
+        except OSError:
+            return None
+        return path
+
+_local = threading.local()
+
+def current():
+    return getattr(_local, 'trace', None)
+
+def bind(trace):
+    """Make trace the current one on this thread and return the previous one.
+
+    Also a ThreadPoolExecutor initializer: initializer=bind, initargs=(current(),)
+    lets a pool's threads report into the trace of the thread that started it.
+    """
+    previous = current()
+    _local.trace = trace
+    return previous
+
+@contextmanager
+def traced(trace):
+    """Record everything this thread does inside into trace, then finish it."""
+    previous = bind(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        bind(previous)
+        trace.finish()
+
+@contextmanager
+def operation(name, **attrs):
+    """Trace one top-level operation to trace_dir when tracing is enabled.
+
+    An operation started inside another one is part of the outer trace.
+    """
+    if settings['trace_dir'] is None or current() is not None:
+        yield current()
+        return
+    trace = Trace(name, attrs)
+    try:
+        with traced(trace):
+            yield trace
+    finally:
+        trace.save(settings['trace_dir'])
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a span of the current trace; free when nothing is traced."""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start, attrs)
+
+def timed(name):
+    """Decorator running the whole function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    trace = current()
+    if trace is not None:
+        trace.count(name, n)
+
+def log(level, message, *args):
+    """Write a message to stderr and the current trace if level is enabled; args are %-formatted only then."""
+    if level < settings['level']:
+        return
+    if args:
+        message = message % args
+    stream = sys.stderr
+    if stream is not None:  # None in the windowed build
+        stream.write(f"[{LEVEL_NAMES[level]}] {message}\n")
+    trace = current()
+    if trace is not None:
+        trace.event(level, message)
+
+def debug(message, *args):
+    log(DEBUG, message, *args)
+
+def info(message, *args):
+    log(INFO, message, *args)
+
+def warning(message, *args):
+    log(WARNING, message, *args)
+
+def error(message, *args):
+    log(ERROR, message, *args)
@@ -0,0 +1,125 @@
+import os
+import mmap
+import struct
+import hashlib
+from collections import namedtuple
+from hashcache import digest_cache
+import tracing
+
+# Valve pack files, v1 and v2. Only the directory tree at the start of a .vpk
+# is read: it lists every entry with its size and CRC32, which is enough to
+# tell whether two packs hold the same entries without reading their data.
+
+SIGNATURE = 0x55AA1234
+VPK_EXTENSION = ".vpk"
+# Digest-cache "algorithm" under which tree digests are kept next to content digests
+TREE_ALGORITHM = 'vpk-tree'
+
+_HEADER_V1 = struct.Struct('<III')  # signature, version, tree size
+_HEADER_V2 = struct.Struct('<IIIIIII')  # + file data, archive MD5, other MD5 and signature section sizes
+_ENTRY = struct.Struct('<IHHIIH')  # CRC32, preload bytes, archive index, offset, length, terminator
+_TERMINATOR = 0xFFFF
+
+# size is the whole entry (preload + archived bytes)
+VpkEntry = namedtuple('VpkEntry', 'crc size archive offset length')
+VpkDirectory = namedtuple('VpkDirectory', 'version header_size tree_size entries')
+
+def is_vpk(relpath):
+    return relpath.lower().endswith(VPK_EXTENSION)
+
+def _cstring(mm, pos, end):
+    i = mm.find(b'\0', pos, end)
+    if i < 0:
+        raise ValueError("VPK directory tree is truncated")
+    return mm[pos:i].decode('utf-8', errors='replace'), i + 1
+
+def read_directory(path):
+    """Parse the directory tree of a VPK v1/v2 file; raises ValueError for anything else.
+
+    The file is mmapped, so only the pages holding the tree are read,
+    however big the archive is.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER_V1.size:
+            raise ValueError(f"{path} is not a VPK file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            signature, version, tree_size = _HEADER_V1.unpack_from(mm, 0)
+            if signature != SIGNATURE or version not in (1, 2):
+                raise ValueError(f"{path} is not a VPK v1/v2 file")
+            header_size = _HEADER_V1.size if version == 1 else _HEADER_V2.size
+            end = header_size + tree_size
+            if end > size:
+                raise ValueError(f"{path} is truncated")
+            entries = {}
+            pos = header_size
+            # Three nested levels of null-terminated strings, each ended by an empty one:
+            # extension, then folder, then file name followed by its entry
+            while True:
+                ext, pos = _cstring(mm, pos, end)
+                if not ext:
+                    break
+                while True:
+                    folder, pos = _cstring(mm, pos, end)
+                    if not folder:
+                        break
+                    while True:
+                        name, pos = _cstring(mm, pos, end)
+                        if not name:
+                            break
+                        if pos + _ENTRY.size > end:
+                            raise ValueError(f"{path} is truncated")
+                        crc, preload, archive, offset, length, terminator = _ENTRY.unpack_from(mm, pos)
+                        if terminator != _TERMINATOR:
+                            raise ValueError(f"{path} has a corrupt directory entry")
+                        pos += _ENTRY.size + preload
+                        entry_path = (f"{folder}/" if folder != ' ' else '') + name + (f".{ext}" if ext != ' ' else '')
+                        entries[entry_path.lower()] = VpkEntry(crc, preload + length, archive, offset, length)
+    tracing.count('vpk_trees_read')
+    tracing.count('bytes_read', end)
+    return VpkDirectory(version, header_size, tree_size, entries)
+
+def tree_digest(path):
+    """Digest of a VPK's entry names, sizes and CRCs, or None if path is not a readable VPK directory.
+
+    Two packs with the same tree digest hold the same entries with the same
+    content as far as their CRC32s tell, whatever order or chunk they are stored in.
+    """
+    try:
+        directory = read_directory(path)
+    except (OSError, ValueError):
+        return None
+    h = hashlib.sha256()
+    for entry_path, entry in sorted(directory.entries.items()):
+        h.update(f"{entry_path}\0{entry.crc:08x}\0{entry.size}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def cached_tree_digest(path, st=None):
+    """tree_digest() through the digest cache, so an unchanged pack is not even opened."""
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return None
+    digest = digest_cache.lookup(path, st, TREE_ALGORITHM)
+    if digest is None:
+        digest = tree_digest(path)
+        if digest is not None:
+            digest_cache.remember(path, st, TREE_ALGORITHM, digest)
+    return digest
+
+def same_vpk(path_a, path_b):
+    """True or False when both files are VPKs whose trees can be compared, otherwise None."""
+    digest_a = cached_tree_digest(path_a)
+    digest_b = cached_tree_digest(path_b) if digest_a is not None else None
+    if digest_b is None:
+        return None
+    return digest_a == digest_b
+
+def diff_directories(old_path, new_path):
+    """(added, removed, changed) entry paths going from one VPK to another; raises ValueError if either is not one."""
+    old = read_directory(old_path).entries
+    new = read_directory(new_path).entries
+    added = sorted(new.keys() - old.keys())
+    removed = sorted(old.keys() - new.keys())
+    changed = sorted(p for p in old.keys() & new.keys() if (old[p].crc, old[p].size) != (new[p].crc, new[p].size))
+    return added, removed, changed
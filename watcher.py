@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+import threading
+
+WATCHED_FOLDERS = ('cfg', 'custom')
+DEBOUNCE_SECONDS = 0.5
+SCAN_INTERVAL = 2.0
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+TREE_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def stat_snapshot(tf2_dir, ignored=()):
+    """Collect (size, mtime_ns) for every file under tf/cfg and tf/custom without reading them."""
+    snapshot = {}
+    for folder in WATCHED_FOLDERS:
+        stack = [os.path.join(tf2_dir, folder)]
+        while stack:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name not in ignored:
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            snapshot[os.path.relpath(entry.path, tf2_dir)] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+    return snapshot
+
+class _BaseWatcher:
+    def __init__(self, tf2_dir, ignored=()):
+        self.tf2_dir = tf2_dir
+        self.ignored = set(ignored)
+        self._changed = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def poll_changed(self):
+        """Return True once for every settled burst of relevant changes."""
+        if self._changed.is_set():
+            self._changed.clear()
+            return True
+        return False
+
+class PollingWatcher(_BaseWatcher):
+    """Fallback watcher that compares cheap stat snapshots instead of hashing contents."""
+    def __init__(self, tf2_dir, ignored=(), interval=SCAN_INTERVAL):
+        super().__init__(tf2_dir, ignored)
+        self.interval = interval
+
+    def _run(self):
+        last = stat_snapshot(self.tf2_dir, self.ignored)
+        while not self._stop_event.wait(self.interval):
+            current = stat_snapshot(self.tf2_dir, self.ignored)
+            if current != last:
+                last = current
+                self._changed.set()
+
+class InotifyWatcher(_BaseWatcher):
+    """Recursive inotify watcher for tf/cfg and tf/custom with debounced notifications.
+
+    Only the tf folder itself is watched on construction; the subfolders are
+    added on the watcher thread, so startup does not wait on walking a large
+    custom folder. If that fails, e.g. on hitting max_user_watches, the
+    thread falls back to stat polling.
+    """
+    def __init__(self, tf2_dir, ignored=(), debounce=DEBOUNCE_SECONDS):
+        super().__init__(tf2_dir, ignored)
+        self.debounce = debounce
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wd_paths = {}
+        try:
+            self._root_wd = self._add_watch(tf2_dir, ROOT_MASK, strict=True)
+        except OSError:
+            self._close()
+            raise
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _add_watch(self, path, mask, strict=False):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            if strict:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+            return None
+        self._wd_paths[wd] = path
+        return wd
+
+    def _add_tree(self, path, strict=False):
+        if not os.path.isdir(path):
+            return
+        self._add_watch(path, TREE_MASK, strict)
+        for root, dirs, _ in os.walk(path):
+            for d in dirs:
+                self._add_watch(os.path.join(root, d), TREE_MASK, strict)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                relevant = True
+                continue
+            if mask & IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                continue
+            parent = self._wd_paths.get(wd)
+            if parent is None:
+                continue
+            if wd == self._root_wd:
+                # Only cfg/custom themselves being created, moved or removed matter here
+                if name in WATCHED_FOLDERS:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._add_tree(os.path.join(parent, name))
+                    relevant = True
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(os.path.join(parent, name))
+                relevant = True
+            elif name not in self.ignored:
+                relevant = True
+        return relevant
+
+    def _run(self):
+        try:
+            for folder in WATCHED_FOLDERS:
+                self._add_tree(os.path.join(self.tf2_dir, folder), strict=True)
+        except OSError:
+            self._close()
+            self.interval = SCAN_INTERVAL
+            PollingWatcher._run(self)
+            return
+        pending = False
+        last_event = 0.0
+        try:
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([self._fd], [], [], self.debounce if pending else 0.5)
+                if ready and self._read_events():
+                    pending = True
+                    last_event = time.monotonic()
+                elif pending and time.monotonic() - last_event >= self.debounce:
+                    pending = False
+                    self._changed.set()
+        finally:
+            self._close()
+
+    def stop(self):
+        super().stop()
+        if self._thread is None:
+            self._close()
+
+def create_watcher(tf2_dir, ignored=()):
+    """Use inotify where available, otherwise fall back to stat-only polling."""
+    try:
+        return InotifyWatcher(tf2_dir, ignored)
+    except OSError:
+        return PollingWatcher(tf2_dir, ignored)
@@ -0,0 +1,78 @@
+import queue
+import threading
+import tracing
+
+class Cancelled(Exception):
+    """Raised inside a background job once a newer request has replaced it."""
+
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+class BackgroundWorker:
+    """Run slow work on a thread pool and hand results back to Tk through a queue.
+
+    Jobs are submitted under a key; submitting again under the same key cancels
+    the older job, and its result is dropped even if it was already running.
+    """
+    def __init__(self, widget, max_workers=2, interval=50):
+        # Imported here so the headless CLI does not pay for concurrent.futures (and logging) at startup
+        from concurrent.futures import ThreadPoolExecutor
+        self.widget = widget
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tf2cm-worker")
+        self._results = queue.Queue()
+        self._jobs = {}
+        self._after_id = None
+
+    def submit(self, key, fn, args, on_done, on_error=None):
+        """Run fn(cancel, *args) in the background and call on_done(result) on the Tk thread."""
+        self.cancel(key)
+        cancel = threading.Event()
+        future = self._executor.submit(self._run, key, cancel, fn, args)
+        self._jobs[key] = (future, cancel, on_done, on_error)
+        if self._after_id is None:
+            self._after_id = self.widget.after(self.interval, self._drain)
+
+    def cancel(self, key):
+        job = self._jobs.pop(key, None)
+        if job:
+            job[0].cancel()
+            job[1].set()
+
+    def _run(self, key, cancel, fn, args):
+        try:
+            with tracing.operation(key):
+                result = fn(cancel, *args)
+            self._results.put((key, cancel, result, None))
+        except Cancelled:
+            pass
+        except Exception as e:
+            self._results.put((key, cancel, None, e))
+
+    def _drain(self):
+        self._after_id = None
+        while True:
+            try:
+                key, cancel, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            job = self._jobs.get(key)
+            if job is None or job[1] is not cancel:
+                continue  # Stale result from a replaced request
+            del self._jobs[key]
+            _, _, on_done, on_error = job
+            if error is None:
+                on_done(result)
+            elif on_error:
+                on_error(error)
+        if self._jobs:
+            self._after_id = self.widget.after(self.interval, self._drain)
+
+    def shutdown(self):
+        for key in list(self._jobs):
+            self.cancel(key)
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)